@@ -0,0 +1,431 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import activity_retriever
+from activity_retriever import COLLECTION_NAME, SOURCE_TABLE, build_activity_document, is_indexable_record
+from activity_log_writer import DATABASE_FILE
+from index_watermark import IndexWatermarkStore, index_watermarks
+
+INDEX_BATCH_SIZE = 64            # 每批嵌入并写入ChromaDB的最大记录数
+INDEX_MAX_ATTEMPTS = 5           # 单条记录最多尝试次数，超过后保留在队列中但不再自动重试
+INDEX_RETRY_BASE_DELAY = 2.0     # 重试退避的基础间隔（秒），按 2^attempts 增长
+INDEX_RETRY_MAX_DELAY = 300.0    # 重试退避的最长间隔（秒）
+INDEX_POLL_INTERVAL = 5.0        # 无新记录通知时检查到期重试的间隔（秒）
+INDEX_BACKLOG_WARNING = 5000     # 积压超过该值时输出告警
+RECONCILE_RANGE_SIZE = 1000      # 对账时每个ID区间的大小
+INDEX_CLAIM_LEASE = 120.0        # 取出的记录在该时间内不会被其他进程重复处理（秒）
+CATCH_UP_INTERVAL = 30.0         # 查询服务进程补登记水位线之上记录的间隔（秒）
+CATCH_UP_MAX_ROWS = 10000        # 每轮补登记的最大记录数
+
+
+class ActivityIndexer:
+    """activity_log 的后台批量向量索引器
+
+    写入服务在插入记录的同一事务中把 source_db_id 登记到 vector_index_queue 表，
+    队列随记录一起持久化，进程崩溃或ChromaDB不可用时不会丢失待索引记录。
+    后台线程按批取出到期的记录，一次 upsert 完成嵌入和写入，成功后出队；
+    失败的记录按指数退避重试。采集线程只多写一行队列记录，不再等待嵌入模型。
+    出队与索引水位线的推进在同一个SQLite事务中提交。
+    """
+
+    def __init__(self, db_file: str = DATABASE_FILE, batch_size: int = INDEX_BATCH_SIZE,
+                 max_attempts: int = INDEX_MAX_ATTEMPTS, poll_interval: float = INDEX_POLL_INTERVAL):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.catch_up_interval = 0.0  # 0 表示只处理写入服务登记的记录
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue_ready = False
+        self.watermarks = index_watermarks if db_file == index_watermarks.db_file else IndexWatermarkStore(db_file)
+
+        # 统计信息
+        self.indexed = 0
+        self.skipped = 0
+        self.retried = 0
+        self.batches = 0
+        self._last_backlog_warning = 0.0
+        self.last_batch_seconds = 0.0
+        self._lag_samples: Deque[float] = deque(maxlen=500)  # 入队 -> 写入ChromaDB（秒）
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def init_queue(self):
+        """创建持久化索引队列表"""
+        if self._queue_ready:
+            return
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS vector_index_queue (
+                    source_db_id INTEGER PRIMARY KEY,
+                    enqueued_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_vector_index_queue_due '
+                         'ON vector_index_queue(next_attempt_at, source_db_id)')
+            conn.commit()
+            self.watermarks.init_table(conn)
+            self._queue_ready = True
+        finally:
+            conn.close()
+
+    def attach(self, writer):
+        """挂到 activity_log 写入服务：事务内入队，提交后唤醒后台线程"""
+        self.init_queue()
+        writer.add_transaction_hook(self.enqueue_in_transaction)
+        writer.add_commit_hook(self.notify)
+
+    def enqueue_in_transaction(self, conn: sqlite3.Connection, records: List[Dict[str, Any]]):
+        """写入服务的事务钩子，只登记需要索引的记录ID；被延长时间跨度的记录重新登记以更新结束时间"""
+        now = time.time()
+        rows = [(record['id'], now) for record in records
+                if record.get('span_update') or is_indexable_record(record)]
+        if rows:
+            conn.executemany('INSERT OR REPLACE INTO vector_index_queue (source_db_id, enqueued_at) '
+                             'VALUES (?, ?)', rows)
+
+    def enqueue(self, source_db_ids: Iterable[int]) -> int:
+        """在写入服务之外补登记待索引的记录ID（如重建索引），返回登记数量"""
+        self.init_queue()
+        now = time.time()
+        rows = [(int(source_db_id), now) for source_db_id in source_db_ids]
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany('INSERT OR REPLACE INTO vector_index_queue (source_db_id, enqueued_at) '
+                             'VALUES (?, ?)', rows)
+            conn.commit()
+        finally:
+            conn.close()
+        self.notify()
+        return len(rows)
+
+    def start(self, catch_up_interval: float = CATCH_UP_INTERVAL):
+        """启动后台线程，并定期把水位线之上尚未登记的记录补登记到队列
+
+        供不负责采集的进程（活动查询界面、RAG服务）使用：其他进程写入但未入队的记录、
+        升级前的历史记录都会被持续追上，查询路径不再同步建立索引。
+        """
+        self.init_queue()
+        self.catch_up_interval = catch_up_interval
+        self._ensure_started()
+        self._wakeup.set()
+
+    def notify(self, record: Optional[Dict[str, Any]] = None):
+        """有新记录提交时唤醒后台线程（也用作写入服务的提交后钩子）"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="activity-indexer", daemon=True)
+                    self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        logging.info("后台向量索引线程已启动")
+        next_catch_up = 0.0
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                if self.catch_up_interval and time.monotonic() >= next_catch_up:
+                    next_catch_up = time.monotonic() + self.catch_up_interval
+                    self._catch_up()
+                processed = self._process_batch()
+            except Exception as e:
+                logging.error(f"后台向量索引批次失败: {e}", exc_info=True)
+                processed = 0
+            # 队列中还有满批记录时立即继续，积压越多批次越满
+            if processed < self.batch_size:
+                self._wakeup.wait(timeout=self.poll_interval)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _catch_up(self) -> int:
+        """把水位线之上、尚未入队的可索引记录补登记到队列，返回登记数量"""
+        conn = self._connection()
+        try:
+            # 水位线在同一语句中读取，与其他进程的出队+推进水位线事务保持一致
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO vector_index_queue (source_db_id, enqueued_at)
+                SELECT id, ? FROM activity_log
+                WHERE id > COALESCE((SELECT last_indexed_id FROM index_watermarks
+                                     WHERE source_table = ? AND collection = ?), 0)
+                  AND ((ocr_text IS NOT NULL AND ocr_text != '') OR record_type = 'app_switch')
+                ORDER BY id
+                LIMIT ?
+            ''', (time.time(), SOURCE_TABLE, COLLECTION_NAME, CATCH_UP_MAX_ROWS))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        added = max(cursor.rowcount, 0)
+        if added:
+            logging.info(f"补登记 {added} 条未索引记录")
+        return added
+
+    def _claim_batch(self, conn: sqlite3.Connection) -> List[sqlite3.Row]:
+        """取出一批到期记录并延后其下次处理时间，多个进程共用队列时不会重复嵌入"""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute('''
+                SELECT q.source_db_id, q.enqueued_at, q.attempts,
+                       a.id, a.timestamp, a.record_type, a.window_title, a.app_name,
+                       a.page_title, a.url, a.ocr_text, a.end_timestamp
+                FROM vector_index_queue q
+                LEFT JOIN activity_log a ON a.id = q.source_db_id
+                WHERE q.attempts < ? AND q.next_attempt_at <= ?
+                ORDER BY q.source_db_id
+                LIMIT ?
+            ''', (self.max_attempts, now, self.batch_size)).fetchall()
+            conn.executemany('UPDATE vector_index_queue SET next_attempt_at = ? WHERE source_db_id = ?',
+                             [(now + INDEX_CLAIM_LEASE, row['source_db_id']) for row in rows])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return rows
+
+    def _process_batch(self) -> int:
+        """处理一批到期的队列记录，返回本批取出的数量"""
+        collection = activity_retriever.collection
+        if collection is None:
+            # ChromaDB不可用时记录留在队列中，不消耗重试次数
+            return 0
+
+        conn = self._connection()
+        rows = self._claim_batch(conn)
+        if not rows:
+            return 0
+
+        started = time.monotonic()
+        done: List[Tuple[int, float]] = []
+        pending = []
+        for row in rows:
+            document = build_activity_document(dict(row)) if row['id'] is not None else None
+            if document is None:
+                # 原记录已删除或内容为空，直接出队
+                self.skipped += 1
+                done.append((row['source_db_id'], row['enqueued_at']))
+                continue
+            pending.append((row, document))
+
+        failed: List[Tuple[Any, str]] = []
+        if pending:
+            try:
+                self._upsert(collection, pending)
+                self.indexed += len(pending)
+                done.extend((row['source_db_id'], row['enqueued_at']) for row, _ in pending)
+            except Exception as e:
+                if len(pending) == 1:
+                    failed.append((pending[0][0], str(e)))
+                else:
+                    # 逐条重试，找出导致整批失败的记录
+                    logging.warning(f"批量写入ChromaDB失败，逐条重试 {len(pending)} 条: {e}")
+                    for item in pending:
+                        try:
+                            self._upsert(collection, [item])
+                            self.indexed += 1
+                            done.append((item[0]['source_db_id'], item[0]['enqueued_at']))
+                        except Exception as single_error:
+                            failed.append((item[0], str(single_error)))
+
+        self._finish(conn, done, failed)
+        self.batches += 1
+        self.last_batch_seconds = time.monotonic() - started
+        logging.info(f"后台向量索引: 写入 {len(done)} 条, 失败 {len(failed)} 条, "
+                     f"耗时 {self.last_batch_seconds:.2f} 秒")
+        if len(rows) >= self.batch_size:
+            self._check_backlog(conn)
+        return len(rows)
+
+    def _check_backlog(self, conn: sqlite3.Connection):
+        """满批时检查积压，超过阈值每分钟最多告警一次"""
+        if time.monotonic() - self._last_backlog_warning < 60:
+            return
+        backlog = conn.execute('SELECT COUNT(*) FROM vector_index_queue WHERE attempts < ?',
+                               (self.max_attempts,)).fetchone()[0]
+        if backlog > INDEX_BACKLOG_WARNING:
+            self._last_backlog_warning = time.monotonic()
+            logging.warning(f"向量索引积压 {backlog} 条，嵌入速度跟不上采集速度")
+
+    @staticmethod
+    def _upsert(collection, items):
+        # upsert 对同一ID重复写入是幂等的，重试和重复入队都不会报错
+        collection.upsert(
+            documents=[document for _, (document, _) in items],
+            metadatas=[metadata for _, (_, metadata) in items],
+            ids=[f"record_{row['source_db_id']}" for row, _ in items]
+        )
+
+    def _finish(self, conn: sqlite3.Connection, done: List[Tuple[int, float]], failed: List[Tuple[Any, str]]):
+        now = time.time()
+        retry_rows = []
+        for row, error in failed:
+            attempts = row['attempts'] + 1
+            delay = min(INDEX_RETRY_MAX_DELAY, INDEX_RETRY_BASE_DELAY * (2 ** attempts))
+            retry_rows.append((attempts, now + delay, error[:500], row['source_db_id']))
+            if attempts >= self.max_attempts:
+                logging.error(f"记录ID {row['source_db_id']} 索引失败 {attempts} 次，停止自动重试: {error}")
+            else:
+                self.retried += 1
+        try:
+            conn.executemany('DELETE FROM vector_index_queue WHERE source_db_id = ? AND enqueued_at = ?', done)
+            conn.executemany('UPDATE vector_index_queue SET attempts = ?, next_attempt_at = ?, last_error = ? '
+                             'WHERE source_db_id = ?', retry_rows)
+            if done:
+                self.watermarks.advance(SOURCE_TABLE, COLLECTION_NAME,
+                                         max(source_db_id for source_db_id, _ in done), conn=conn)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        for _, enqueued_at in done:
+            self._lag_samples.append(now - enqueued_at)
+
+    def requeue_failed(self) -> int:
+        """把超过重试次数的记录重新放回队列，返回数量"""
+        self.init_queue()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('UPDATE vector_index_queue SET attempts = 0, next_attempt_at = 0 '
+                                  'WHERE attempts >= ?', (self.max_attempts,))
+            conn.commit()
+            count = cursor.rowcount
+        finally:
+            conn.close()
+        if count:
+            self.notify()
+        return count
+
+    def reconcile(self, start_id: int = 0, end_id: Optional[int] = None,
+                  range_size: int = RECONCILE_RANGE_SIZE) -> Dict[str, int]:
+        """按ID区间检查 (start_id, end_id] 内漏索引的记录，补登记到索引队列
+
+        每个区间只从SQLite取出需要索引的ID，再用这些ID向ChromaDB查询是否存在
+        （include=[] 只返回ID），内存占用只与区间大小有关。end_id 默认为当前水位线。
+        """
+        result = {"ranges": 0, "checked": 0, "missing": 0}
+        collection = activity_retriever.collection
+        if collection is None:
+            logging.error("ChromaDB集合未初始化，无法对账")
+            return result
+        self.init_queue()
+        if end_id is None:
+            end_id = self.watermarks.get(SOURCE_TABLE, COLLECTION_NAME) or 0
+
+        conn = self._connect()
+        try:
+            low = start_id
+            while low < end_id:
+                high = min(low + range_size, end_id)
+                ids = [row[0] for row in conn.execute('''
+                    SELECT id FROM activity_log
+                    WHERE id > ? AND id <= ?
+                      AND ((ocr_text IS NOT NULL AND ocr_text != '') OR record_type = 'app_switch')
+                      AND id NOT IN (SELECT source_db_id FROM vector_index_queue WHERE source_db_id > ? AND source_db_id <= ?)
+                ''', (low, high, low, high))]
+                if ids:
+                    found = collection.get(ids=[f"record_{record_id}" for record_id in ids], include=[])
+                    present = set(found['ids'])
+                    missing = [record_id for record_id in ids if f"record_{record_id}" not in present]
+                    if missing:
+                        logging.warning(f"对账发现ID区间 ({low}, {high}] 漏索引 {len(missing)} 条，已补登记")
+                        self.enqueue(missing)
+                        result["missing"] += len(missing)
+                result["ranges"] += 1
+                result["checked"] += len(ids)
+                low = high
+        finally:
+            conn.close()
+        logging.info(f"向量索引对账完成: {result}")
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        backlog, dead, oldest = 0, 0, None
+        if self._queue_ready:
+            conn = self._connect()
+            try:
+                row = conn.execute('''
+                    SELECT SUM(attempts < ?) AS backlog, SUM(attempts >= ?) AS dead,
+                           MIN(CASE WHEN attempts < ? THEN enqueued_at END) AS oldest
+                    FROM vector_index_queue
+                ''', (self.max_attempts, self.max_attempts, self.max_attempts)).fetchone()
+                backlog, dead, oldest = row['backlog'] or 0, row['dead'] or 0, row['oldest']
+            finally:
+                conn.close()
+
+        samples = sorted(self._lag_samples)
+        return {
+            "indexed": self.indexed,
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "dead": dead,
+            "backlog": backlog,
+            "batches": self.batches,
+            "last_batch_seconds": round(self.last_batch_seconds, 3),
+            # 最早一条待索引记录已等待的时间
+            "lag_seconds": round(time.time() - oldest, 2) if oldest else 0.0,
+            "avg_index_lag_seconds": round(sum(samples) / len(samples), 2) if samples else 0.0,
+            "p95_index_lag_seconds": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else 0.0,
+            "watermarks": self.watermarks.get_all(),
+        }
+
+
+# 全局索引器实例，同一进程内的所有录制器共享
+activity_indexer = ActivityIndexer()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="活动记录向量索引维护工具")
+    parser.add_argument("--reconcile", action="store_true", help="按ID区间检查漏索引的记录并补登记到索引队列")
+    parser.add_argument("--start", type=int, default=0, help="对账起始ID（不含）")
+    parser.add_argument("--end", type=int, default=None, help="对账结束ID（含），默认为当前水位线")
+    parser.add_argument("--requeue-failed", action="store_true", help="把超过重试次数的记录放回队列")
+    parser.add_argument("--drain", action="store_true", help="处理完队列中到期的记录后退出")
+    args = parser.parse_args()
+
+    if args.reconcile:
+        print(f"🔍 对账结果: {activity_indexer.reconcile(args.start, args.end)}")
+    if args.requeue_failed:
+        print(f"🔄 已放回队列: {activity_indexer.requeue_failed()} 条")
+    if args.drain:
+        activity_indexer.init_queue()
+        while activity_indexer._process_batch():
+            pass
+    print(json.dumps(activity_indexer.get_stats(), ensure_ascii=False, indent=2))
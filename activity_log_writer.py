@@ -0,0 +1,249 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 与 screen_capture / activity_retriever 使用同一个数据库文件
+SCREENSHOT_DIR = "screen_recordings"
+DATABASE_FILE = os.path.join(SCREENSHOT_DIR, "activity_log.db")
+
+# activity_log 表可写入的列 (id 自增)
+ACTIVITY_LOG_COLUMNS = [
+    'timestamp', 'record_type', 'triggered_by', 'event_type',
+    'window_title', 'process_name', 'app_name', 'page_title', 'url', 'pid',
+    'from_app', 'to_app', 'to_app_title',
+    'screenshot_path', 'ocr_text', 'visual_elements', 'parser_type',
+    'mouse_x', 'mouse_y', 'button', 'pressed'
+]
+
+BATCH_MAX_RECORDS = 64   # 单个事务最多写入的记录数
+BATCH_MAX_DELAY = 0.02   # 收到第一条记录后等待凑批的最长时间（秒）
+
+_FLUSH = object()  # flush() 使用的占位任务
+
+# extend() 使用的更新语句：延长已有记录的时间跨度并累计被合并的重复次数
+EXTEND_SPAN_SQL = ("UPDATE activity_log SET end_timestamp = ?, duplicate_count = COALESCE(duplicate_count, 0) + 1 "
+                   "WHERE id = ?")
+
+
+class _SpanUpdate:
+    """extend() 放入队列的更新任务"""
+    __slots__ = ("record_id", "end_timestamp")
+
+    def __init__(self, record_id: int, end_timestamp: str):
+        self.record_id = record_id
+        self.end_timestamp = end_timestamp
+
+
+class ActivityLogWriter:
+    """activity_log 表的唯一写入服务
+
+    屏幕截图、鼠标点击和各音频录制器把记录放入队列，由单个写线程按数量或时间凑批，
+    在一个事务中写入并提交；生产者通过 Future 拿到分配的行ID。事务钩子（如登记
+    向量索引队列）在同一事务内随记录一起提交；提交成功后，已注册的提交后钩子在
+    独立线程中逐条执行，不会拖慢写入。近似重复的屏幕内容通过 extend() 延长已有记录的
+    时间跨度，与插入在同一批次中提交；事务钩子会收到带 'span_update' 标记的记录，
+    以便重新登记被延长的记录（如更新向量元数据中的结束时间）。
+    """
+
+    def __init__(self, db_file: str = DATABASE_FILE, max_batch: int = BATCH_MAX_RECORDS,
+                 max_delay: float = BATCH_MAX_DELAY):
+        self.db_file = db_file
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[Tuple[Any, Future, bool]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[Dict[str, Any]], Any]] = []
+        self._transaction_hooks: List[Callable[[sqlite3.Connection, List[Dict[str, Any]]], Any]] = []
+        self._hook_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="activity-log-hooks")
+        self._conn: Optional[sqlite3.Connection] = None
+
+        # 统计信息
+        self.written = 0
+        self.failed = 0
+        self.commits = 0
+        self.extended = 0
+
+    def add_commit_hook(self, hook: Callable[[Dict[str, Any]], Any]):
+        """注册提交后钩子，参数为已带 'id' 的记录；同一函数只注册一次"""
+        with self._lock:
+            if hook not in self._hooks:
+                self._hooks.append(hook)
+
+    def add_transaction_hook(self, hook: Callable[[sqlite3.Connection, List[Dict[str, Any]]], Any]):
+        """注册事务钩子，在批次提交前以 (连接, 已带 'id' 的记录列表) 调用，写入与记录一同提交
+
+        钩子只应执行轻量的SQL；钩子失败只记录日志，不影响记录本身的写入。
+        """
+        with self._lock:
+            if hook not in self._transaction_hooks:
+                self._transaction_hooks.append(hook)
+
+    def submit(self, record: Dict[str, Any], run_hooks: bool = True) -> Future:
+        """放入写入队列，返回在提交后得到行ID的 Future"""
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((record, future, run_hooks))
+        return future
+
+    def write(self, record: Dict[str, Any], run_hooks: bool = True, timeout: float = 30) -> Optional[int]:
+        """同步写入一条记录，返回行ID，失败时返回 None"""
+        try:
+            return self.submit(record, run_hooks).result(timeout=timeout)
+        except Exception as e:
+            logging.error(f"保存记录到数据库失败: {e}. Data: {record}")
+            return None
+
+    def extend(self, record_id: int, end_timestamp: str, run_hooks: bool = True) -> Future:
+        """把记录的 end_timestamp 更新为 end_timestamp 并累加 duplicate_count
+
+        run_hooks 为 True 时以 {'id', 'end_timestamp', 'span_update': True} 调用事务钩子，不触发提交后钩子。
+        """
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((_SpanUpdate(record_id, end_timestamp), future, run_hooks))
+        return future
+
+    def flush(self, timeout: float = 30):
+        """等待此前提交的记录全部写入"""
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((_FLUSH, future, False))
+        future.result(timeout=timeout)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+                    self._thread.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_file, timeout=10)
+            # WAL 让检索/界面的读取不阻塞写线程
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch and batch[-1][0] is not _FLUSH:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        sql = (f"INSERT INTO activity_log ({', '.join(ACTIVITY_LOG_COLUMNS)}) "
+               f"VALUES ({', '.join(['?'] * len(ACTIVITY_LOG_COLUMNS))})")
+        results = []
+        try:
+            conn = self._connection()
+            cursor = conn.cursor()
+            for record, future, run_hooks in batch:
+                if record is _FLUSH:
+                    continue
+                if isinstance(record, _SpanUpdate):
+                    try:
+                        cursor.execute(EXTEND_SPAN_SQL, (record.end_timestamp, record.record_id))
+                        results.append((record, future, run_hooks, record.record_id, None))
+                    except sqlite3.Error as e:
+                        results.append((record, future, run_hooks, None, e))
+                    continue
+                try:
+                    cursor.execute(sql, tuple(record.get(column) for column in ACTIVITY_LOG_COLUMNS))
+                    results.append((record, future, run_hooks, cursor.lastrowid, None))
+                except sqlite3.Error as e:
+                    results.append((record, future, run_hooks, None, e))
+            self._run_transaction_hooks(conn, results)
+            conn.commit()
+            self.commits += 1
+        except Exception as e:
+            logging.error(f"批量写入 activity_log 失败 ({len(batch)} 条): {e}", exc_info=True)
+            try:
+                if self._conn is not None:
+                    self._conn.rollback()
+            except sqlite3.Error:
+                pass
+            results = [(record, future, run_hooks, None, e) for record, future, run_hooks in batch
+                       if record is not _FLUSH]
+
+        committed = []
+        for record, future, run_hooks, record_id, error in results:
+            if isinstance(record, _SpanUpdate):
+                if error is not None:
+                    logging.error(f"延长记录时间跨度失败 (ID: {record.record_id}): {error}")
+                    future.set_exception(error)
+                else:
+                    self.extended += 1
+                    future.set_result(record_id)
+                continue
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+                continue
+            self.written += 1
+            record['id'] = record_id
+            future.set_result(record_id)
+            if run_hooks:
+                committed.append(record)
+        logging.debug(f"activity_log 批量提交 {len(results)} 条记录")
+
+        if committed and self._hooks:
+            self._hook_executor.submit(self._run_hooks, committed)
+
+        for record, future, _ in batch:
+            if record is _FLUSH:
+                future.set_result(None)
+
+    def _run_transaction_hooks(self, conn: sqlite3.Connection, results):
+        records = [{'id': record_id, 'end_timestamp': record.end_timestamp, 'span_update': True}
+                   if isinstance(record, _SpanUpdate) else dict(record, id=record_id)
+                   for record, _, run_hooks, record_id, error in results if run_hooks and error is None]
+        if not records:
+            return
+        for hook in list(self._transaction_hooks):
+            try:
+                conn.execute("SAVEPOINT transaction_hook")
+                hook(conn, records)
+                conn.execute("RELEASE SAVEPOINT transaction_hook")
+            except Exception as e:
+                logging.error(f"activity_log 事务钩子执行失败 ({len(records)} 条): {e}")
+                try:
+                    conn.execute("ROLLBACK TO SAVEPOINT transaction_hook")
+                    conn.execute("RELEASE SAVEPOINT transaction_hook")
+                except sqlite3.Error:
+                    pass
+
+    def _run_hooks(self, records: List[Dict[str, Any]]):
+        for record in records:
+            for hook in list(self._hooks):
+                try:
+                    hook(record)
+                except Exception as e:
+                    logging.error(f"activity_log 提交后钩子执行失败 (ID: {record.get('id')}): {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "written": self.written,
+            "failed": self.failed,
+            "commits": self.commits,
+            "extended": self.extended,
+            "avg_records_per_commit": round(self.written / self.commits, 2) if self.commits else 0.0,
+            "pending": self._queue.qsize(),
+        }
+
+
+# 全局写入服务实例，同一进程内的所有录制器共享
+activity_log_writer = ActivityLogWriter()
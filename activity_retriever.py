@@ -1,11 +1,11 @@
 # activity_retriever.py
 
+import asyncio
 import json
 import os
 import logging
 from datetime import datetime, timedelta
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 # 假设 llm_service.py 和 config.py 在同一项目路径下，并且可以被导入
 from llm_service import LLMService # 如果LLMService封装了调用逻辑
 from config import APIConfig # 主要用于LLMService初始化，如果它需要的话
@@ -21,8 +21,9 @@ import threading
 # ... (保留您现有的ChromaDB和LLM相关导入)
 # 例如:
 import chromadb
-from chromadb.utils import embedding_functions
 from llm_service import get_llm_response 
+from index_watermark import index_watermarks
+from embedding_service import embedding_service
 
 # --- 配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -33,7 +34,14 @@ SCREENSHOT_DIR = "screen_recordings"
 DATABASE_FILE = os.path.join(SCREENSHOT_DIR, "activity_log.db") # <--- 新增：SQLite数据库文件名
 
 CHROMA_DB_PATH = "chroma_db_activity" # 统一数据库目录
-COLLECTION_NAME = "screen_activity"
+# 集合改用共享嵌入服务的 gte-multilingual-base 向量，与旧的默认模型集合维度不同，
+# 因此使用新集合名；新集合没有水位线，后台索引器会从头补齐历史记录
+COLLECTION_NAME = "screen_activity_gte"
+SOURCE_TABLE = "activity_log" # 水位线对应的源表
+
+# 查询时从SQLite补充尚未索引的最新记录
+UNINDEXED_TAIL_LIMIT = 20    # 最多补充的记录数
+UNINDEXED_TAIL_SCAN = 2000   # 最多向前扫描的未索引记录数，索引严重积压时也不会拖慢查询
 
 # 全局变量，用于跟踪已索引的记录，避免重复索引
 # 当从数据库加载时，我们需要一种新的方式来跟踪已索引的ID，例如记录最后索引的ID或时间戳
@@ -46,15 +54,15 @@ indexing_lock = threading.Lock()
 # (保留您现有的ChromaDB初始化逻辑)
 # 例如:
 try:
-    # 使用默认的SentenceTransformer模型
-    default_ef = embedding_functions.DefaultEmbeddingFunction()
+    # 使用共享嵌入服务 (与 rag_server 同一模型，自动凑批、结果缓存)
+    shared_ef = embedding_service.as_chroma()
     
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     
     # 获取或创建集合，并指定嵌入函数
     collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
-        embedding_function=default_ef
+        embedding_function=shared_ef
     )
     logging.info(f"成功连接到ChromaDB并获取/创建集合: {COLLECTION_NAME} at path {CHROMA_DB_PATH}")
 except Exception as e:
@@ -79,23 +87,12 @@ RECORD_DATA_FILE = os.path.join(SCREEN_RECORD_DIR, "screen_activity_log.jsonl")
 
 # ChromaDB 配置
 CHROMA_DB_DIR_ACTIVITY = "chroma_db_activity" # 新的数据库目录，避免与rag_server的冲突
-CHROMA_COLLECTION_NAME_ACTIVITY = "screen_activity"
+CHROMA_COLLECTION_NAME_ACTIVITY = COLLECTION_NAME
 
-# 初始化嵌入模型 (与 rag_server.py 保持一致)
-embeddings = None
+# 嵌入模型 (与 rag_server.py 共用同一个嵌入服务，模型在首次编码时加载)
+embeddings = embedding_service.as_langchain()
 activity_vector_store = None
 
-try:
-    embeddings = HuggingFaceEmbeddings(
-        model_name="Alibaba-NLP/gte-multilingual-base",
-        model_kwargs={'device': 'cpu', 'trust_remote_code': True},
-        encode_kwargs={'normalize_embeddings': True}
-    )
-    logging.info("嵌入模型加载成功。")
-except Exception as e:
-    logging.error(f"嵌入模型加载失败: {e}", exc_info=True)
-    # embeddings 会保持为 None
-
 # 初始化向量存储
 try:
     if embeddings:
@@ -130,6 +127,79 @@ except Exception as e:
     logging.error(f"初始化LLM服务时发生错误: {e}", exc_info=True)
 
 
+def is_indexable_record(record: Dict[str, Any]) -> bool:
+    """只索引包含OCR文本的记录；app_switch 事件的 ocr_text 是生成的描述，同样索引"""
+    return bool(record.get("ocr_text")) or record.get("record_type") == "app_switch"
+
+
+def build_activity_document(record: Dict[str, Any]) -> Optional[tuple]:
+    """
+    把一条 activity_log 记录转换为 (文档文本, 元数据)，文档内容为空时返回 None。
+    单条索引、批量索引和后台索引器共用，保证写入ChromaDB的格式一致。
+    """
+    record_id = record.get("id")
+
+    # 构建文档内容
+    doc_content_parts = []
+    if record.get("app_name") and record["app_name"] != "Unknown":
+        doc_content_parts.append(f"应用: {record['app_name']}")
+    if record.get("window_title") and record["window_title"] != "Unknown":
+        doc_content_parts.append(f"窗口: {record['window_title']}")
+    if record.get("page_title"):
+        doc_content_parts.append(f"页面: {record['page_title']}")
+    if record.get("url"):
+        doc_content_parts.append(f"链接: {record['url']}")
+
+    ocr_text = record.get("ocr_text", "")
+    if ocr_text:
+        doc_content_parts.append(f"内容: {ocr_text}")
+
+    document_text = " | ".join(doc_content_parts)
+    if not document_text.strip():
+        return None
+
+    # 构建元数据
+    original_timestamp_iso = record.get("timestamp")
+    timestamp_unix_float = None
+    if original_timestamp_iso:
+        try:
+            timestamp_unix_float = datetime.fromisoformat(original_timestamp_iso).timestamp()
+        except ValueError:
+            logging.warning(f"无效的ISO时间戳格式 '{original_timestamp_iso}' 对于记录ID {record_id}. 该记录将无法通过精确时间过滤。")
+
+    window_title_value = record.get("window_title")
+
+    temp_metadata = {
+        "timestamp_iso_str": original_timestamp_iso if original_timestamp_iso else "N/A",
+        "record_type": record.get("record_type", "N/A"),
+        "app_name": record.get("app_name", "Unknown"),
+        "window_title_meta": (window_title_value[:200] if isinstance(window_title_value, str) else "N/A"),
+        "url_meta": (record.get("url")[:250] if record.get("url") else "N/A"),
+        "source_db_id": record_id
+    }
+    if timestamp_unix_float is not None:
+        temp_metadata["timestamp_unix_float"] = timestamp_unix_float
+        # 近似重复截图会延长记录的时间跨度，按时间范围检索时用跨度结束时间判断是否重叠
+        end_timestamp_unix_float = timestamp_unix_float
+        if record.get("end_timestamp"):
+            try:
+                end_timestamp_unix_float = max(timestamp_unix_float,
+                                               datetime.fromisoformat(record["end_timestamp"]).timestamp())
+            except ValueError:
+                logging.warning(f"无效的结束时间戳 '{record['end_timestamp']}' 对于记录ID {record_id}，按开始时间处理。")
+        temp_metadata["end_timestamp_unix_float"] = end_timestamp_unix_float
+
+    cleaned_metadata = {}
+    for key, value in temp_metadata.items():
+        if value is None:
+            cleaned_metadata[key] = "N/A"
+        elif not isinstance(value, (str, int, float, bool)):
+            cleaned_metadata[key] = str(value)
+        else:
+            cleaned_metadata[key] = value
+    return document_text, cleaned_metadata
+
+
 def batch_iterator(data: list, batch_size: int):
     """一个简单的迭代器，用于将列表分批。"""
     for i in range(0, len(data), batch_size):
@@ -157,11 +227,16 @@ def load_and_index_activity_data() -> int:
 
         total_indexed_count = 0
         try:
+            # 后台索引器也会推进水位线，每次从持久化存储读取最新值
+            stored_watermark = index_watermarks.get(SOURCE_TABLE, COLLECTION_NAME)
+            if stored_watermark is not None and stored_watermark > last_indexed_id:
+                last_indexed_id = stored_watermark
+
             cursor = conn.cursor()
             query = f"""
                 SELECT id, timestamp, record_type, triggered_by, event_type, 
                        window_title, process_name, app_name, page_title, url,
-                       ocr_text, mouse_x, mouse_y, button
+                       ocr_text, mouse_x, mouse_y, button, end_timestamp
                 FROM activity_log 
                 WHERE id > ? AND ocr_text IS NOT NULL AND ocr_text != ''
                 ORDER BY id ASC 
@@ -189,73 +264,23 @@ def load_and_index_activity_data() -> int:
 
                 for record_row in batch:
                     record_dict = dict(record_row)
-                    
-                    # 构建文档内容
-                    doc_content_parts = []
-                    if record_dict.get("app_name") and record_dict["app_name"] != "Unknown":
-                        doc_content_parts.append(f"应用: {record_dict['app_name']}")
-                    if record_dict.get("window_title") and record_dict["window_title"] != "Unknown":
-                        doc_content_parts.append(f"窗口: {record_dict['window_title']}")
-                    if record_dict.get("page_title"):
-                        doc_content_parts.append(f"页面: {record_dict['page_title']}")
-                    if record_dict.get("url"):
-                        doc_content_parts.append(f"链接: {record_dict['url']}")
-                    
-                    ocr_text = record_dict.get("ocr_text", "")
-                    if ocr_text:
-                         doc_content_parts.append(f"内容: {ocr_text}")
-                    
-                    document_text = " | ".join(doc_content_parts)
-                    
-                    if not document_text.strip():
+                    if record_dict['id'] > max_id_in_batch:
+                        max_id_in_batch = record_dict['id']
+
+                    document = build_activity_document(record_dict)
+                    if document is None:
                         logging.warning(f"记录ID {record_dict['id']} 生成的文档内容为空，跳过索引。")
-                        if record_dict['id'] > max_id_in_batch:
-                            max_id_in_batch = record_dict['id']
                         continue
 
-                    documents_to_add.append(document_text)
-                    
-                    # 构建元数据
-                    original_timestamp_iso = record_dict.get("timestamp")
-                    timestamp_unix_float = None
-                    if original_timestamp_iso:
-                        try:
-                            timestamp_unix_float = datetime.fromisoformat(original_timestamp_iso).timestamp()
-                        except ValueError:
-                            logging.warning(f"无效的ISO时间戳格式 '{original_timestamp_iso}' 对于记录ID {record_dict['id']}. 该记录将无法通过精确时间过滤。")
-                    
-                    window_title_value = record_dict.get("window_title")
-
-                    temp_metadata = {
-                        "timestamp_iso_str": original_timestamp_iso if original_timestamp_iso else "N/A",
-                        "record_type": record_dict.get("record_type", "N/A"),
-                        "app_name": record_dict.get("app_name", "Unknown"),
-                        "window_title_meta": (window_title_value[:200] if isinstance(window_title_value, str) else "N/A"),
-                        "url_meta": (record_dict.get("url")[:250] if record_dict.get("url") else "N/A"),
-                        "source_db_id": record_dict.get("id")
-                    }
-                    if timestamp_unix_float is not None:
-                        temp_metadata["timestamp_unix_float"] = timestamp_unix_float
-                    
-                    cleaned_metadata = {}
-                    for key, value in temp_metadata.items():
-                        if value is None: 
-                            cleaned_metadata[key] = "N/A"
-                        elif not isinstance(value, (str, int, float, bool)):
-                             cleaned_metadata[key] = str(value)
-                        else:
-                            cleaned_metadata[key] = value
-
-                    metadatas_to_add.append(cleaned_metadata)
+                    documents_to_add.append(document[0])
+                    metadatas_to_add.append(document[1])
                     ids_to_add.append(f"record_{record_dict['id']}")
 
-                    if record_dict['id'] > max_id_in_batch:
-                        max_id_in_batch = record_dict['id']
-                
                 if documents_to_add:
                     try:
                         logging.info(f"正在向ChromaDB添加 {len(documents_to_add)} 条记录的批次...")
-                        collection.add(
+                        # upsert 是幂等的：水位线在向量写入之后提交，中途退出时重复写入同一批也不会出错
+                        collection.upsert(
                             documents=documents_to_add,
                             metadatas=metadatas_to_add,
                             ids=ids_to_add
@@ -264,6 +289,7 @@ def load_and_index_activity_data() -> int:
                         total_indexed_count += batch_indexed_count
                         last_indexed_id = max_id_in_batch # 每个成功批次后更新
                         max_id_in_run = max_id_in_batch
+                        index_watermarks.advance(SOURCE_TABLE, COLLECTION_NAME, last_indexed_id)
                         logging.info(f"成功添加批次。当前总共添加 {total_indexed_count} 条记录。Last indexed ID 更新为: {last_indexed_id}")
                     except chromadb.errors.InternalError as e_chroma_internal:
                         if "Batch size" in str(e_chroma_internal):
@@ -288,38 +314,44 @@ def load_and_index_activity_data() -> int:
     finally:
         indexing_lock.release()
 
-# 全局变量 last_indexed_id 的初始化逻辑：
-# 我们需要在程序启动时，从ChromaDB获取已存在的最大 source_db_id，或者从数据库获取最大ID作为起点。
-# 一个简单的方法是，如果ChromaDB是空的，last_indexed_id从0开始。
-# 如果ChromaDB非空，可以查询ChromaDB中已存在的最大 source_db_id (如果之前存储了这个元数据)。
-# 或者，更简单的是，每次启动时都重新索引最近一段时间的数据（比如最近一天），但这可能导致重复。
-# 暂时，我们依赖于程序重启后 last_indexed_id 保持（如果脚本不重启），或者从0开始（如果脚本重启）。
-# 一个更健壮的方法是持久化 last_indexed_id，或者在启动时查询数据库中的最大ID。
-
 def initialize_last_indexed_id():
     """
     在程序启动时初始化 last_indexed_id。
-    从ChromaDB中已存在的记录元数据里恢复。
+    从持久化的水位线读取；只有首次升级、尚无水位线时才分页扫描一次集合元数据并写入水位线。
     """
     global last_indexed_id, collection
+    try:
+        stored_watermark = index_watermarks.get(SOURCE_TABLE, COLLECTION_NAME)
+        if stored_watermark is not None:
+            last_indexed_id = stored_watermark
+            logging.info(f"从索引水位线恢复，初始化 last_indexed_id 为: {last_indexed_id}")
+            return
+    except sqlite3.Error as e:
+        logging.warning(f"读取索引水位线失败: {e}")
+
     if collection:
         try:
-            # 只获取元数据可以更快
-            existing_records = collection.get(include=["metadatas"])
             max_db_id = 0
-            if existing_records and existing_records['metadatas']:
-                for meta in existing_records['metadatas']:
-                    if meta and 'source_db_id' in meta and isinstance(meta['source_db_id'], int):
-                        if meta['source_db_id'] > max_db_id:
-                            max_db_id = meta['source_db_id']
+            page_size = 5000
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+                metadatas = (page or {}).get('metadatas') or []
+                for meta in metadatas:
+                    if meta and isinstance(meta.get('source_db_id'), int) and meta['source_db_id'] > max_db_id:
+                        max_db_id = meta['source_db_id']
+                if len(metadatas) < page_size:
+                    break
+                offset += page_size
             last_indexed_id = max_db_id
-            logging.info(f"从ChromaDB恢复，初始化 last_indexed_id 为: {last_indexed_id}")
+            index_watermarks.advance(SOURCE_TABLE, COLLECTION_NAME, last_indexed_id)
+            logging.info(f"从ChromaDB迁移索引水位线，初始化 last_indexed_id 为: {last_indexed_id}")
             return
         except Exception as e:
             logging.warning(f"从ChromaDB恢复last_indexed_id失败: {e}. 将使用默认值0.")
-    
+
     last_indexed_id = 0
-    logging.info(f"未能从ChromaDB恢复 last_indexed_id，初始化为: {last_indexed_id} (将尝试索引所有记录)")
+    logging.info(f"未能恢复 last_indexed_id，初始化为: {last_indexed_id} (将尝试索引所有记录)")
 
 if collection:
     initialize_last_indexed_id()
@@ -347,66 +379,17 @@ def index_single_activity_record(record_data: Dict[str, Any]) -> bool:
         logging.error(f"index_single_activity_record: 无效或缺失的记录ID ('{record_id}')。无法索引。数据: {record_data}")
         return False # 不进行索引
 
-    ocr_text_content = record_data.get("ocr_text", "")
-
     # 通常我们只索引包含有效OCR文本的记录
-    # 对于 app_switch 事件，其 ocr_text 是生成的描述，也可以被索引
-    if not ocr_text_content and record_data.get("record_type") != "app_switch": # 如果不是app_switch且ocr为空则跳过
-        # 或者根据您的策略决定是否索引ocr_text为空的记录
+    if not is_indexable_record(record_data):
         logging.debug(f"记录ID {record_id} (类型: {record_data.get('record_type')}) OCR文本为空，跳过单条索引。")
         return True # 认为处理完成，但不索引
 
-    # 构建文档内容
-    doc_content_parts = []
-    if record_data.get("app_name") and record_data["app_name"] != "Unknown":
-        doc_content_parts.append(f"应用: {record_data['app_name']}")
-    if record_data.get("window_title") and record_data["window_title"] != "Unknown":
-        doc_content_parts.append(f"窗口: {record_data['window_title']}")
-    if record_data.get("page_title"):
-        doc_content_parts.append(f"页面: {record_data['page_title']}")
-    if record_data.get("url"):
-        doc_content_parts.append(f"链接: {record_data['url']}")
-    
-    if ocr_text_content:
-         doc_content_parts.append(f"内容: {ocr_text_content}")
-    
-    document_text = " | ".join(doc_content_parts)
-
-    if not document_text.strip():
+    document = build_activity_document(record_data)
+    if document is None:
         logging.warning(f"记录ID {record_id} 生成的文档内容为空（单条索引），跳过。")
-        return True 
-
-    # 构建元数据
-    original_timestamp_iso = record_data.get("timestamp")
-    timestamp_unix_float = None
-    if original_timestamp_iso:
-        try:
-            timestamp_unix_float = datetime.fromisoformat(original_timestamp_iso).timestamp()
-        except ValueError:
-            logging.warning(f"index_single_activity_record: 无效的ISO时间戳格式 '{original_timestamp_iso}' 对于记录ID {record_id}.")
-
-    window_title_value = record_data.get("window_title")
-    
-    temp_metadata = {
-        "timestamp_iso_str": original_timestamp_iso if original_timestamp_iso else "N/A",
-        "record_type": record_data.get("record_type", "N/A"),
-        "app_name": record_data.get("app_name", "Unknown"),
-        "window_title_meta": (window_title_value[:200] if isinstance(window_title_value, str) else "N/A"),
-        "url_meta": (record_data.get("url")[:250] if record_data.get("url") else "N/A"),
-        "source_db_id": record_id 
-    }
-    if timestamp_unix_float is not None:
-        temp_metadata["timestamp_unix_float"] = timestamp_unix_float
+        return True
+    document_text, cleaned_metadata = document
 
-    cleaned_metadata = {}
-    for key, value in temp_metadata.items():
-        if value is None:
-            cleaned_metadata[key] = "N/A"
-        elif not isinstance(value, (str, int, float, bool)):
-             cleaned_metadata[key] = str(value)
-        else:
-            cleaned_metadata[key] = value
-    
     chroma_id = f"record_{record_id}" # 确保ID是字符串
 
     try:
@@ -416,6 +399,7 @@ def index_single_activity_record(record_data: Dict[str, Any]) -> bool:
             metadatas=[cleaned_metadata],
             ids=[chroma_id]
         )
+        index_watermarks.advance(SOURCE_TABLE, COLLECTION_NAME, record_id)
         logging.info(f"成功将记录ID {record_id} (Chroma ID: {chroma_id}) 单独索引到ChromaDB。")
         return True
     except Exception as e:
@@ -433,22 +417,81 @@ def index_single_activity_record(record_data: Dict[str, Any]) -> bool:
 
 # --- 其他函数将在这里逐个修改 --- 
 
+def ensure_background_indexing():
+    """启动后台索引线程（只启动一次），由它们持续把新记录索引到ChromaDB和关键词索引"""
+    try:
+        from activity_indexer import activity_indexer
+        activity_indexer.start()
+    except Exception as e:
+        logging.error(f"启动后台向量索引失败: {e}")
+    try:
+        from activity_search_engine import activity_search_engine
+        activity_search_engine.start()
+    except Exception as e:
+        logging.error(f"启动关键词索引同步失败: {e}")
+
+
+def format_context_document(document: tuple, note: str) -> str:
+    """把 build_activity_document 的结果格式化为提供给LLM的一条上下文"""
+    doc_text, metadata = document
+    doc_info_parts = [
+        f"活动记录 (时间: {metadata.get('timestamp_iso_str', '未知')}",
+        f"应用: {metadata.get('app_name', '未知')}",
+        f"类型: {metadata.get('record_type','未知')}"
+    ]
+    url_from_meta = metadata.get('url_meta')
+    if url_from_meta and url_from_meta != "N/A":
+        doc_info_parts.append(f"URL: {url_from_meta}")
+    doc_info_parts.append(f"{note})")
+    return f"{', '.join(doc_info_parts)}:\n{doc_text}\n---"
+
+
+def get_unindexed_tail_records(start_time_dt: datetime, end_time_dt: datetime,
+                               limit: int = UNINDEXED_TAIL_LIMIT) -> List[Dict[str, Any]]:
+    """
+    返回时间范围内ID高于索引水位线、尚未进入向量库的最新记录（按时间倒序）。
+    只扫描水位线之上最近 UNINDEXED_TAIL_SCAN 条记录，代价与索引积压量无关。
+    """
+    try:
+        watermark = index_watermarks.get(SOURCE_TABLE, COLLECTION_NAME) or last_indexed_id
+    except sqlite3.Error as e:
+        logging.warning(f"读取索引水位线失败: {e}")
+        return []
+
+    conn = create_db_connection()
+    if not conn:
+        return []
+    try:
+        max_id = conn.execute("SELECT MAX(id) FROM activity_log").fetchone()[0] or 0
+        rows = conn.execute('''
+            SELECT id, timestamp, record_type, window_title, app_name, page_title, url, ocr_text, end_timestamp
+            FROM activity_log
+            WHERE id > ? AND timestamp <= ? AND COALESCE(end_timestamp, timestamp) >= ?
+              AND ((ocr_text IS NOT NULL AND ocr_text != '') OR record_type = 'app_switch')
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (max(watermark, max_id - UNINDEXED_TAIL_SCAN), end_time_dt.isoformat(),
+              start_time_dt.isoformat(), limit)).fetchall()
+        return [dict(row) for row in rows if build_activity_document(dict(row)) is not None]
+    except sqlite3.Error as e:
+        logging.error(f"查询未索引的最新记录失败: {e}")
+        return []
+    finally:
+        conn.close()
+
+
 async def query_recent_activity(query_text: str, custom_prompt: Optional[str] = None, minutes_ago: Optional[int] = None) -> str:
     """
     根据用户查询（可能包含自然语言时间描述）和自定义提示，
-    查询ChromaDB中的活动记录，并使用LLM生成回答。
+    通过关键词+向量混合检索查询活动记录，并使用LLM生成回答。
     """
     global collection
     if collection is None:
-        return "抱歉，向量数据库未初始化，无法执行语义查询。\n\n💡 提示：您可以通过Web界面的'活动记录'页面查看最近的活动数据，或者联系管理员重新启用向量索引功能。"
+        logging.warning("向量数据库未初始化，本次查询只使用关键词检索。")
 
     try:
-        # 1. 确保数据已索引
-        new_indexed_count = load_and_index_activity_data()
-        if new_indexed_count > 0:
-            logging.info(f"查询前，新索引了 {new_indexed_count} 条记录到ChromaDB。")
-        else:
-            logging.info("查询前，没有新的记录被索引到ChromaDB。")
+        # 1. 索引由后台线程持续追赶，查询只使用已索引的数据，未索引的最新记录从SQLite补充
+        ensure_background_indexing()
 
         # 2. 从用户查询中解析时间范围
         if minutes_ago is not None and isinstance(minutes_ago, int) and minutes_ago > 0 :
@@ -458,50 +501,34 @@ async def query_recent_activity(query_text: str, custom_prompt: Optional[str] =
         else:
             start_time_dt, end_time_dt = parse_time_range_from_query(query_text)
         
-        logging.info(f"用于ChromaDB查询的最终时间范围: 从 {start_time_dt.isoformat()} 到 {end_time_dt.isoformat()}")
-
-        # 3. 构建ChromaDB的 'where' 过滤器
-        where_filter = {
-            "$and": [
-                {"timestamp_unix_float": {"$gte": start_time_dt.timestamp()}},
-                {"timestamp_unix_float": {"$lte": end_time_dt.timestamp()}}
-            ]
-        }
-        
-        logging.info(f"构建的ChromaDB 'where' 过滤器: {where_filter}")
-        
-        # 4. 从ChromaDB检索相关文档
-        results = collection.query(
-            query_texts=[query_text],
-            n_results=30,
-            where=where_filter,
-            include=["documents", "metadatas", "distances"]
-        )
-        
-        retrieved_count = len(results['documents'][0]) if results and results['documents'] and results['documents'][0] else 0
-        logging.info(f"ChromaDB查询在应用时间过滤器后返回了 {retrieved_count} 条文档。")
-        
+        logging.info(f"用于检索的最终时间范围: 从 {start_time_dt.isoformat()} 到 {end_time_dt.isoformat()}")
+
+        # 3. 混合检索：FTS5关键词召回与ChromaDB向量召回按RRF融合，时间范围在两路中分别过滤
+        from activity_search_engine import activity_search_engine
+        hits = await asyncio.to_thread(activity_search_engine.search, query_text, start_time_dt, end_time_dt, 30)
+        logging.info(f"混合检索在应用时间过滤器后返回了 {len(hits)} 条记录。")
+
         retrieved_docs = []
-        if retrieved_count > 0:
-            for i, doc_text in enumerate(results['documents'][0]):
-                metadata = results['metadatas'][0][i] if results['metadatas'] and results['metadatas'][0] else {}
-                distance = results['distances'][0][i] if results['distances'] and results['distances'][0] else float('inf')
-                
-                doc_info_parts = [
-                    f"活动记录 (时间: {metadata.get('timestamp_iso_str', '未知')}",
-                    f"应用: {metadata.get('app_name', '未知')}",
-                    f"类型: {metadata.get('record_type','未知')}"
-                ]
-                url_from_meta = metadata.get('url_meta')
-                if url_from_meta and url_from_meta != "N/A":
-                    doc_info_parts.append(f"URL: {url_from_meta}")
-
-                doc_info_parts.append(f"相关度: {1-distance:.2f})")
-                
-                doc_info_header = ", ".join(doc_info_parts)
-                doc_info = f"{doc_info_header}:\n{doc_text}\n---"
-                retrieved_docs.append(doc_info)
-        
+        retrieved_ids = set()
+        for hit in hits:
+            document = build_activity_document(hit)
+            if document is None:
+                continue
+            sources = []
+            if "keyword_rank" in hit:
+                sources.append("关键词")
+            if "vector_rank" in hit:
+                sources.append(f"语义相关度 {1 - hit['distance']:.2f}")
+            retrieved_docs.append(format_context_document(document, "匹配: " + "+".join(sources)))
+            retrieved_ids.add(hit['id'])
+
+        tail_records = await asyncio.to_thread(get_unindexed_tail_records, start_time_dt, end_time_dt)
+        tail_records = [record for record in tail_records if record['id'] not in retrieved_ids]
+        if tail_records:
+            logging.info(f"从SQLite补充 {len(tail_records)} 条尚未索引的最新记录。")
+        for record in tail_records:
+            retrieved_docs.append(format_context_document(build_activity_document(record), "尚未索引的最新记录"))
+
         if not retrieved_docs:
             return f"根据您的问题并在指定的时间范围（从 {start_time_dt.strftime('%Y-%m-%d %H:%M:%S')} 到 {end_time_dt.strftime('%Y-%m-%d %H:%M:%S')}）内，我没有找到相关的活动记录。"
 
@@ -730,13 +757,15 @@ async def get_application_usage_summary(start_time_dt: datetime, end_time_dt: da
         # 我们需要app_name和timestamp
         # 'mouse_interaction' 通常也发生在某个应用内，但如果只关心应用切换和主要内容，可以先关注前两者
         # 为了更准确，我们应该考虑所有带有 app_name 的记录类型
+        # 时间跨度与查询范围重叠即纳入：近似重复合并后的记录可能开始于范围之前
         query = """
             SELECT timestamp, app_name, record_type, url
             FROM activity_log
-            WHERE timestamp >= ? AND timestamp <= ? AND app_name IS NOT NULL AND app_name != 'Unknown'
+            WHERE timestamp <= ? AND COALESCE(end_timestamp, timestamp) >= ?
+              AND app_name IS NOT NULL AND app_name != 'Unknown'
             ORDER BY timestamp ASC
         """
-        cursor.execute(query, (start_time_iso, end_time_iso))
+        cursor.execute(query, (end_time_iso, start_time_iso))
         events = cursor.fetchall()
         
         # logging.debug(f"获取到 {len(events)} 条事件用于计算 {start_time_iso} 到 {end_time_iso} 之间的应用时长。")
@@ -763,7 +792,8 @@ async def get_application_usage_summary(start_time_dt: datetime, end_time_dt: da
             
             try:
                 # sqlite3.Row['timestamp'] 返回的是字符串，需要解析
-                current_event_time = datetime.fromisoformat(current_event_dict['timestamp'])
+                # 开始于查询范围之前的记录只统计范围内的部分
+                current_event_time = max(datetime.fromisoformat(current_event_dict['timestamp']), start_time_dt)
             except ValueError:
                 logging.warning(f"无法解析事件时间戳: {current_event_dict['timestamp']} for app {current_app}. 跳过此事件对。")
                 continue
@@ -0,0 +1,331 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import activity_retriever
+from activity_retriever import SOURCE_TABLE
+from activity_log_writer import DATABASE_FILE
+from index_watermark import IndexWatermarkStore, index_watermarks
+
+try:
+    import jieba
+    JIEBA_AVAILABLE = True
+except ImportError:
+    JIEBA_AVAILABLE = False
+    logging.warning("jieba 未安装，关键词索引退回到中文二元切分，请运行: pip install jieba")
+
+FTS_TABLE = "activity_fts"
+FTS_COLUMNS = ["app_name", "window_title", "page_title", "url", "ocr_text"]
+FTS_COLUMN_WEIGHTS = (3.0, 2.0, 2.0, 1.0, 1.0)  # bm25 列权重，与 FTS_COLUMNS 对应
+FTS_WATERMARK = "fts:activity_fts"             # 关键词索引在水位线表中的集合名
+
+FTS_SYNC_BATCH_ROWS = 500   # 每个事务写入关键词索引的记录数
+FTS_SYNC_INTERVAL = 5.0     # 后台同步关键词索引的间隔（秒）
+RRF_K = 60                  # 倒数排名融合常数
+CANDIDATE_MULTIPLIER = 3    # 每路召回的候选数 = limit * CANDIDATE_MULTIPLIER
+
+_CJK_RUN = re.compile(r'[一-鿿]+')
+_WORD = re.compile(r'[0-9A-Za-z_]+(?:[.\-+#][0-9A-Za-z_]+)*')
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """把文本切分为关键词；jieba 可用时使用搜索引擎模式，否则英文按单词、中文按二元切分"""
+    if not text:
+        return []
+    text = text.lower()
+    if JIEBA_AVAILABLE:
+        tokens = jieba.cut_for_search(text)
+    else:
+        tokens = _WORD.findall(text)
+        for run in _CJK_RUN.findall(text):
+            tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+    return [token.strip() for token in tokens if token.strip() and re.search(r'\w', token)]
+
+
+def _to_iso(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class ActivitySearchEngine:
+    """activity_log 的混合检索引擎
+
+    关键词召回使用 SQLite FTS5 倒排索引（jieba 预分词后写入，BM25 排序），
+    语义召回使用 ChromaDB 向量相似度，两路结果按倒数排名融合 (RRF) 合并，
+    时间范围在两路召回中分别下推。活动查询界面和RAG问答共用 search()。
+
+    关键词索引按水位线增量同步：后台线程把新记录分词后写入无内容（contentless）
+    FTS表，不重复保存OCR原文；写入与水位线推进在同一事务中提交。
+    """
+
+    def __init__(self, db_file: str = DATABASE_FILE):
+        self.db_file = db_file
+        self.watermarks = index_watermarks if db_file == index_watermarks.db_file else IndexWatermarkStore(db_file)
+        self.fts_available = True
+        self._schema_ready = False
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.synced = 0
+        self.searches = 0
+        self.last_search_ms = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        if self._schema_ready or not self.fts_available:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+                USING fts5({", ".join(FTS_COLUMNS)}, content='', tokenize='unicode61 remove_diacritics 2')
+            ''')
+            conn.commit()
+            self.watermarks.init_table(conn)
+            self._schema_ready = True
+        except sqlite3.OperationalError as e:
+            # 个别 Python 发行版的 SQLite 未编译 FTS5
+            self.fts_available = False
+            logging.error(f"创建FTS5关键词索引失败，混合检索将只使用向量召回: {e}")
+        finally:
+            conn.close()
+
+    # --- 关键词索引同步 ---
+
+    def sync(self, max_rows: int = FTS_SYNC_BATCH_ROWS) -> int:
+        """把水位线之上的记录分词写入关键词索引，返回本次写入数量"""
+        self.init_schema()
+        if not self.fts_available:
+            return 0
+        with self._sync_lock:
+            conn = self._connect()
+            try:
+                watermark = self.watermarks.get(SOURCE_TABLE, FTS_WATERMARK) or 0
+                rows = conn.execute(f'''
+                    SELECT id, {", ".join(FTS_COLUMNS)} FROM activity_log
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (watermark, max_rows)).fetchall()
+                if not rows:
+                    return 0
+
+                # 分词在事务外完成，写锁只在插入期间持有
+                entries = [(row['id'], *(" ".join(tokenize(row[column])) for column in FTS_COLUMNS))
+                           for row in rows]
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    current = self.watermarks.get(SOURCE_TABLE, FTS_WATERMARK, conn=conn) or 0
+                    entries = [entry for entry in entries if entry[0] > current]  # 其他进程已同步的部分跳过
+                    conn.executemany(f'''
+                        INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)})
+                        VALUES (?, {", ".join(["?"] * len(FTS_COLUMNS))})
+                    ''', entries)
+                    if entries:
+                        self.watermarks.advance(SOURCE_TABLE, FTS_WATERMARK, entries[-1][0], conn=conn)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                self.synced += len(entries)
+                return len(entries)
+            finally:
+                conn.close()
+
+    def rebuild(self):
+        """清空关键词索引和水位线，之后的同步从头重新写入
+
+        无内容 FTS 表不会拒绝重复的 rowid，只重置水位线会让每条记录被索引两次、
+        BM25 词频统计失真，所以必须与 'delete-all' 在同一事务中执行。
+        """
+        self.init_schema()
+        if not self.fts_available:
+            return
+        with self._sync_lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('delete-all')")
+                    self.watermarks.reset(FTS_WATERMARK, conn=conn)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+            finally:
+                conn.close()
+        logging.info("关键词索引已清空，将从头重新同步")
+
+    def start(self, interval: float = FTS_SYNC_INTERVAL):
+        """启动后台线程，持续把新记录同步到关键词索引"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sync_loop, args=(interval,),
+                                                name="activity-fts-sync", daemon=True)
+                self._thread.start()
+
+    def _sync_loop(self, interval: float):
+        while True:
+            try:
+                count = self.sync()
+                if count:
+                    logging.info(f"关键词索引同步 {count} 条记录")
+                    if count >= FTS_SYNC_BATCH_ROWS:
+                        continue  # 追赶历史记录时不等待
+            except Exception as e:
+                logging.error(f"同步关键词索引失败: {e}")
+            time.sleep(interval)
+
+    # --- 检索 ---
+
+    def keyword_search(self, query: str, start_time=None, end_time=None, limit: int = 50) -> List[int]:
+        """FTS5 关键词召回，返回按 BM25 排序的记录ID"""
+        self.init_schema()
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not self.fts_available or not tokens:
+            return []
+        # 英文/数字关键词按前缀匹配，兼顾原来子串搜索的习惯（如 git 命中 github）
+        match = " OR ".join('"' + token.replace('"', '""') + '"' + ("*" if token.isascii() else "")
+                            for token in tokens)
+        sql = f'''
+            SELECT a.id FROM {FTS_TABLE} f
+            JOIN activity_log a ON a.id = f.rowid
+            WHERE {FTS_TABLE} MATCH ?
+        '''
+        params: List[Any] = [match]
+        # 记录的时间跨度 [timestamp, end_timestamp] 与查询范围重叠即命中
+        if start_time is not None:
+            sql += ' AND COALESCE(a.end_timestamp, a.timestamp) >= ?'
+            params.append(_to_iso(start_time))
+        if end_time is not None:
+            sql += ' AND a.timestamp <= ?'
+            params.append(_to_iso(end_time))
+        sql += f' ORDER BY bm25({FTS_TABLE}, {", ".join(map(str, FTS_COLUMN_WEIGHTS))}) LIMIT ?'
+        params.append(limit)
+
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute(sql, params)]
+        except sqlite3.Error as e:
+            logging.error(f"关键词检索失败: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def vector_search(self, query: str, start_time=None, end_time=None, limit: int = 50) -> List[Dict[str, Any]]:
+        """ChromaDB 语义召回，返回 [{'id', 'distance'}]，按相似度排序"""
+        collection = activity_retriever.collection
+        if collection is None or not query.strip():
+            return []
+        conditions = []
+        try:
+            if start_time is not None:
+                # 按时间跨度重叠过滤；旧向量没有 end_timestamp_unix_float，靠开始时间条件命中
+                start_epoch = datetime.fromisoformat(_to_iso(start_time)).timestamp()
+                conditions.append({"$or": [{"timestamp_unix_float": {"$gte": start_epoch}},
+                                           {"end_timestamp_unix_float": {"$gte": start_epoch}}]})
+            if end_time is not None:
+                conditions.append({"timestamp_unix_float": {"$lte": datetime.fromisoformat(_to_iso(end_time)).timestamp()}})
+        except ValueError as e:
+            logging.warning(f"无法解析检索时间范围，向量召回不做时间过滤: {e}")
+        where = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else None)
+        try:
+            results = collection.query(query_texts=[query], n_results=limit, where=where,
+                                       include=["metadatas", "distances"])
+        except Exception as e:
+            logging.error(f"向量检索失败: {e}")
+            return []
+        hits = []
+        metadatas = (results.get('metadatas') or [[]])[0]
+        distances = (results.get('distances') or [[]])[0]
+        for metadata, distance in zip(metadatas, distances):
+            source_db_id = (metadata or {}).get('source_db_id')
+            if isinstance(source_db_id, int):
+                hits.append({"id": source_db_id, "distance": distance})
+        return hits
+
+    def search(self, query: str, start_time=None, end_time=None, limit: int = 30,
+               record_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """混合检索：关键词与向量两路召回按 RRF 融合，返回带 score 等字段的 activity_log 记录"""
+        started = time.perf_counter()
+        candidates = max(limit * CANDIDATE_MULTIPLIER, limit)
+        keyword_ids = self.keyword_search(query, start_time, end_time, candidates)
+        vector_hits = self.vector_search(query, start_time, end_time, candidates)
+
+        fused: Dict[int, Dict[str, Any]] = {}
+        for rank, record_id in enumerate(keyword_ids, start=1):
+            entry = fused.setdefault(record_id, {"score": 0.0})
+            entry["score"] += 1.0 / (RRF_K + rank)
+            entry["keyword_rank"] = rank
+        for rank, hit in enumerate(vector_hits, start=1):
+            entry = fused.setdefault(hit["id"], {"score": 0.0})
+            entry["score"] += 1.0 / (RRF_K + rank)
+            entry["vector_rank"] = rank
+            entry["distance"] = hit["distance"]
+
+        ranked = sorted(fused.items(), key=lambda item: item[1]["score"], reverse=True)
+        records = self._load_records([record_id for record_id, _ in ranked], record_types)
+        results = []
+        for record_id, ranking in ranked:
+            record = records.get(record_id)
+            if record is None:
+                continue
+            record.update(ranking)
+            results.append(record)
+            if len(results) >= limit:
+                break
+
+        self.searches += 1
+        self.last_search_ms = (time.perf_counter() - started) * 1000
+        logging.info(f"混合检索 '{query}': 关键词 {len(keyword_ids)} 条, 向量 {len(vector_hits)} 条, "
+                     f"融合后返回 {len(results)} 条, 耗时 {self.last_search_ms:.1f} ms")
+        return results
+
+    def _load_records(self, ids: List[int], record_types: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """按ID批量读取记录"""
+        records: Dict[int, Dict[str, Any]] = {}
+        if not ids:
+            return records
+        conn = self._connect()
+        try:
+            # 分段查询，避免超出 SQLite 参数数量上限
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                sql = f'SELECT * FROM activity_log WHERE id IN ({", ".join(["?"] * len(chunk))})'
+                params: List[Any] = list(chunk)
+                if record_types:
+                    sql += f' AND record_type IN ({", ".join(["?"] * len(record_types))})'
+                    params.extend(record_types)
+                for row in conn.execute(sql, params):
+                    records[row['id']] = dict(row)
+        finally:
+            conn.close()
+        return records
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "fts_available": self.fts_available,
+            "tokenizer": "jieba" if JIEBA_AVAILABLE else "bigram",
+            "fts_watermark": self.watermarks.get(SOURCE_TABLE, FTS_WATERMARK) if self._schema_ready else None,
+            "synced": self.synced,
+            "searches": self.searches,
+            "last_search_ms": round(self.last_search_ms, 2),
+        }
+
+
+# 全局混合检索引擎实例
+activity_search_engine = ActivitySearchEngine()
@@ -11,6 +11,8 @@ from flask_cors import CORS
 import logging
 
 from activity_retriever import query_recent_activity, load_and_index_activity_data, get_all_activity_records, get_application_usage_summary
+from activity_search_engine import activity_search_engine
+from keyword_stats import keyword_stats
 
 # 数据库相关配置
 SCREENSHOT_DIR = "screen_recordings"
@@ -38,16 +40,17 @@ os.makedirs('templates', exist_ok=True)
 # 存储聊天历史
 chat_history = []
 
-# --- 应用启动时加载一次数据 ---
+# --- 应用启动时启动后台索引 ---
 def initial_load_data():
-    print("应用启动：正在后台加载和索引屏幕活动数据...")
+    print("应用启动：正在启动后台索引线程，持续把新的屏幕活动记录索引到向量数据库...")
     try:
         # 这里的导入需要放在函数内部，以确保在子线程中能正确初始化
-        from activity_retriever import load_and_index_activity_data
-        count = load_and_index_activity_data()
-        print(f"应用启动：后台任务完成，加载了 {count} 条新记录。")
+        from activity_retriever import ensure_background_indexing
+        ensure_background_indexing()
+        keyword_stats.start()
+        print("应用启动：后台索引线程已启动，查询不再等待索引完成。")
     except Exception as e:
-        print(f"应用启动：后台加载数据时出错: {e}")
+        print(f"应用启动：启动后台索引时出错: {e}")
 
 # -----------------------------
 
@@ -257,194 +260,22 @@ def get_keywords():
         # 获取时间范围参数
         hours = request.args.get('hours', 24, type=int)  # 默认24小时
 
-        # 根据时间范围动态调整获取记录数量
-        if hours <= 6:
-            limit = 500   # 6小时内获取500条
-        elif hours <= 12:
-            limit = 1000  # 12小时内获取1000条
-        elif hours <= 24:
-            limit = 2000  # 24小时内获取2000条
-        elif hours <= 48:
-            limit = 3000  # 48小时内获取3000条
-        else:
-            limit = 5000  # 7天获取5000条
-
-        # 计算时间范围
-        import re
-        from collections import Counter
-        from datetime import datetime, timedelta
-        import sqlite3
-
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        cutoff_time_iso = cutoff_time.isoformat()
-
-        # 直接从数据库按时间范围获取记录
-        conn = create_connection(DATABASE_FILE)
-        if not conn:
-            return jsonify({'error': '无法连接到数据库'}), 500
-
-        records = []
-        try:
-            cursor = conn.cursor()
-            # 查询指定时间范围内的记录，按时间戳降序排序
-            query = """
-                SELECT timestamp, app_name, window_title, page_title, ocr_text, url
-                FROM activity_log
-                WHERE timestamp >= ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            """
-            cursor.execute(query, (cutoff_time_iso, limit))
-            rows = cursor.fetchall()
-
-            # 转换为字典格式
-            columns = ['timestamp', 'app_name', 'window_title', 'page_title', 'ocr_text', 'url']
-            for row in rows:
-                record = {}
-                for i, column in enumerate(columns):
-                    record[column] = row[i]
-                records.append(record)
-
-            logging.info(f"从数据库获取了 {len(records)} 条记录 (时间范围: {hours}小时, 限制: {limit}条)")
-        except sqlite3.Error as e:
-            logging.error(f"查询数据库失败: {e}")
-            return jsonify({'error': f'数据库查询失败: {e}'}), 500
-        finally:
-            conn.close()
+        # 合并预先按小时累加的词频桶，不再重新读取和分词原始记录
+        result = keyword_stats.get_keywords(hours, top_n=25)
+        logging.info(f"关键词云: 合并 {hours} 小时的词频桶，覆盖 {result['records_count']} 条记录")
 
-        # 收集所有文本内容
-        all_text = []
-        for record in records:
-            # 提取OCR文本
-            ocr_text = record.get('ocr_text', '')
-            if ocr_text:
-                all_text.append(ocr_text)
-
-            # 提取窗口标题
-            window_title = record.get('window_title', '')
-            if window_title and window_title not in ['Unknown', 'Untitled']:
-                all_text.append(window_title)
-
-            # 提取页面标题
-            page_title = record.get('page_title', '')
-            if page_title:
-                all_text.append(page_title)
-
-        if not all_text:
+        if not result['records_count']:
             return jsonify({
                 'keywords': [],
                 'total_text_length': 0,
                 'hours': hours
             })
 
-        # 合并所有文本
-        combined_text = ' '.join(all_text)
-
-        # 简单的关键词提取
-        # 移除标点符号，转换为小写，分割单词
-        import string
-
-        # 清理文本
-        cleaned_text = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', combined_text.lower())
-        words = cleaned_text.split()
-
-        # 过滤条件
-        stop_words = {
-            # 英文停用词
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
-            'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did',
-            'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these',
-            'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them',
-            'my', 'your', 'his', 'her', 'its', 'our', 'their', 'mine', 'yours', 'hers', 'ours', 'theirs',
-            'not', 'no', 'yes', 'all', 'any', 'some', 'each', 'every', 'both', 'either', 'neither',
-            'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
-            # 中文停用词
-            '的', '了', '在', '是', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很',
-            '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这', '那', '来', '而',
-            '把', '学', '对', '从', '起', '还', '用', '过', '时', '后', '可以', '回', '什么', '没',
-            # 常见无意义词
-            'com', 'www', 'http', 'https', 'html', 'htm', 'php', 'asp', 'jsp',
-            'chrome', 'firefox', 'edge', 'safari', 'browser',
-            # 代码和技术相关的停用词
-            'div', 'class', 'span', 'script', 'style', 'function', 'var', 'let', 'const', 'import', 'export',
-            'component', 'props', 'data', 'method', 'computed', 'watch', 'mounted', 'created', 'beforemount',
-            'template', 'vue', 'react', 'angular', 'js', 'css', 'scss', 'sass', 'less', 'webpack', 'vite',
-            'npm', 'yarn', 'node', 'modules', 'package', 'json', 'config', 'build', 'dist', 'src',
-            'assets', 'static', 'public', 'lib', 'libs', 'vendor', 'polyfill', 'babel', 'eslint',
-            'prettier', 'typescript', 'tsx', 'jsx', 'ts', 'vue', 'svelte', 'next', 'nuxt',
-            # 文件路径相关
-            'users', 'jason', 'pycharmprojects', 'ai_watch_dog', 'frontend', 'backend', 'node_modules',
-            'vscode', 'cursor', 'ide', 'editor', 'terminal', 'console', 'command', 'cmd', 'powershell',
-            # 代码语法
-            'if', 'else', 'for', 'while', 'switch', 'case', 'break', 'continue', 'return', 'try', 'catch',
-            'finally', 'throw', 'async', 'await', 'promise', 'callback', 'then', 'resolve', 'reject',
-            # 通用技术词汇
-            'api', 'url', 'uri', 'get', 'post', 'put', 'delete', 'patch', 'head', 'options', 'cors',
-            'http', 'https', 'ssl', 'tls', 'tcp', 'udp', 'ip', 'dns', 'cdn', 'cache', 'session', 'cookie',
-            # HTML/CSS相关
-            'html', 'head', 'body', 'meta', 'title', 'link', 'script', 'style', 'img', 'src', 'href',
-            'alt', 'id', 'class', 'name', 'value', 'type', 'content', 'data', 'aria', 'role',
-            # 版本控制
-            'git', 'github', 'gitlab', 'commit', 'push', 'pull', 'merge', 'branch', 'master', 'main',
-            # 常见缩写和技术术语
-            'app', 'dev', 'prod', 'test', 'debug', 'log', 'info', 'warn', 'error', 'success', 'fail',
-            'true', 'false', 'null', 'undefined', 'nan', 'infinity',
-            # 数学和几何相关（来自SVG等）
-            'm0', '0l9', '5z', 'svg', 'path', 'rect', 'circle', 'line', 'polygon', 'polyline',
-            # 界面元素
-            'button', 'input', 'form', 'select', 'option', 'textarea', 'label', 'fieldset', 'legend',
-            'table', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot', 'caption',
-            # 动作相关
-            'click', 'hover', 'focus', 'blur', 'change', 'submit', 'reset', 'load', 'unload', 'resize',
-            'scroll', 'keydown', 'keyup', 'keypress', 'mousedown', 'mouseup', 'mousemove',
-        }
-
-        # 过滤单词
-        filtered_words = [
-            word for word in words
-            if len(word) >= 2 and  # 至少2个字符
-            word not in stop_words and  # 不在停用词中
-            not word.isdigit() and  # 不是纯数字
-            not re.match(r'^[a-z]$', word)  # 不是单个字母
-        ]
-
-        # 统计词频
-        word_counts = Counter(filtered_words)
-
-        # 分离中文和英文关键词
-        chinese_words = []
-        english_words = []
-
-        for word, count in word_counts.items():
-            if count >= 1:  # 至少出现1次
-                # 检查是否包含中文字符
-                if re.search(r'[\u4e00-\u9fff]', word):
-                    chinese_words.append((word, count))
-                else:
-                    # 进一步过滤英文技术词汇
-                    if (len(word) > 2 and  # 英文词至少3个字符
-                        not re.match(r'^[a-z]+[0-9]+$', word) and  # 不是字母+数字组合
-                        not word.endswith('js') and not word.endswith('ts') and  # 不是文件扩展名
-                        not word.endswith('css') and not word.endswith('html') and
-                        not word.startswith('ba') and  # 不是组件前缀
-                        not word.startswith('on') and  # 不是事件前缀
-                        not re.match(r'^[a-z]{1,3}$', word) and  # 不是1-3个字母的简短缩写
-                        word not in ['item', 'icon', 'list', 'grid', 'card', 'tabs']):  # 保留一些有意义的词如menu, text, panel
-                        english_words.append((word, count))
-
-        # 按词频排序
-        chinese_words.sort(key=lambda x: x[1], reverse=True)
-        english_words.sort(key=lambda x: x[1], reverse=True)
-
-        # 取前25个中文词和前25个英文词
-        top_chinese = chinese_words[:25]
-        top_english = english_words[:25]
-
         # 合并并格式化输出
         keywords = []
 
         # 添加中文关键词
-        for word, count in top_chinese:
+        for word, count in result['chinese']:
             keywords.append({
                 'text': word,
                 'count': count,
@@ -452,7 +283,7 @@ def get_keywords():
             })
 
         # 添加英文关键词
-        for word, count in top_english:
+        for word, count in result['english']:
             keywords.append({
                 'text': word,
                 'count': count,
@@ -464,9 +295,9 @@ def get_keywords():
 
         return jsonify({
             'keywords': keywords,
-            'total_text_length': len(combined_text),
-            'unique_words': len(word_counts),
-            'records_count': len(records),
+            'total_text_length': result['total_text_length'],
+            'unique_words': result['unique_words'],
+            'records_count': result['records_count'],
             'hours': hours
         })
 
@@ -484,34 +315,27 @@ def activity_search():
         if not query:
             return jsonify({'activities': [], 'count': 0})
 
-        # 简单的关键词搜索
-        all_records = get_all_activity_records(1000)  # 搜索更多记录
-        filtered_records = []
+        # 混合检索：FTS5关键词索引 + 向量相似度，按倒数排名融合
+        start_time = request.args.get('start_time') or None
+        end_time = request.args.get('end_time') or None
+        record_types = request.args.getlist('record_type') or None
+        records = activity_search_engine.search(query, start_time=start_time, end_time=end_time,
+                                                limit=limit, record_types=record_types)
 
-        for record in all_records:
-            # 搜索应用名、窗口标题、OCR文本
-            searchable_text = ' '.join([
-                record.get('app_name', ''),
-                record.get('window_title', ''),
-                record.get('ocr_text', ''),
-                record.get('url', '')
-            ]).lower()
-
-            if query.lower() in searchable_text:
-                formatted_record = {
-                    'id': record.get('id'),
-                    'timestamp': record.get('timestamp'),
-                    'app_name': record.get('app_name', 'Unknown'),
-                    'record_type': record.get('record_type'),
-                    'window_title': record.get('window_title', ''),
-                    'ocr_text': record.get('ocr_text', '')[:100] + '...' if record.get('ocr_text', '') and len(record.get('ocr_text', '')) > 100 else record.get('ocr_text', ''),
-                    'url': record.get('url'),
-                    'parser_type': record.get('parser_type')
-                }
-                filtered_records.append(formatted_record)
-
-                if len(filtered_records) >= limit:
-                    break
+        filtered_records = []
+        for record in records:
+            ocr_text = record.get('ocr_text') or ''
+            filtered_records.append({
+                'id': record.get('id'),
+                'timestamp': record.get('timestamp'),
+                'app_name': record.get('app_name', 'Unknown'),
+                'record_type': record.get('record_type'),
+                'window_title': record.get('window_title', ''),
+                'ocr_text': ocr_text[:100] + '...' if len(ocr_text) > 100 else ocr_text,
+                'url': record.get('url'),
+                'parser_type': record.get('parser_type'),
+                'score': round(record.get('score', 0.0), 5)
+            })
 
         return jsonify({
             'activities': filtered_records,
@@ -612,11 +436,11 @@ async def app_usage_summary():
                 SELECT id, timestamp, app_name, window_title, page_title, ocr_text, url,
                        record_type, mouse_x, mouse_y
                 FROM activity_log
-                WHERE app_name = ? AND timestamp >= ? AND timestamp <= ?
+                WHERE app_name = ? AND timestamp <= ? AND COALESCE(end_timestamp, timestamp) >= ?
                 ORDER BY timestamp DESC
                 LIMIT 50
             """
-            cursor.execute(query, (app_name, start_time_dt.isoformat(), end_time_dt.isoformat()))
+            cursor.execute(query, (app_name, end_time_dt.isoformat(), start_time_dt.isoformat()))
             rows = cursor.fetchall()
 
             # 转换为记录列表
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from config import ServerConfig
+
+
+def get_alert_key(alert: Dict[str, Any]) -> str:
+    """提取预警的唯一标识，缺少 alert_key 时根据内容和时间戳生成后备key"""
+    alert_key = alert.get("alert_key")
+    if not alert_key:
+        alert_key = f"{alert.get('content', '')}_{alert.get('timestamp', '')}"
+    return alert_key
+
+
+class LatencyStats:
+    """保留最近若干次样本的延迟统计（毫秒）"""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.max_ms = 0.0
+
+    def add(self, seconds: float):
+        ms = seconds * 1000
+        self._samples.append(ms)
+        self.count += 1
+        self.max_ms = max(self.max_ms, ms)
+
+    def summary(self) -> Dict[str, float]:
+        if not self._samples:
+            return {"count": self.count, "avg_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "avg_ms": round(sum(ordered) / len(ordered), 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+class AlertSubscription:
+    """单个 /alerts 连接的有界发件箱
+
+    总线在事件循环中把预警放入发件箱；发件箱满时丢弃最旧的一条，慢连接不会拖慢其他连接。
+    """
+
+    def __init__(self, bus: "AlertBus", camera_id: Optional[str], maxsize: int):
+        self._bus = bus
+        self.camera_id = camera_id
+        self._outbox: "asyncio.Queue[Tuple[float, Dict[str, Any]]]" = asyncio.Queue(maxsize=maxsize)
+        self.delivered = 0
+        self.dropped = 0
+
+    def matches(self, alert: Dict[str, Any]) -> bool:
+        """camera_id 为 None 时订阅全部摄像头"""
+        return self.camera_id is None or alert.get("camera_id") == self.camera_id
+
+    def _offer(self, published_at: float, alert: Dict[str, Any]):
+        if self._outbox.full():
+            self._outbox.get_nowait()
+            self.dropped += 1
+        self._outbox.put_nowait((published_at, alert))
+
+    async def deliver(self, send: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """持续把发件箱中的预警交给 send 发送，send 抛出异常时结束"""
+        while True:
+            published_at, alert = await self._outbox.get()
+            await send(alert)
+            self.delivered += 1
+            if published_at:
+                self._bus.delivery_latency.add(time.monotonic() - published_at)
+
+    def close(self):
+        self._bus._unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AlertBus:
+    """线程安全、基于 asyncio 的预警发布/订阅总线
+
+    分析线程、活动结束逻辑等生产者在任意线程调用 publish()，预警通过
+    call_soon_threadsafe 交给事件循环，在循环内完成去重、记录最近预警并放入
+    各订阅者的发件箱；各连接独立并发发送，空闲时不占用CPU。
+    """
+
+    def __init__(self, max_recent: int = None, dedup_window: int = None, outbox_size: int = None):
+        self.dedup_window = dedup_window or ServerConfig.ALERT_DEDUP_WINDOW
+        self.outbox_size = outbox_size or ServerConfig.ALERT_OUTBOX_SIZE
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=max_recent or ServerConfig.MAX_RECENT_ALERTS)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._early: List[Tuple[float, Dict[str, Any]]] = []  # 事件循环绑定前发布的预警
+        self._seen_keys: "OrderedDict[str, None]" = OrderedDict()
+        self._subscribers: Set[AlertSubscription] = set()
+        self._listeners: List[Callable[[Dict[str, Any]], Any]] = []  # 去重后的预警监听器（如持久化），须为非阻塞调用
+
+        # 统计信息
+        self.published = 0
+        self.duplicates = 0
+        self.dispatch_latency = LatencyStats()   # publish -> 事件循环分发
+        self.delivery_latency = LatencyStats()   # publish -> WebSocket 发送完成
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def add_listener(self, callback: Callable[[Dict[str, Any]], Any]):
+        """注册去重后的预警监听器，在事件循环中同步调用，不能阻塞"""
+        self._listeners.append(callback)
+
+    def bind(self, loop: asyncio.AbstractEventLoop = None):
+        """绑定分发所用的事件循环，并补发绑定前积压的预警"""
+        loop = loop or asyncio.get_running_loop()
+        with self._lock:
+            self._loop = loop
+            early, self._early = self._early, []
+        for published_at, alert in early:
+            loop.call_soon_threadsafe(self._dispatch, published_at, alert)
+
+    def publish(self, alert: Dict[str, Any]) -> bool:
+        """发布一条预警，可在任意线程调用"""
+        published_at = time.monotonic()
+        with self._lock:
+            loop = self._loop
+            if loop is None:
+                self._early.append((published_at, alert))
+                return True
+        try:
+            loop.call_soon_threadsafe(self._dispatch, published_at, alert)
+            return True
+        except RuntimeError:
+            logging.warning(f"事件循环已关闭，预警未发送: {alert.get('content', 'Unknown')}")
+            return False
+
+    def _dispatch(self, published_at: float, alert: Dict[str, Any]):
+        """在事件循环中去重并投递到各订阅者的发件箱"""
+        self.dispatch_latency.add(time.monotonic() - published_at)
+        alert_key = get_alert_key(alert)
+        if alert_key in self._seen_keys:
+            self.duplicates += 1
+            logging.info(f"预警已处理，跳过: {alert_key}")
+            return
+        self._seen_keys[alert_key] = None
+        if len(self._seen_keys) > self.dedup_window:
+            self._seen_keys.popitem(last=False)
+
+        self.published += 1
+        self.recent.append(alert)
+        for callback in self._listeners:
+            try:
+                callback(alert)
+            except Exception as e:
+                logging.error(f"预警监听器执行失败: {e}")
+
+        targets = [subscription for subscription in self._subscribers if subscription.matches(alert)]
+        for subscription in targets:
+            subscription._offer(published_at, alert)
+
+        alert_type = alert.get('type', 'standard')
+        if targets:
+            logging.info(f"📤 预警已投递到 {len(targets)} 个活跃连接: [{alert_type}] {alert.get('content', 'Unknown')}")
+            if alert.get('is_custom', False) or 'custom' in alert_type:
+                logging.info(f"🔧 自定义预警详情: type={alert_type}, level={alert.get('level')}, is_custom={alert.get('is_custom', False)}")
+        else:
+            logging.info(f"📥 预警已记录，但无活跃连接: {alert.get('content', 'Unknown')}")
+
+    def subscribe(self, camera_id: Optional[str] = None, replay: bool = True) -> AlertSubscription:
+        """在事件循环中创建订阅，replay 为 True 时先放入匹配的最近预警"""
+        subscription = AlertSubscription(self, camera_id, self.outbox_size)
+        if replay:
+            for alert in self.recent:
+                if subscription.matches(alert):
+                    subscription._offer(0.0, alert)
+        self._subscribers.add(subscription)
+        logging.info(f"预警订阅者加入，当前 {len(self._subscribers)} 个")
+        return subscription
+
+    def _unsubscribe(self, subscription: AlertSubscription):
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            logging.info(f"预警订阅者离开，当前 {len(self._subscribers)} 个 (丢弃 {subscription.dropped} 条)")
+
+    def get_recent(self, camera_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [alert for alert in self.recent if camera_id is None or alert.get("camera_id") == camera_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "duplicates": self.duplicates,
+            "subscribers": len(self._subscribers),
+            "dropped": sum(subscription.dropped for subscription in self._subscribers),
+            "dispatch_latency": self.dispatch_latency.summary(),
+            "delivery_latency": self.delivery_latency.summary(),
+        }
+
+
+# 全局预警总线实例，所有摄像头的分析器共享
+alert_bus = AlertBus()
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from config import APIConfig
+from llm_cache import description_cache
+from llm_service import query_siliconflow_model
+from prompt import prompt_rule_batch
+
+
+class AlertRuleEngine:
+    """自定义预警规则评估引擎
+
+    把所有启用的规则放进一个结构化提示词中，一次LLM调用得到每条规则的JSON判定；
+    规则总长度超出上下文预算时拆成多个批次并发评估，批次结果无法解析时退回到
+    逐条规则的并发评估（并发数受限），判定语义与逐条评估保持一致。
+    """
+
+    def __init__(self, max_prompt_chars: int = None, concurrency: int = None):
+        self.max_prompt_chars = max_prompt_chars or APIConfig.RULE_BATCH_MAX_CHARS
+        self.concurrency = concurrency or APIConfig.RULE_EVAL_CONCURRENCY
+
+        # 统计信息
+        self.stats = {"batch_calls": 0, "single_calls": 0, "fallbacks": 0}
+
+    async def evaluate(self, rules: List[Dict], description: str, timestamp: str) -> List[Dict]:
+        """评估规则，返回被触发规则的预警信息列表"""
+        rules = [rule for rule in rules if rule.get('enabled', False) and rule.get('generated_prompt')]
+        if not rules:
+            return []
+
+        # 规则集合变化后缓存自动失效
+        rules_key = self._rules_fingerprint(rules)
+        merged = description_cache.get("rules", description, context=rules_key, time_str=timestamp)
+        if merged is not None:
+            logging.info(f"♻️ 复用缓存的自定义规则判定 ({len(rules)} 条规则)")
+        else:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            batches = self._split_batches(rules, description, timestamp)
+            results = await asyncio.gather(
+                *(self._evaluate_batch(batch, description, timestamp, semaphore) for batch in batches)
+            )
+
+            merged, complete = {}, True
+            for batch_result, batch_complete in results:
+                merged.update(batch_result)
+                complete = complete and batch_complete
+            if complete:
+                # 只缓存全部规则都得到有效判定的结果
+                description_cache.put("rules", description, merged, context=rules_key, time_str=timestamp)
+
+        triggered_alerts = []
+        for rule in rules:
+            detection_result = merged.get(rule['id'])
+            if detection_result:
+                triggered_alerts.append({
+                    'rule_id': rule['id'],
+                    'rule_name': rule['name'],
+                    'condition': rule['condition'],
+                    'level': rule['level'],
+                    'detection_result': detection_result,
+                    'timestamp': timestamp
+                })
+                logging.info(f"✅ 用户自定义规则触发: {rule['name']}")
+            else:
+                logging.info(f"❌ 自定义规则未触发: {rule['name']}")
+        return triggered_alerts
+
+    @staticmethod
+    def _rules_fingerprint(rules: List[Dict]) -> str:
+        content = json.dumps(
+            [[rule['id'], rule['name'], rule['generated_prompt']] for rule in rules],
+            ensure_ascii=False
+        )
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _format_rule(rule: Dict) -> str:
+        return f"规则{rule['id']}【{rule['name']}】：{rule['generated_prompt'].strip()}"
+
+    def _split_batches(self, rules: List[Dict], description: str, timestamp: str) -> List[List[Dict]]:
+        """按提示词长度预算把规则打包成批次"""
+        base_length = len(prompt_rule_batch) + len(description) + len(timestamp)
+        batches, current, current_length = [], [], base_length
+        for rule in rules:
+            rule_length = len(self._format_rule(rule)) + 1
+            if current and current_length + rule_length > self.max_prompt_chars:
+                batches.append(current)
+                current, current_length = [], base_length
+            current.append(rule)
+            current_length += rule_length
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _evaluate_batch(self, rules: List[Dict], description: str, timestamp: str,
+                              semaphore: asyncio.Semaphore) -> Tuple[Dict[int, Optional[str]], bool]:
+        """一次调用评估一批规则，返回 ({rule_id: 检测结果或None}, 是否全部得到有效判定)"""
+        if len(rules) == 1:
+            result, ok = await self._evaluate_single(rules[0], description, timestamp, semaphore)
+            return {rules[0]['id']: result}, ok
+
+        prompt = prompt_rule_batch.format(
+            rules="\n".join(self._format_rule(rule) for rule in rules),
+            time=timestamp,
+            description=description
+        )
+        max_tokens = min(2048, 64 + 16 * len(rules))
+        async with semaphore:
+            self.stats["batch_calls"] += 1
+            logging.info(f"🔍 批量检测 {len(rules)} 条自定义规则")
+            raw = await query_siliconflow_model(prompt, max_tokens=max_tokens)
+        logging.info(f"🤖 LLM批量检测结果: '{raw}'")
+
+        if raw.startswith("API调用"):
+            # 接口本身失败时逐条重试也不会成功，按未触发处理
+            return {rule['id']: None for rule in rules}, False
+
+        verdicts = self._parse_verdicts(raw)
+        results, missing, complete = {}, [], True
+        for rule in rules:
+            verdict = verdicts.get(str(rule['id'])) if verdicts is not None else None
+            if verdict is None:
+                missing.append(rule)
+            else:
+                # 与逐条评估的返回格式保持一致
+                results[rule['id']] = f"{timestamp} {rule['name']}" if verdict else None
+
+        if missing:
+            self.stats["fallbacks"] += 1
+            logging.warning(f"批量检测结果缺少 {len(missing)} 条规则的判定，退回逐条检测")
+            single_results = await asyncio.gather(
+                *(self._evaluate_single(rule, description, timestamp, semaphore) for rule in missing)
+            )
+            for rule, (result, ok) in zip(missing, single_results):
+                results[rule['id']] = result
+                complete = complete and ok
+        return results, complete
+
+    async def _evaluate_single(self, rule: Dict, description: str, timestamp: str,
+                               semaphore: asyncio.Semaphore) -> Tuple[Optional[str], bool]:
+        """逐条规则评估（原有语义），返回 (触发时的检测结果字符串, 调用是否成功)"""
+        detection_prompt = f"""
+                {rule['generated_prompt']}
+
+                当前视频描述：{description}
+                当前时间：{timestamp}
+
+                请根据规则检测是否触发预警，如果触发请返回："{timestamp} {rule['name']}"
+                如果未触发请返回："未检测到"
+                """
+        try:
+            async with semaphore:
+                self.stats["single_calls"] += 1
+                logging.info(f"🔍 检测自定义规则: {rule['name']}")
+                custom_result = await query_siliconflow_model(detection_prompt)
+            logging.info(f"🤖 LLM检测结果: '{custom_result}'")
+            if custom_result and custom_result.strip() != "未检测到" and rule['name'] in custom_result:
+                return custom_result.strip(), True
+            return None, not (custom_result or "").startswith("API调用")
+        except Exception as e:
+            logging.error(f"执行自定义规则检测失败 [{rule['name']}]: {e}")
+        return None, False
+
+    @staticmethod
+    def _parse_verdicts(raw: str) -> Optional[Dict[str, bool]]:
+        """从LLM输出中解析 {规则编号: 是否触发}，无法解析时返回 None"""
+        if not raw:
+            return None
+        # 从每个 '{' 处尝试解码一个完整的 JSON 对象，推理文字或其他片段中的花括号不影响判定对象
+        decoder = json.JSONDecoder()
+        parsed = None
+        for match in re.finditer(r'\{', raw):
+            try:
+                data, _ = decoder.raw_decode(raw, match.start())
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            verdicts = AlertRuleEngine._verdicts_from_object(data)
+            if verdicts:
+                return verdicts
+            if parsed is None:
+                parsed = verdicts
+        return parsed
+
+    @staticmethod
+    def _verdicts_from_object(data: Dict) -> Dict[str, bool]:
+        verdicts = {}
+        for key, value in data.items():
+            key = re.sub(r'\D', '', str(key))
+            if not key:
+                continue
+            if isinstance(value, dict):
+                value = value.get('triggered')
+            if isinstance(value, str):
+                value = value.strip().lower() in ('true', 'yes', '是', '触发')
+            if isinstance(value, bool):
+                verdicts[key] = value
+        return verdicts
@@ -0,0 +1,155 @@
+import copy
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from video_database import video_db
+
+# 用户自定义规则从1000开始编号，避免与系统预设规则（1-999）冲突
+USER_RULE_ID_START = 1000
+
+
+class AlertRuleStore:
+    """带版本号的进程内预警规则注册表
+
+    video_server 的增删改接口直接修改注册表并递增版本号，分析器通过 snapshot()
+    读取不可变快照，不再经过HTTP自调用；规则同时持久化到SQLite，重启后自动恢复。
+    """
+
+    def __init__(self, database=None):
+        self.db = database or video_db
+        self._lock = threading.Lock()
+        self._rules: Dict[int, Dict[str, Any]] = {}
+        self.version = 0
+        self._snapshot: Tuple[Dict[str, Any], ...] = ()
+        self._init_table()
+        self._load()
+
+    def _init_table(self):
+        with self.db.get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS custom_alert_rules (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    is_system_rule INTEGER DEFAULT 0,
+                    rule_json TEXT NOT NULL,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.commit()
+
+    def _load(self):
+        """从SQLite加载全部规则"""
+        with self.db.get_connection() as conn:
+            rows = conn.execute('SELECT rule_json FROM custom_alert_rules ORDER BY id').fetchall()
+        with self._lock:
+            self._rules = {}
+            for row in rows:
+                rule = json.loads(row['rule_json'])
+                self._rules[rule['id']] = rule
+            self._bump()
+        logging.info(f"从数据库加载了{len(self._rules)}条预警规则")
+
+    def _bump(self):
+        """递增版本号并重建快照（调用方需持有锁）"""
+        self.version += 1
+        self._snapshot = tuple(copy.deepcopy(rule) for rule in self._rules.values())
+
+    def _persist(self, rules: List[Dict[str, Any]], deleted_ids: List[int] = ()):
+        with self.db.get_connection() as conn:
+            for rule_id in deleted_ids:
+                conn.execute('DELETE FROM custom_alert_rules WHERE id = ?', (rule_id,))
+            for rule in rules:
+                conn.execute('''
+                    INSERT OR REPLACE INTO custom_alert_rules (id, name, is_system_rule, rule_json, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (rule['id'], rule.get('name', ''), int(bool(rule.get('is_system_rule', False))),
+                      json.dumps(rule, ensure_ascii=False)))
+            conn.commit()
+
+    def snapshot(self) -> Tuple[Dict[str, Any], ...]:
+        """返回当前规则的不可变快照（无I/O，调用方不应修改其中的字典）"""
+        return self._snapshot
+
+    def snapshot_with_version(self) -> Tuple[int, Tuple[Dict[str, Any], ...]]:
+        with self._lock:
+            return self.version, self._snapshot
+
+    def list_rules(self) -> List[Dict[str, Any]]:
+        return [copy.deepcopy(rule) for rule in self._snapshot]
+
+    def get(self, rule_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rule = self._rules.get(rule_id)
+            return copy.deepcopy(rule) if rule else None
+
+    def ensure_defaults(self, default_rules: List[Dict[str, Any]]) -> int:
+        """写入缺失的系统预设规则，已存在的规则（含用户修改）保持不变"""
+        with self._lock:
+            missing = [rule for rule in default_rules if rule['id'] not in self._rules]
+            if not missing:
+                return 0
+            self._persist(missing)
+            for rule in missing:
+                self._rules[rule['id']] = copy.deepcopy(rule)
+            self._rules = dict(sorted(self._rules.items()))
+            self._bump()
+        return len(missing)
+
+    def _next_user_rule_id(self) -> int:
+        user_ids = [rule_id for rule_id, rule in self._rules.items()
+                    if not rule.get('is_system_rule', False) and rule_id >= USER_RULE_ID_START]
+        return max(user_ids, default=USER_RULE_ID_START - 1) + 1
+
+    def next_user_rule_id(self) -> int:
+        with self._lock:
+            return self._next_user_rule_id()
+
+    def add(self, rule: Dict[str, Any]) -> Dict[str, Any]:
+        """添加规则，未指定ID时自动分配用户规则ID"""
+        with self._lock:
+            rule = copy.deepcopy(rule)
+            if 'id' not in rule:
+                rule['id'] = self._next_user_rule_id()
+            self._persist([rule])
+            self._rules[rule['id']] = rule
+            self._bump()
+            return copy.deepcopy(rule)
+
+    def update(self, rule_id: int, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """更新规则字段，规则不存在时返回 None"""
+        with self._lock:
+            if rule_id not in self._rules:
+                return None
+            rule = copy.deepcopy(self._rules[rule_id])
+            rule.update(update_data)
+            rule['updated_at'] = datetime.now().isoformat()
+            self._persist([rule])
+            self._rules[rule_id] = rule
+            self._bump()
+            return copy.deepcopy(rule)
+
+    def delete(self, rule_id: int) -> Optional[Dict[str, Any]]:
+        """删除规则，返回被删除的规则"""
+        with self._lock:
+            if rule_id not in self._rules:
+                return None
+            self._persist([], deleted_ids=[rule_id])
+            rule = self._rules.pop(rule_id)
+            self._bump()
+            return rule
+
+    def replace_all(self, rules: List[Dict[str, Any]]):
+        """整体替换规则集合（用于清理重复规则）"""
+        with self._lock:
+            new_ids = {rule['id'] for rule in rules}
+            deleted_ids = [rule_id for rule_id in self._rules if rule_id not in new_ids]
+            self._persist(rules, deleted_ids=deleted_ids)
+            self._rules = {rule['id']: copy.deepcopy(rule) for rule in rules}
+            self._bump()
+
+
+# 全局规则注册表实例，video_server 与 MultiModalAnalyzer 共享
+rule_store = AlertRuleStore()
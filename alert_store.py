@@ -0,0 +1,139 @@
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from video_database import video_db
+
+# 预警时间统一存储格式，字符串比较即时间顺序
+ALERT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+_ACCEPTED_TIME_FORMATS = (ALERT_TIME_FORMAT, '%Y-%m-%d-%H-%M-%S', '%Y-%m-%dT%H:%M:%S')
+
+
+def normalize_alert_time(value: Optional[str]) -> str:
+    """把预警中的各种时间格式统一为 ALERT_TIME_FORMAT，无法解析时使用当前时间"""
+    if value:
+        value = str(value).split('.')[0]
+        for time_format in _ACCEPTED_TIME_FORMATS:
+            try:
+                return datetime.strptime(value, time_format).strftime(ALERT_TIME_FORMAT)
+            except ValueError:
+                continue
+    return datetime.now().strftime(ALERT_TIME_FORMAT)
+
+
+class AlertStore:
+    """持久化的预警记录表
+
+    预警总线每分发一条新预警就调用 append()，由后台线程批量写入SQLite；
+    alert_time 列带索引，导出时按 (alert_time, id) 键集分页做范围扫描，内存占用与导出时长无关。
+    """
+
+    def __init__(self, database=None, batch_size: int = 100):
+        self.db = database or video_db
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self.written = 0
+        self._init_table()
+
+    def _init_table(self):
+        with self.db.get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS alerts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    alert_time TEXT NOT NULL,
+                    camera_id TEXT,
+                    alert_type TEXT,
+                    level TEXT,
+                    content TEXT,
+                    alert_key TEXT UNIQUE,
+                    alert_json TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts(alert_time, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_camera_time ON alerts(camera_id, alert_time)')
+            conn.commit()
+
+    def append(self, alert: Dict[str, Any]):
+        """登记一条预警，不阻塞调用方（可在事件循环中调用）"""
+        self._ensure_writer()
+        self._queue.put(alert)
+
+    def _ensure_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            with self._writer_lock:
+                if self._writer is None or not self._writer.is_alive():
+                    self._writer = threading.Thread(target=self._write_loop, name="alert-store-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logging.error(f"写入预警记录失败 ({len(batch)} 条): {e}")
+
+    def _write_batch(self, alerts: List[Dict[str, Any]]):
+        rows = [(
+            normalize_alert_time(alert.get('timestamp')),
+            alert.get('camera_id'),
+            alert.get('type'),
+            alert.get('level'),
+            alert.get('content'),
+            alert.get('alert_key'),
+            json.dumps(alert, ensure_ascii=False, default=str)
+        ) for alert in alerts]
+        with self.db.get_connection() as conn:
+            cursor = conn.executemany('''
+                INSERT OR IGNORE INTO alerts
+                (alert_time, camera_id, alert_type, level, content, alert_key, alert_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        self.written += max(cursor.rowcount, 0)  # 重复的 alert_key 被忽略
+
+    def iter_range(self, start_time: str, end_time: str, camera_id: Optional[str] = None,
+                   page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """按时间升序流式返回 [start_time, end_time] 内的预警
+
+        每页单独查询并立即释放连接，长时间导出不会一直占用数据库读锁。
+        """
+        last_time, last_id = start_time, 0
+        while True:
+            sql = '''
+                SELECT id, alert_time, alert_json FROM alerts
+                WHERE (alert_time > ? OR (alert_time = ? AND id > ?)) AND alert_time <= ?
+            '''
+            params: List[Any] = [last_time, last_time, last_id, end_time]
+            if camera_id:
+                sql += ' AND camera_id = ?'
+                params.append(camera_id)
+            sql += ' ORDER BY alert_time, id LIMIT ?'
+            params.append(page_size)
+
+            with self.db.get_connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            for row in rows:
+                alert = json.loads(row['alert_json'])
+                alert['timestamp'] = row['alert_time']
+                yield alert
+            if len(rows) < page_size:
+                return
+            last_time, last_id = rows[-1]['alert_time'], rows[-1]['id']
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"written": self.written, "pending": self._queue.qsize()}
+
+
+# 全局预警记录存储实例
+alert_store = AlertStore()
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, Optional
+
+from config import VideoConfig
+
+
+class AnalysisScheduler:
+    """多路摄像头共享的分析调度器
+
+    在一个后台线程中运行独立的事件循环，所有摄像头的分析协程都提交到这里执行，
+    并用信号量限制同时进行的分析数量，避免每次分析都新建线程和事件循环。
+    """
+
+    def __init__(self, max_concurrent: int = None):
+        self.max_concurrent = max_concurrent or VideoConfig.MAX_CONCURRENT_ANALYSES
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+
+    def start(self):
+        """启动调度线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="analysis-scheduler", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._ready.set()
+        logging.info(f"分析调度器已启动，最大并发分析数: {self.max_concurrent}")
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """提交分析协程，返回 concurrent.futures.Future（可在任意线程调用）"""
+        self.start()
+        self.submitted += 1
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro), self._loop)
+
+    async def _guarded(self, coro: Coroutine) -> Any:
+        async with self._semaphore:
+            self.running += 1
+            try:
+                result = await coro
+                self.completed += 1
+                return result
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.running -= 1
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        return self._loop
+
+    def stop(self):
+        """停止调度线程"""
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        self._loop = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "running": self.running,
+        }
+
+
+# 全局共享调度器实例
+analysis_scheduler = AnalysisScheduler()
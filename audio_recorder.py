@@ -39,7 +39,11 @@ except ImportError:
     logging.warning("Faster Whisper 未安装，请运行: pip install faster-whisper")
 
 # 导入现有的数据库和索引功能
-from activity_retriever import create_db_connection, index_single_activity_record
+from activity_log_writer import activity_log_writer
+from activity_indexer import activity_indexer
+
+# 转录记录在写入事务中登记到向量索引队列，由后台线程批量索引
+activity_indexer.attach(activity_log_writer)
 
 # 导入配置
 from audio_config import AudioConfig, DEFAULT_CONFIG
@@ -344,6 +348,12 @@ class AudioRecorder:
             self.stream.close()
             self.stream = None
 
+        # 等待尚未提交的转录记录写入数据库
+        try:
+            activity_log_writer.flush(timeout=10)
+        except Exception as e:
+            logging.warning(f"等待转录记录写入超时: {e}")
+
         logging.info("音频录制已停止")
         self._print_stats()
 
@@ -589,66 +599,21 @@ class AudioRecorder:
                 'button': None
             }
 
-            # 保存到数据库
-            conn = create_db_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor()
-
-                    # 插入记录
-                    insert_query = """
-                        INSERT INTO activity_log (
-                            timestamp, record_type, triggered_by, event_type,
-                            window_title, process_name, app_name, page_title, url,
-                            ocr_text, parser_type, mouse_x, mouse_y, button
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """
-
-                    cursor.execute(insert_query, (
-                        record_data['timestamp'],
-                        record_data['record_type'],
-                        record_data['triggered_by'],
-                        record_data['event_type'],
-                        record_data['window_title'],
-                        record_data['process_name'],
-                        record_data['app_name'],
-                        record_data['page_title'],
-                        record_data['url'],
-                        record_data['ocr_text'],
-                        record_data['parser_type'],
-                        record_data['mouse_x'],
-                        record_data['mouse_y'],
-                        record_data['button']
-                    ))
-
-                    conn.commit()
-
-                    # 获取插入的记录ID
-                    record_id = cursor.lastrowid
-                    record_data['id'] = record_id
-
-                    logging.debug(f"音频转录记录已保存到数据库，ID: {record_id}")
-
-                    # 索引到向量数据库
-                    try:
-                        success = index_single_activity_record(record_data)
-                        if success:
-                            logging.debug(f"音频转录记录已索引到向量数据库，ID: {record_id}")
-                        else:
-                            logging.warning(f"音频转录记录索引到向量数据库失败，ID: {record_id}")
-                    except Exception as e:
-                        logging.error(f"索引音频转录记录到向量数据库时出错: {e}")
-
-                except sqlite3.Error as e:
-                    logging.error(f"保存音频转录记录到数据库失败: {e}")
-                finally:
-                    conn.close()
-            else:
-                logging.error("无法连接到数据库，音频转录记录未保存")
+            # 交给 activity_log 写入服务批量提交，提交后由钩子索引到向量数据库
+            future = activity_log_writer.submit(record_data)
+            future.add_done_callback(self._on_transcription_saved)
 
         except Exception as e:
             logging.error(f"保存音频转录记录时出错: {e}")
 
+    @staticmethod
+    def _on_transcription_saved(future):
+        """写入服务提交后的回调"""
+        if future.exception():
+            logging.error(f"保存音频转录记录到数据库失败: {future.exception()}")
+        else:
+            logging.debug(f"音频转录记录已保存到数据库，ID: {future.result()}")
+
     def _print_stats(self):
         """打印统计信息"""
         if self.stats['start_time']:
@@ -26,10 +26,26 @@ class VideoConfig:
     ANALYSIS_INTERVAL = 10  # 分析间隔(秒)
     BUFFER_DURATION = 11  # 滑窗分析时长
     JPEG_QUALITY = 80  # JPEG压缩质量
+    DISPLAY_BUFFER_SIZE = 4  # 显示帧环形缓冲区槽位数
+    MAX_CONCURRENT_ANALYSES = 4  # 多路摄像头共享调度器的最大并发分析数
 
     # 活动检测配置
     ACTIVITY_THRESHOLD = 0.1  # 活动检测阈值
 
+    # 运动门控分析配置
+    MOTION_GATE_ENABLED = True  # 画面静止时跳过/退避分析
+    MOTION_STATIC_THRESHOLD = 0.01  # 低于该运动分数视为静止
+    MOTION_TRIGGER_THRESHOLD = 0.1  # 超过该运动分数立即分析
+    MOTION_MIN_INTERVAL = 3  # 两次分析的最小间隔(秒)
+    ANALYSIS_HEARTBEAT = 300  # 静止画面的强制分析间隔(秒)
+    ANALYSIS_BACKOFF = 2.0  # 静止时分析间隔的退避倍数
+    MOTION_GRAY_WIDTH = 160  # 运动检测缩略灰度图尺寸
+    MOTION_GRAY_HEIGHT = 90
+
+    # 关键帧去重配置
+    KEYFRAME_DEDUP_ENABLED = True  # 上传前按感知哈希剔除近似重复帧
+    KEYFRAME_HASH_DISTANCE = 6  # dHash(64位)汉明距离小于该值视为重复
+
 # 修改默认视频源为摄像头
 VIDEO_SOURCE = VideoConfig.CAMERA_INDEX  # 使用摄像头索引
 
@@ -74,6 +90,31 @@ class APIConfig:
     TOP_K = 50              # 控制核心词汇 (可能不被所有API支持)
     REPETITION_PENALTY = 0.5 # 控制重复性 (可能不被所有API支持，或映射到 frequency_penalty)
 
+    # 共享HTTP网关配置 (llm_service.http_gateway)
+    HTTP2_ENABLED = True          # 安装 h2 后启用 HTTP/2
+    HTTP_MAX_CONNECTIONS = 100    # 连接池最大连接数
+    HTTP_MAX_KEEPALIVE = 20       # 保持的空闲长连接数
+    HTTP_KEEPALIVE_EXPIRY = 60.0  # 空闲长连接过期时间（秒）
+    HTTP_MAX_RETRIES = 2          # 网络错误/429/5xx 的重试次数
+    HTTP_RETRY_BASE_DELAY = 0.5   # 指数退避初始等待（秒），实际等待带随机抖动
+    DEFAULT_UPSTREAM_CONCURRENCY = 16  # 每个上游主机默认的最大并发请求数
+    UPSTREAM_CONCURRENCY = {
+        "api.siliconflow.cn": 8,
+    }
+
+    # 自定义预警规则批量评估配置
+    RULE_BATCH_MAX_CHARS = 6000   # 单次批量评估提示词的长度预算（字符）
+    RULE_EVAL_CONCURRENCY = 4     # 超出预算或回退逐条评估时的最大并发调用数
+
+    # 描述级LLM结果缓存配置 (异常检测与自定义规则评估)
+    LLM_CACHE_ENABLED = True
+    LLM_CACHE_TTL = 600                 # 缓存有效期（秒）
+    LLM_CACHE_MAX_ENTRIES = 512         # LRU最大条目数
+    # 启用MinHash近似重复描述匹配。默认关闭：异常检测/规则评估的描述哪怕只改几个字
+    # （如追加“冒出明火”）也可能改变结论，近似命中会把新的异常复用成旧的“正常”结果
+    LLM_CACHE_NEAR_DUP = False
+    LLM_CACHE_NEAR_DUP_THRESHOLD = 0.85 # 近似匹配的最小Jaccard相似度
+
 # RAG系统配置
 class RAGConfig:
     # 知识库配置
@@ -86,6 +127,33 @@ class RAGConfig:
 # 存档配置
 ARCHIVE_DIR = "archive"
 
+# SQLite 数据库访问配置
+class DatabaseConfig:
+    WAL_ENABLED = True            # WAL日志模式，读写互不阻塞
+    SYNCHRONOUS = "NORMAL"        # WAL 下 NORMAL 可保证一致性，仅断电时可能丢失最近的提交
+    BUSY_TIMEOUT = 10.0           # 等待写锁的超时（秒）
+    CACHED_STATEMENTS = 256       # 每个连接缓存的预编译语句数
+    GROUP_COMMIT_ENABLED = True   # 写操作交给数据库线程合并为一个事务提交
+    GROUP_COMMIT_MAX_BATCH = 256  # 单次合并提交的最大写操作数
+    GROUP_COMMIT_MAX_DELAY = 0.0  # 等待更多写操作加入批次的最长时间（秒），0 表示只合并已排队的写操作
+
+# 共享嵌入服务配置 (rag_server、activity_retriever 与各索引路径共用同一个模型)
+class EmbeddingConfig:
+    MODEL_NAME = "Alibaba-NLP/gte-multilingual-base"
+    DEVICE = "cpu"
+    BACKEND = "onnx"                      # onnx: ONNX Runtime 推理，加载失败时回退到 torch
+    ONNX_QUANTIZE = True                  # 使用 int8 动态量化的 ONNX 模型
+    ONNX_QUANTIZE_TARGET = "avx2"         # 量化目标指令集: arm64 / avx2 / avx512 / avx512_vnni
+    MODEL_CACHE_DIR = os.path.join("models", "embedding")  # 导出/量化后的模型保存目录
+    BATCH_MAX_SIZE = 32                   # 单次推理最多合并的文本数
+    BATCH_MAX_DELAY = 0.01                # 收到第一条请求后等待凑批的最长时间（秒）
+    CACHE_MAX_ENTRIES = 10000             # 按内容哈希缓存的向量数 (LRU)
+    # 设置后本进程不加载模型，通过本机嵌入服务 (python embedding_service.py --serve) 计算
+    SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+    SERVER_HOST = "127.0.0.1"
+    SERVER_PORT = 8095
+    REQUEST_TIMEOUT = 60                  # 请求嵌入服务的超时（秒）
+
 # 服务器配置
 class ServerConfig:
     HOST = "0.0.0.0"
@@ -93,6 +161,11 @@ class ServerConfig:
     RELOAD = True
     WORKERS = 1
 
+    # 预警总线配置
+    MAX_RECENT_ALERTS = 10      # 新连接回放的最近预警数
+    ALERT_DEDUP_WINDOW = 100    # 按 alert_key 去重的最近预警窗口
+    ALERT_OUTBOX_SIZE = 64      # 每个 /alerts 连接的待发送上限，溢出时丢弃最旧的预警
+
 # 日志配置
 LOG_CONFIG = {
     'level': logging.DEBUG,  # 临时改为DEBUG级别以便调试API问题
@@ -113,9 +186,17 @@ class OSSConfig:
     # 用于存储的路径前缀
     ALERT_PREFIX = 'video_warning/'
     ANALYSIS_PREFIX = 'analysis_frames/'
+    # 上传服务配置
+    BACKEND = os.getenv("OSS_BACKEND", "oss")  # oss 或 local (本地文件系统，离线测试用)
+    LOCAL_ROOT = os.getenv("OSS_LOCAL_ROOT", "oss_local")
+    LOCAL_URL_PREFIX = os.getenv("OSS_LOCAL_URL_PREFIX", "")  # 为空时使用 file:// 路径
+    UPLOAD_WORKERS = 8  # 并行上传线程数 (同时也是连接池大小)
+    UPLOAD_MAX_RETRIES = 3
+    RETRY_BASE_DELAY = 0.5  # 指数退避的初始等待(秒)
+    CONNECT_TIMEOUT = 10  # 连接超时(秒)
 
     # 检查OSS配置是否完整
-    if not ACCESS_KEY_ID or not ACCESS_KEY_SECRET or not BUCKET:
+    if BACKEND != "local" and (not ACCESS_KEY_ID or not ACCESS_KEY_SECRET or not BUCKET):
         print("警告: OSS配置不完整，请检查 .env 文件中的 OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET, OSS_BUCKET 配置")
 
 def update_config(args: Dict[str, Any]) -> None:
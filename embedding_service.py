@@ -0,0 +1,363 @@
+import argparse
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from config import EmbeddingConfig
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+try:
+    from langchain_core.embeddings import Embeddings as _LangchainEmbeddings
+except ImportError:
+    _LangchainEmbeddings = object
+
+try:
+    from chromadb import EmbeddingFunction as _ChromaEmbeddingFunction
+except ImportError:
+    _ChromaEmbeddingFunction = object
+
+Vector = List[float]
+
+
+class EmbeddingService:
+    """进程内共享的文本嵌入服务
+
+    模型只加载一次（优先 int8 量化的 ONNX 模型，失败时回退到 torch）。各线程的请求
+    先按内容哈希查 LRU 缓存，未命中的文本交给单个推理线程，按数量或时间凑成一批
+    统一编码，再把结果分发回各自的 Future。配置了 SERVICE_URL 时本进程不加载模型，
+    凑好的批次发送到本机嵌入服务，同一台机器上的多个进程共用一份模型。
+    """
+
+    def __init__(self, model_name: str = None, service_url: str = None,
+                 max_batch: int = None, max_delay: float = None, cache_size: int = None):
+        self.model_name = model_name or EmbeddingConfig.MODEL_NAME
+        self.service_url = (EmbeddingConfig.SERVICE_URL if service_url is None else service_url).rstrip('/')
+        self.max_batch = max_batch or EmbeddingConfig.BATCH_MAX_SIZE
+        self.max_delay = EmbeddingConfig.BATCH_MAX_DELAY if max_delay is None else max_delay
+        self.cache_size = EmbeddingConfig.CACHE_MAX_ENTRIES if cache_size is None else cache_size
+
+        self._model = None
+        self.backend = None
+        self._model_lock = threading.Lock()
+        self._cache: "OrderedDict[str, Vector]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.requests = 0
+        self.texts = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.remote_failures = 0
+
+    # ---- 对外接口 ----
+    def embed(self, texts: List[str], timeout: float = None) -> List[Vector]:
+        """返回与 texts 一一对应的向量；重复文本只计算一次
+
+        timeout 缺省时按需要计算的批数放宽（每批 REQUEST_TIMEOUT 秒），大批量写入不会超时。
+        """
+        texts = [text or "" for text in texts]
+        results: List[Optional[Vector]] = [None] * len(texts)
+        missing: "OrderedDict[str, List[int]]" = OrderedDict()
+        with self._cache_lock:
+            self.requests += 1
+            self.texts += len(texts)
+            for i, text in enumerate(texts):
+                key = self._cache_key(text)
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    self.cache_hits += 1
+                    results[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            pending = [texts[indexes[0]] for indexes in missing.values()]
+            futures = self._submit(pending)
+            deadline = time.monotonic() + (timeout or EmbeddingConfig.REQUEST_TIMEOUT * len(futures))
+            vectors = [vector for future in futures
+                       for vector in future.result(timeout=max(0.0, deadline - time.monotonic()))]
+            with self._cache_lock:
+                for (key, indexes), vector in zip(missing.items(), vectors):
+                    for i in indexes:
+                        results[i] = vector
+                    if self.cache_size > 0:
+                        self._cache[key] = vector
+                        self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def embed_query(self, text: str) -> Vector:
+        return self.embed([text])[0]
+
+    def as_langchain(self) -> "LangchainEmbeddingAdapter":
+        """供 langchain Chroma 使用的 embedding_function"""
+        return LangchainEmbeddingAdapter(self)
+
+    def as_chroma(self) -> "ChromaEmbeddingFunction":
+        """供 chromadb 原生集合使用的 embedding_function"""
+        return ChromaEmbeddingFunction(self)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    # ---- 凑批推理 ----
+    @staticmethod
+    def _cache_key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _submit(self, texts: List[str]) -> List[Future]:
+        """按 max_batch 切分后放入队列，返回与各分片对应的 Future 列表"""
+        self._ensure_started()
+        futures = []
+        for i in range(0, len(texts), self.max_batch):
+            future: Future = Future()
+            self._queue.put((texts[i:i + self.max_batch], future))
+            futures.append(future)
+        return futures
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_delay
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[Tuple[List[str], Future]]):
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            started = time.perf_counter()
+            vectors = self._encode(texts)
+            self.encode_seconds += time.perf_counter() - started
+            self.batches += 1
+            self.encoded += len(texts)
+        except Exception as e:
+            logging.error(f"文本嵌入失败 ({len(texts)} 条): {e}", exc_info=True)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        offset = 0
+        for item_texts, future in batch:
+            future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def _encode(self, texts: List[str]) -> List[Vector]:
+        if self.service_url:
+            try:
+                response = requests.post(f"{self.service_url}/embed", json={"texts": texts},
+                                         timeout=EmbeddingConfig.REQUEST_TIMEOUT)
+                response.raise_for_status()
+                return response.json()["embeddings"]
+            except Exception as e:
+                # 嵌入服务不可用时回退到本进程加载模型，保证索引和检索不中断
+                self.remote_failures += 1
+                logging.warning(f"嵌入服务 {self.service_url} 请求失败，改用本地模型: {e}")
+        model = self._load_model()
+        # 与原 HuggingFaceEmbeddings(normalize_embeddings=True) 的输出保持一致
+        return model.encode(texts, batch_size=self.max_batch, normalize_embeddings=True,
+                            convert_to_numpy=True, show_progress_bar=False).tolist()
+
+    # ---- 模型加载 ----
+    def _load_model(self):
+        if self._model is not None:
+            return self._model
+        with self._model_lock:
+            if self._model is not None:
+                return self._model
+            if not SENTENCE_TRANSFORMERS_AVAILABLE:
+                raise RuntimeError("sentence-transformers 未安装，无法加载嵌入模型")
+            if EmbeddingConfig.BACKEND == "onnx":
+                try:
+                    self._model = self._load_onnx_model()
+                    self.backend = "onnx-int8" if EmbeddingConfig.ONNX_QUANTIZE else "onnx"
+                except Exception as e:
+                    logging.warning(f"ONNX 嵌入模型加载失败，回退到 torch: {e}")
+            if self._model is None:
+                self._model = SentenceTransformer(self.model_name, device=EmbeddingConfig.DEVICE,
+                                                  trust_remote_code=True)
+                self.backend = "torch"
+            logging.info(f"嵌入模型已加载: {self.model_name} (backend={self.backend})")
+            return self._model
+
+    def _load_onnx_model(self):
+        """导出 ONNX 模型并做一次 int8 动态量化，结果保存在 MODEL_CACHE_DIR 下复用"""
+        kwargs = dict(device=EmbeddingConfig.DEVICE, trust_remote_code=True, backend="onnx")
+        if not EmbeddingConfig.ONNX_QUANTIZE:
+            return SentenceTransformer(self.model_name, **kwargs)
+
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        export_dir = os.path.join(EmbeddingConfig.MODEL_CACHE_DIR, self.model_name.replace('/', '__'))
+        target = EmbeddingConfig.ONNX_QUANTIZE_TARGET
+        file_name = f"onnx/model_qint8_{target}.onnx"
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            logging.info(f"正在导出并量化 ONNX 嵌入模型到 {export_dir} ...")
+            model = SentenceTransformer(self.model_name, **kwargs)
+            model.save_pretrained(export_dir)
+            export_dynamic_quantized_onnx_model(model, target, export_dir)
+        return SentenceTransformer(export_dir, model_kwargs={"file_name": file_name}, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "backend": self.backend or ("remote" if self.service_url else None),
+            "service_url": self.service_url,
+            "requests": self.requests,
+            "texts": self.texts,
+            "cache_hits": self.cache_hits,
+            "cache_hit_rate": round(self.cache_hits / self.texts, 3) if self.texts else 0.0,
+            "cache_entries": len(self._cache),
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+            "texts_per_second": round(self.encoded / self.encode_seconds, 1) if self.encode_seconds else 0.0,
+            "remote_failures": self.remote_failures,
+            "pending": self._queue.qsize(),
+        }
+
+
+class LangchainEmbeddingAdapter(_LangchainEmbeddings):
+    """langchain Embeddings 接口适配"""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def embed_documents(self, texts: List[str]) -> List[Vector]:
+        return self.service.embed(list(texts))
+
+    def embed_query(self, text: str) -> Vector:
+        return self.service.embed_query(text)
+
+
+class ChromaEmbeddingFunction(_ChromaEmbeddingFunction):
+    """chromadb EmbeddingFunction 接口适配"""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def __call__(self, input: List[str]) -> List[Vector]:
+        return self.service.embed(list(input))
+
+
+# 全局嵌入服务实例，同一进程内的检索和索引共享
+embedding_service = EmbeddingService()
+
+
+def serve(host: str = None, port: int = None):
+    """以本机 HTTP 服务运行，多个进程的请求在这里合并成批次"""
+    import asyncio
+
+    import uvicorn
+    from fastapi import FastAPI
+    from pydantic import BaseModel
+
+    class EmbedRequest(BaseModel):
+        texts: List[str]
+
+    # 服务端自己加载模型，不能再转发给 SERVICE_URL
+    embedding_service.service_url = ""
+    app = FastAPI(title="嵌入服务")
+
+    @app.post("/embed")
+    async def embed(request: EmbedRequest):
+        vectors = await asyncio.to_thread(embedding_service.embed, request.texts)
+        return {"embeddings": vectors}
+
+    @app.get("/stats")
+    async def stats():
+        return embedding_service.get_stats()
+
+    embedding_service._load_model()
+    uvicorn.run(app, host=host or EmbeddingConfig.SERVER_HOST, port=port or EmbeddingConfig.SERVER_PORT)
+
+
+def run_benchmark(num_texts: int = 512, concurrency: int = 16):
+    """对比逐条编码、凑批编码和缓存命中三种情况的吞吐量"""
+    samples = ["正在编辑 activity_retriever.py 的向量检索逻辑",
+               "Chrome - GitHub pull request review comments",
+               "微信 - 项目群聊 今天下午三点开会讨论索引积压",
+               "Visual Studio Code - embedding_service.py - AI_Watch_Dog"]
+    texts = [f"{samples[i % len(samples)]} #{i}" for i in range(num_texts)]
+
+    def report(name: str, count: int, seconds: float):
+        print(f"{name:<28} {count:>6} 条  {seconds:8.2f}s  {count / seconds:10.1f} 条/秒")
+
+    print(f"📊 嵌入吞吐量测试: {num_texts} 条文本, 并发 {concurrency}")
+
+    sequential = EmbeddingService(max_batch=1, max_delay=0, cache_size=0)
+    sequential.embed(["预热"])
+    count = min(num_texts, 64)
+    started = time.perf_counter()
+    for text in texts[:count]:
+        sequential.embed([text])
+    report("逐条编码", count, time.perf_counter() - started)
+    print(f"   backend: {sequential.backend}")
+
+    batched = EmbeddingService(cache_size=0)
+    batched._model, batched.backend = sequential._model, sequential.backend
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda text: batched.embed([text]), texts))
+    report("并发单条请求 (自动凑批)", num_texts, time.perf_counter() - started)
+    print(f"   平均批大小: {batched.get_stats()['avg_batch_size']}")
+
+    cached = EmbeddingService()
+    cached._model, cached.backend = sequential._model, sequential.backend
+    cached.embed(texts)
+    started = time.perf_counter()
+    cached.embed(texts)
+    report("缓存命中", num_texts, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="共享文本嵌入服务")
+    parser.add_argument("--serve", action="store_true", help="以本机 HTTP 服务运行")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--benchmark", type=int, nargs="?", const=512, metavar="N",
+                        help="运行吞吐量测试 (默认 512 条文本)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.host, args.port)
+    elif args.benchmark:
+        run_benchmark(args.benchmark, args.concurrency)
+    else:
+        parser.print_help()
@@ -69,7 +69,11 @@ except ImportError:
     FASTER_WHISPER_AVAILABLE = False
 
 # 导入配置和依赖
-from activity_retriever import create_db_connection, index_single_activity_record
+from activity_log_writer import activity_log_writer
+from activity_indexer import activity_indexer
+
+# 转录记录在写入事务中登记到向量索引队列，由后台线程批量索引
+activity_indexer.attach(activity_log_writer)
 from audio_config_optimized import OptimizedAudioConfig, OptimizedPresets
 
 # 文本转换
@@ -755,43 +759,11 @@ class EnhancedAudioRecorder:
                 'button': None
             }
 
-            conn = create_db_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor()
-
-                    insert_query = """
-                        INSERT INTO activity_log (
-                            timestamp, record_type, triggered_by, event_type,
-                            window_title, process_name, app_name, page_title, url,
-                            ocr_text, parser_type, mouse_x, mouse_y, button
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """
-
-                    cursor.execute(insert_query, (
-                        record_data['timestamp'], record_data['record_type'],
-                        record_data['triggered_by'], record_data['event_type'],
-                        record_data['window_title'], record_data['process_name'],
-                        record_data['app_name'], record_data['page_title'],
-                        record_data['url'], record_data['ocr_text'],
-                        record_data['parser_type'], record_data['mouse_x'],
-                        record_data['mouse_y'], record_data['button']
-                    ))
-
-                    conn.commit()
-                    record_id = cursor.lastrowid
-                    record_data['id'] = record_id
-
-                    # 索引到向量数据库
-                    try:
-                        index_single_activity_record(record_data)
-                    except Exception as e:
-                        logging.debug(f"索引失败: {e}")
-
-                except sqlite3.Error as e:
-                    logging.error(f"保存转录失败: {e}")
-                finally:
-                    conn.close()
+            # 交给 activity_log 写入服务批量提交，不阻塞处理线程
+            future = activity_log_writer.submit(record_data)
+            future.add_done_callback(
+                lambda f: logging.error(f"保存转录失败: {f.exception()}") if f.exception() else None
+            )
 
         except Exception as e:
             logging.error(f"保存转录错误: {e}")
@@ -814,6 +786,12 @@ class EnhancedAudioRecorder:
             self.stream.stop_stream()
             self.stream.close()
 
+        # 等待尚未提交的转录记录写入数据库
+        try:
+            activity_log_writer.flush(timeout=10)
+        except Exception as e:
+            logging.warning(f"等待转录记录写入超时: {e}")
+
         logging.info("增强版音频录制已停止")
         self._print_enhanced_stats()
 
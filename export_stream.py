@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# 每个输出块包含的行数，块越大写出越少、占用内存越多
+EXPORT_CHUNK_ROWS = 500
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def csv_chunks(rows: Iterable[Dict[str, Any]], fieldnames: List[str],
+               chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """逐块生成CSV文本，表头总是输出"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def json_array_chunks(rows: Iterable[Dict[str, Any]], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """逐块生成JSON数组，不在内存中拼接完整结果"""
+    parts = ["["]
+    first = True
+    count = 0
+    for row in rows:
+        item = json.dumps(row, ensure_ascii=False, indent=2)
+        parts.append(("\n" if first else ",\n") + item)
+        first = False
+        count += 1
+        if count % chunk_rows == 0:
+            yield "".join(parts)
+            parts = []
+    parts.append("\n]" if not first else "]")
+    yield "".join(parts)
+
+
+def ndjson_chunks(rows: Iterable[Dict[str, Any]], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """逐块生成NDJSON，每行一个JSON对象"""
+    parts = []
+    for row in rows:
+        parts.append(json.dumps(row, ensure_ascii=False) + "\n")
+        if len(parts) >= chunk_rows:
+            yield "".join(parts)
+            parts = []
+    if parts:
+        yield "".join(parts)
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的输出流，ParquetWriter 写入的字节按块取走"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def parquet_chunks(rows: Iterable[Dict[str, Any]], fieldnames: List[str],
+                   field_types: Optional[Dict[str, type]] = None,
+                   chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """每 chunk_rows 行写出一个 row group 并立即输出字节，需要 pyarrow"""
+    if not PARQUET_AVAILABLE:
+        raise ValueError("导出Parquet需要安装 pyarrow")
+    arrow_types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+    field_types = field_types or {}
+    schema = pa.schema([(name, arrow_types[field_types.get(name, str)]) for name in fieldnames])
+
+    def to_table(batch: List[Dict[str, Any]]):
+        columns = {}
+        for name in fieldnames:
+            cast = field_types.get(name, str)
+            columns[name] = [None if row.get(name) in (None, "") else cast(row.get(name)) for row in batch]
+        return pa.Table.from_pydict(columns, schema=schema)
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            writer.write_table(to_table(batch))
+            batch = []
+            yield sink.drain()
+    if batch:
+        writer.write_table(to_table(batch))
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(rows: Iterable[Dict[str, Any]], format: str, fieldnames: List[str],
+                  field_types: Optional[Dict[str, type]] = None) -> Iterator[Union[str, bytes]]:
+    """按格式把行迭代器转换为输出块迭代器"""
+    if format == "csv":
+        return csv_chunks(rows, fieldnames)
+    if format == "json":
+        return json_array_chunks(rows)
+    if format == "ndjson":
+        return ndjson_chunks(rows)
+    if format == "parquet":
+        return parquet_chunks(rows, fieldnames, field_types)
+    raise ValueError(f"不支持的导出格式: {format}")
+
+
+class ExportJob:
+    """一次导出任务的进度与吞吐统计"""
+
+    def __init__(self, name: str, format: str, total: Optional[int] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.format = format
+        self.total = total
+        self.rows = 0
+        self.bytes = 0
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = max((self.finished_at or time.time()) - self.started_at, 1e-6)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "format": self.format,
+            "status": self.status,
+            "rows": self.rows,
+            "total": self.total,
+            "progress": round(self.rows / self.total, 4) if self.total else None,
+            "bytes": self.bytes,
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(self.rows / elapsed, 1),
+            "mb_per_second": round(self.bytes / elapsed / 1024 / 1024, 3),
+        }
+
+
+class ExportTracker:
+    """记录进行中和最近完成的导出任务"""
+
+    def __init__(self, history: int = 20):
+        self._lock = threading.Lock()
+        self._running: Dict[str, ExportJob] = {}
+        self._finished: "deque[ExportJob]" = deque(maxlen=history)
+
+    def start(self, name: str, format: str, total: Optional[int] = None) -> ExportJob:
+        """创建导出任务；任务在 track() 开始迭代时才登记为进行中，响应未开始发送时不会残留"""
+        return ExportJob(name, format, total)
+
+    def count_rows(self, job: ExportJob, rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for row in rows:
+            job.rows += 1
+            yield row
+
+    def track(self, job: ExportJob, chunks: Iterable[Union[str, bytes]]) -> Iterator[Union[str, bytes]]:
+        """包装输出块迭代器，首次迭代时登记任务，统计字节数并在结束时归档任务"""
+        job.started_at = time.time()
+        with self._lock:
+            self._running[job.id] = job
+        try:
+            for chunk in chunks:
+                job.bytes += len(chunk.encode('utf-8')) if isinstance(chunk, str) else len(chunk)
+                yield chunk
+            job.status = "completed"
+        except GeneratorExit:
+            # 客户端中途断开
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            logging.error(f"导出失败 [{job.name}]: {e}")
+            raise
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._running.pop(job.id, None)
+                self._finished.append(job)
+            stats = job.to_dict()
+            logging.info(f"导出{job.status} [{job.name}.{job.format}]: {stats['rows']} 行, "
+                         f"{stats['bytes']} 字节, {stats['elapsed_seconds']} 秒, {stats['rows_per_second']} 行/秒")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._running.get(job_id) or next((j for j in self._finished if j.id == job_id), None)
+        return job.to_dict() if job else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": [job.to_dict() for job in self._running.values()],
+                "recent": [job.to_dict() for job in reversed(self._finished)],
+            }
+
+
+# 全局导出任务统计
+export_tracker = ExportTracker()
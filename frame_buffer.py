@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class FrameRingBuffer:
+    """预分配的帧环形缓冲区
+
+    一次性分配 N x H x W x 3 的帧块和并行的时间戳数组，采集线程把帧原地写入槽位，
+    消费者通过序号获取只读视图或一次性快照，稳态采集不再产生逐帧的堆分配。
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 2:
+            raise ValueError("环形缓冲区容量至少为2")
+        self.capacity = capacity
+        self._frames: Optional[np.ndarray] = None
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._count = 0  # 已提交的总帧数（单调递增，序号 = count - 1）
+        self._lock = threading.Lock()
+
+    def _allocate(self, shape: Tuple[int, ...], dtype) -> None:
+        """按首帧尺寸分配帧块（尺寸变化时重新分配）"""
+        self._frames = np.empty((self.capacity,) + tuple(shape), dtype=dtype)
+        self._count = 0
+
+    def acquire_slot(self) -> Optional[np.ndarray]:
+        """返回下一个待写入的槽位，可直接作为 cap.read() 的输出数组
+
+        该槽位在 commit() 之前对消费者不可见；缓冲区尚未分配时返回 None。
+        """
+        if self._frames is None:
+            return None
+        return self._frames[self._count % self.capacity]
+
+    def commit(self, frame: np.ndarray, timestamp: float) -> int:
+        """提交一帧，返回其序号
+
+        如果 frame 就是 acquire_slot() 返回的槽位（原地读取），则不发生拷贝；
+        否则拷贝到槽位中。帧尺寸、通道数或类型变化（如摄像头重连后分辨率改变）时
+        重新分配缓冲区，之前的帧随之丢弃。
+        """
+        if self._frames is None or frame.shape != self._frames.shape[1:] or frame.dtype != self._frames.dtype:
+            with self._lock:
+                self._allocate(frame.shape, frame.dtype)
+
+        slot_index = self._count % self.capacity
+        slot = self._frames[slot_index]
+        if not (frame is slot or np.may_share_memory(frame, slot)):
+            np.copyto(slot, frame)
+
+        with self._lock:
+            self._timestamps[slot_index] = timestamp
+            self._count += 1
+            return self._count - 1
+
+    def write(self, frame: np.ndarray, timestamp: float) -> int:
+        """拷贝一帧到下一个槽位"""
+        return self.commit(frame, timestamp)
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    @property
+    def latest_seq(self) -> int:
+        """最新帧序号，没有帧时为 -1"""
+        return self._count - 1
+
+    def get(self, seq: int) -> Optional[np.ndarray]:
+        """按序号获取只读视图，该帧已被覆盖时返回 None
+
+        视图直接引用槽位内存，持有时间应短于 (capacity - 1) 个采集周期。
+        """
+        with self._lock:
+            if self._frames is None or seq < 0 or seq >= self._count or seq <= self._count - self.capacity:
+                return None
+            view = self._frames[seq % self.capacity].view()
+        view.flags.writeable = False
+        return view
+
+    def latest(self) -> Optional[np.ndarray]:
+        """获取最新帧的只读视图"""
+        return self.get(self._count - 1)
+
+    def latest_timestamp(self) -> Optional[float]:
+        """获取最新帧的时间戳"""
+        with self._lock:
+            if self._count == 0:
+                return None
+            return float(self._timestamps[(self._count - 1) % self.capacity])
+
+    def snapshot(self, count: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """按时间顺序拷贝最近 count 帧（默认全部），返回 (帧数组, 时间戳数组)
+
+        快照与缓冲区不共享内存，适合耗时较长的分析任务持有。
+        """
+        with self._lock:
+            available = min(self._count, self.capacity)
+            if count is None or count > available:
+                count = available
+            if self._frames is None or count <= 0:
+                return np.empty((0,), dtype=np.uint8), np.empty((0,), dtype=np.float64)
+            first = self._count - count
+            indices = np.arange(first, self._count) % self.capacity
+            # 高级索引一次性生成连续拷贝
+            frames = self._frames[indices]
+            timestamps = self._timestamps[indices]
+        return frames, timestamps
+
+    def snapshot_frames(self, count: Optional[int] = None,
+                        time_format: str = '%Y-%m-%d-%H-%M-%S') -> Tuple[List[np.ndarray], List[str]]:
+        """快照并转换为分析器使用的 (帧列表, 时间字符串列表)
+
+        帧列表中的元素是快照数组的视图，不再逐帧拷贝。
+        """
+        frames, timestamps = self.snapshot(count)
+        return list(frames), [datetime.fromtimestamp(ts).strftime(time_format) for ts in timestamps]
+
+    def clear(self) -> None:
+        """清空缓冲区（保留已分配的内存）"""
+        with self._lock:
+            self._count = 0
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import threading
+from typing import Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+
+class FrameSubscription:
+    """单个视频流订阅者
+
+    只保存“有新帧”这一信号，始终读取最新帧；发送慢的客户端自然跳过中间帧，
+    不会阻塞其他订阅者。
+    """
+
+    def __init__(self, hub: "FrameBroadcastHub"):
+        self._hub = hub
+        self._event = asyncio.Event()
+        self._last_seq = -1
+        self.dropped = 0  # 因发送过慢被跳过的帧数
+
+    async def get(self) -> bytes:
+        """等待并返回比上次更新的一帧JPEG数据"""
+        while True:
+            latest = self._hub._latest
+            if latest is not None and latest[0] > self._last_seq:
+                seq, data = latest
+                if self._last_seq >= 0 and seq > self._last_seq + 1:
+                    self.dropped += seq - self._last_seq - 1
+                self._last_seq = seq
+                return data
+            self._event.clear()
+            await self._event.wait()
+
+    def close(self):
+        self._hub._unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class FrameBroadcastHub:
+    """编码一次、广播给所有 /video_feed 订阅者的视频帧中心
+
+    采集线程调用 publish()：仅在存在订阅者时编码JPEG，每帧最多编码一次；
+    编码结果通过 call_soon_threadsafe 交给事件循环，再以 asyncio.Event 唤醒各订阅者。
+    """
+
+    def __init__(self, jpeg_quality: int = 80):
+        self.jpeg_quality = jpeg_quality
+        self._subscribers: Set[FrameSubscription] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._latest: Optional[Tuple[int, bytes]] = None
+        self._pending: Optional[Tuple[int, bytes]] = None
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self.encoded_frames = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> FrameSubscription:
+        """在事件循环中创建订阅，配合 async with 使用"""
+        self._loop = asyncio.get_running_loop()
+        subscription = FrameSubscription(self)
+        self._subscribers.add(subscription)
+        logging.info(f"视频流订阅者加入，当前 {len(self._subscribers)} 个")
+        return subscription
+
+    def _unsubscribe(self, subscription: FrameSubscription):
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            logging.info(f"视频流订阅者离开，当前 {len(self._subscribers)} 个 (跳过 {subscription.dropped} 帧)")
+        if not self._subscribers:
+            # 无订阅者时释放最后一帧，下一个订阅者只接收新帧
+            self._latest = None
+
+    def publish(self, frame: np.ndarray, seq: int) -> bool:
+        """由采集线程调用，无订阅者时直接返回且不编码"""
+        loop = self._loop
+        if not self._subscribers or loop is None or loop.is_closed():
+            return False
+
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return False
+        self.encoded_frames += 1
+
+        with self._lock:
+            self._pending = (seq, buffer.tobytes())
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            try:
+                loop.call_soon_threadsafe(self._flush)
+            except RuntimeError:
+                # 事件循环已关闭
+                with self._lock:
+                    self._flush_scheduled = False
+                return False
+        return True
+
+    def _flush(self):
+        """在事件循环中发布最新帧并唤醒所有订阅者"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._flush_scheduled = False
+        if pending is None or not self._subscribers:
+            return
+        self._latest = pending
+        for subscription in self._subscribers:
+            subscription._event.set()
@@ -0,0 +1,125 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from activity_log_writer import DATABASE_FILE
+
+NAMESPACE_SEPARATOR = ":"  # 派生索引水位线的命名空间分隔符，如 'keywords:hourly'
+
+
+class IndexWatermarkStore:
+    """持久化的向量索引水位线
+
+    每个 (源表, 向量集合) 记录已写入向量库的最大源记录ID。索引批次在自己的SQLite事务中
+    推进水位线（只增不减），启动时读取一行即可恢复进度，不必扫描整个集合的元数据。
+    水位线以下可能存在的漏索引记录由 ActivityIndexer.reconcile() 按ID区间检查补齐。
+    """
+
+    def __init__(self, db_file: str = DATABASE_FILE):
+        self.db_file = db_file
+        self._table_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_table(self, conn: Optional[sqlite3.Connection] = None):
+        if self._table_ready:
+            return
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS index_watermarks (
+                    source_table TEXT NOT NULL,
+                    collection TEXT NOT NULL,
+                    last_indexed_id INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (source_table, collection)
+                )
+            ''')
+            conn.commit()
+            self._table_ready = True
+        finally:
+            if own_conn:
+                conn.close()
+
+    def get(self, source_table: str, collection: str,
+            conn: Optional[sqlite3.Connection] = None) -> Optional[int]:
+        """返回水位线，尚未记录时返回 None；传入 conn 时在该连接的当前事务中读取"""
+        own_conn = conn is None
+        if own_conn:
+            self.init_table()
+            conn = self._connect()
+        try:
+            row = conn.execute('SELECT last_indexed_id FROM index_watermarks WHERE source_table = ? AND collection = ?',
+                               (source_table, collection)).fetchone()
+        finally:
+            if own_conn:
+                conn.close()
+        return row[0] if row else None
+
+    def advance(self, source_table: str, collection: str, last_id: int,
+                conn: Optional[sqlite3.Connection] = None):
+        """把水位线推进到 last_id（不会回退）
+
+        传入 conn 时只在该连接的当前事务中执行，由调用方随批次一起提交。
+        """
+        own_conn = conn is None
+        if own_conn:
+            self.init_table()
+            conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO index_watermarks (source_table, collection, last_indexed_id, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(source_table, collection) DO UPDATE SET
+                    last_indexed_id = MAX(last_indexed_id, excluded.last_indexed_id),
+                    updated_at = excluded.updated_at
+            ''', (source_table, collection, int(last_id), time.time()))
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def reset(self, collection: Optional[str] = None, conn: Optional[sqlite3.Connection] = None):
+        """清除水位线（向量库被删除重建时调用）
+
+        collection 为 None 时只清除向量集合的水位线；带命名空间前缀的水位线（如 'keywords:'、
+        'fts:'）属于 SQLite 内的派生索引，不随向量库删除，只能按名称显式清除，并且调用方
+        必须同时清空对应的索引数据，否则重新同步会重复累加。传入 conn 时不提交。
+        """
+        own_conn = conn is None
+        if own_conn:
+            self.init_table()
+            conn = self._connect()
+        try:
+            if collection is None:
+                conn.execute('DELETE FROM index_watermarks WHERE instr(collection, ?) = 0', (NAMESPACE_SEPARATOR,))
+            else:
+                conn.execute('DELETE FROM index_watermarks WHERE collection = ?', (collection,))
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def get_all(self) -> List[Dict[str, Any]]:
+        self.init_table()
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute('SELECT * FROM index_watermarks ORDER BY source_table, collection')]
+        except sqlite3.Error as e:
+            logging.error(f"读取索引水位线失败: {e}")
+            return []
+        finally:
+            conn.close()
+
+
+# 全局水位线存储实例
+index_watermarks = IndexWatermarkStore()
@@ -0,0 +1,320 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from activity_log_writer import DATABASE_FILE
+from index_watermark import IndexWatermarkStore, index_watermarks
+
+SOURCE_TABLE = "activity_log"
+KEYWORD_WATERMARK = "keywords:hourly"   # 关键词统计在水位线表中的集合名
+KEYWORD_SYNC_BATCH_ROWS = 2000          # 每个事务累加的记录数
+KEYWORD_SYNC_INTERVAL = 10.0            # 后台同步间隔（秒）
+KEYWORD_REQUEST_SYNC_ROWS = 200         # 查询时顺带同步的最大记录数，保证请求耗时有上限
+
+# 词类型：zh/en 进入关键词云，空字符串只计入 unique_words
+KIND_CHINESE = "zh"
+KIND_ENGLISH = "en"
+KIND_OTHER = ""
+
+KEYWORD_STOP_WORDS = {
+    # 英文停用词
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did',
+    'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these',
+    'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them',
+    'my', 'your', 'his', 'her', 'its', 'our', 'their', 'mine', 'yours', 'hers', 'ours', 'theirs',
+    'not', 'no', 'yes', 'all', 'any', 'some', 'each', 'every', 'both', 'either', 'neither',
+    'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    # 中文停用词
+    '的', '了', '在', '是', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很',
+    '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这', '那', '来', '而',
+    '把', '学', '对', '从', '起', '还', '用', '过', '时', '后', '可以', '回', '什么', '没',
+    # 常见无意义词
+    'com', 'www', 'http', 'https', 'html', 'htm', 'php', 'asp', 'jsp',
+    'chrome', 'firefox', 'edge', 'safari', 'browser',
+    # 代码和技术相关的停用词
+    'div', 'class', 'span', 'script', 'style', 'function', 'var', 'let', 'const', 'import', 'export',
+    'component', 'props', 'data', 'method', 'computed', 'watch', 'mounted', 'created', 'beforemount',
+    'template', 'vue', 'react', 'angular', 'js', 'css', 'scss', 'sass', 'less', 'webpack', 'vite',
+    'npm', 'yarn', 'node', 'modules', 'package', 'json', 'config', 'build', 'dist', 'src',
+    'assets', 'static', 'public', 'lib', 'libs', 'vendor', 'polyfill', 'babel', 'eslint',
+    'prettier', 'typescript', 'tsx', 'jsx', 'ts', 'vue', 'svelte', 'next', 'nuxt',
+    # 文件路径相关
+    'users', 'jason', 'pycharmprojects', 'ai_watch_dog', 'frontend', 'backend', 'node_modules',
+    'vscode', 'cursor', 'ide', 'editor', 'terminal', 'console', 'command', 'cmd', 'powershell',
+    # 代码语法
+    'if', 'else', 'for', 'while', 'switch', 'case', 'break', 'continue', 'return', 'try', 'catch',
+    'finally', 'throw', 'async', 'await', 'promise', 'callback', 'then', 'resolve', 'reject',
+    # 通用技术词汇
+    'api', 'url', 'uri', 'get', 'post', 'put', 'delete', 'patch', 'head', 'options', 'cors',
+    'http', 'https', 'ssl', 'tls', 'tcp', 'udp', 'ip', 'dns', 'cdn', 'cache', 'session', 'cookie',
+    # HTML/CSS相关
+    'html', 'head', 'body', 'meta', 'title', 'link', 'script', 'style', 'img', 'src', 'href',
+    'alt', 'id', 'class', 'name', 'value', 'type', 'content', 'data', 'aria', 'role',
+    # 版本控制
+    'git', 'github', 'gitlab', 'commit', 'push', 'pull', 'merge', 'branch', 'master', 'main',
+    # 常见缩写和技术术语
+    'app', 'dev', 'prod', 'test', 'debug', 'log', 'info', 'warn', 'error', 'success', 'fail',
+    'true', 'false', 'null', 'undefined', 'nan', 'infinity',
+    # 数学和几何相关（来自SVG等）
+    'm0', '0l9', '5z', 'svg', 'path', 'rect', 'circle', 'line', 'polygon', 'polyline',
+    # 界面元素
+    'button', 'input', 'form', 'select', 'option', 'textarea', 'label', 'fieldset', 'legend',
+    'table', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot', 'caption',
+    # 动作相关
+    'click', 'hover', 'focus', 'blur', 'change', 'submit', 'reset', 'load', 'unload', 'resize',
+    'scroll', 'keydown', 'keyup', 'keypress', 'mousedown', 'mouseup', 'mousemove',
+}
+
+
+@lru_cache(maxsize=200000)
+def _keyword_kind(word: str) -> Optional[str]:
+    """返回词的类型，不计入统计的词返回 None（与原 /api/keywords 的过滤规则一致）"""
+    if len(word) < 2 or word in KEYWORD_STOP_WORDS or word.isdigit() or re.match(r'^[a-z]$', word):
+        return None
+    if re.search(r'[\u4e00-\u9fff]', word):
+        return KIND_CHINESE
+    # 进一步过滤英文技术词汇
+    if (len(word) > 2 and  # 英文词至少3个字符
+        not re.match(r'^[a-z]+[0-9]+$', word) and  # 不是字母+数字组合
+        not word.endswith('js') and not word.endswith('ts') and  # 不是文件扩展名
+        not word.endswith('css') and not word.endswith('html') and
+        not word.startswith('ba') and  # 不是组件前缀
+        not word.startswith('on') and  # 不是事件前缀
+        not re.match(r'^[a-z]{1,3}$', word) and  # 不是1-3个字母的简短缩写
+        word not in ['item', 'icon', 'list', 'grid', 'card', 'tabs']):  # 保留一些有意义的词如menu, text, panel
+        return KIND_ENGLISH
+    return KIND_OTHER
+
+
+def extract_record_keywords(record: Dict[str, Any]) -> Tuple[Counter, int]:
+    """统计一条记录中OCR文本、窗口标题和页面标题的词频，返回 (词频, 文本长度)"""
+    parts = []
+    if record.get('ocr_text'):
+        parts.append(record['ocr_text'])
+    window_title = record.get('window_title')
+    if window_title and window_title not in ['Unknown', 'Untitled']:
+        parts.append(window_title)
+    if record.get('page_title'):
+        parts.append(record['page_title'])
+    text = ' '.join(parts)
+    cleaned_text = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', text.lower())
+    counts = Counter(word for word in cleaned_text.split() if _keyword_kind(word) is not None)
+    return counts, len(text)
+
+
+def _hour_bucket(timestamp: Optional[str]) -> Optional[str]:
+    """ISO时间戳所在的小时桶，如 2025-06-01T14"""
+    if not timestamp or len(timestamp) < 13:
+        return None
+    return timestamp[:10] + 'T' + timestamp[11:13]
+
+
+class KeywordStatsStore:
+    """按小时/天分桶的增量词频统计
+
+    每条 activity_log 记录只分词一次，词频同时累加到所在小时和所在天的桶中；关键词云查询
+    对起始那天使用小时桶、之后的完整天使用天桶，7天窗口也只合并不到 7+24 个桶，
+    耗时与记录数无关，也不再需要按窗口截断记录。
+    增量同步按水位线进行，累加与推进水位线在同一事务中提交。
+    """
+
+    def __init__(self, db_file: str = DATABASE_FILE):
+        self.db_file = db_file
+        self.watermarks = index_watermarks if db_file == index_watermarks.db_file else IndexWatermarkStore(db_file)
+        self._schema_ready = False
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.synced = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        if self._schema_ready:
+            return
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keyword_hourly (
+                    hour TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (hour, word)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keyword_daily (
+                    day TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (day, word)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keyword_hour_stats (
+                    hour TEXT PRIMARY KEY,
+                    records INTEGER NOT NULL,
+                    text_length INTEGER NOT NULL
+                )
+            ''')
+            conn.commit()
+            self.watermarks.init_table(conn)
+            self._schema_ready = True
+        finally:
+            conn.close()
+
+    def sync(self, max_rows: int = KEYWORD_SYNC_BATCH_ROWS) -> int:
+        """把水位线之上的新记录累加到小时桶，返回本次处理的记录数"""
+        self.init_schema()
+        with self._sync_lock:
+            conn = self._connect()
+            try:
+                watermark = self.watermarks.get(SOURCE_TABLE, KEYWORD_WATERMARK) or 0
+                rows = conn.execute('''
+                    SELECT id, timestamp, ocr_text, window_title, page_title FROM activity_log
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (watermark, max_rows)).fetchall()
+                if not rows:
+                    return 0
+
+                # 分词在事务外完成
+                extracted = [(row['id'], _hour_bucket(row['timestamp']), *extract_record_keywords(dict(row)))
+                             for row in rows]
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    current = self.watermarks.get(SOURCE_TABLE, KEYWORD_WATERMARK, conn=conn) or 0
+                    extracted = [item for item in extracted if item[0] > current]  # 其他进程已累加的部分跳过
+                    word_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+                    hour_stats: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+                    for _, hour, counts, text_length in extracted:
+                        if hour is None:
+                            continue
+                        hour_stats[hour][0] += 1
+                        hour_stats[hour][1] += text_length
+                        for word, count in counts.items():
+                            word_counts[(hour, word)] += count
+
+                    conn.executemany('''
+                        INSERT INTO keyword_hourly (hour, word, kind, count) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(hour, word) DO UPDATE SET count = count + excluded.count
+                    ''', [(hour, word, _keyword_kind(word), count) for (hour, word), count in word_counts.items()])
+                    day_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+                    for (hour, word), count in word_counts.items():
+                        day_counts[(hour[:10], word)] += count
+                    conn.executemany('''
+                        INSERT INTO keyword_daily (day, word, kind, count) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(day, word) DO UPDATE SET count = count + excluded.count
+                    ''', [(day, word, _keyword_kind(word), count) for (day, word), count in day_counts.items()])
+                    conn.executemany('''
+                        INSERT INTO keyword_hour_stats (hour, records, text_length) VALUES (?, ?, ?)
+                        ON CONFLICT(hour) DO UPDATE SET records = records + excluded.records,
+                                                        text_length = text_length + excluded.text_length
+                    ''', [(hour, stats[0], stats[1]) for hour, stats in hour_stats.items()])
+                    if extracted:
+                        self.watermarks.advance(SOURCE_TABLE, KEYWORD_WATERMARK, extracted[-1][0], conn=conn)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                self.synced += len(extracted)
+                return len(extracted)
+            finally:
+                conn.close()
+
+    def rebuild(self):
+        """清空全部词频桶和水位线，之后的同步从头重新累加"""
+        self.init_schema()
+        with self._sync_lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for table in ('keyword_hourly', 'keyword_daily', 'keyword_hour_stats'):
+                        conn.execute(f'DELETE FROM {table}')
+                    self.watermarks.reset(KEYWORD_WATERMARK, conn=conn)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+            finally:
+                conn.close()
+        logging.info("关键词统计已清空，将从头重新累加")
+
+    def start(self, interval: float = KEYWORD_SYNC_INTERVAL):
+        """启动后台线程，持续累加新记录（含首次启动时的历史记录）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sync_loop, args=(interval,),
+                                                name="keyword-stats-sync", daemon=True)
+                self._thread.start()
+
+    def _sync_loop(self, interval: float):
+        while True:
+            try:
+                if self.sync() >= KEYWORD_SYNC_BATCH_ROWS:
+                    continue  # 追赶历史记录时不等待
+            except Exception as e:
+                logging.error(f"同步关键词统计失败: {e}")
+            time.sleep(interval)
+
+    def get_keywords(self, hours: int, top_n: int = 25, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """合并最近 hours 小时（按整点对齐）的桶，返回中英文各 top_n 个关键词及汇总信息"""
+        self.init_schema()
+        # 请求时补上最近一小段未同步的记录，历史积压由后台线程处理
+        try:
+            self.sync(KEYWORD_REQUEST_SYNC_ROWS)
+        except sqlite3.Error as e:
+            logging.warning(f"同步关键词统计失败，使用已有统计: {e}")
+
+        start_hour = _hour_bucket(((now or datetime.now()) - timedelta(hours=hours)).isoformat())
+        start_day = start_hour[:10]
+        # 起始那天用小时桶，之后的完整天用天桶（当天的天桶即截至现在的累计）
+        buckets = '''
+            SELECT word, kind, count FROM keyword_hourly WHERE hour >= ? AND hour <= ?
+            UNION ALL
+            SELECT word, kind, count FROM keyword_daily WHERE day > ?
+        '''
+        bucket_params = (start_hour, start_day + 'T23', start_day)
+        conn = self._connect()
+        try:
+            totals = conn.execute(f'''
+                SELECT word, kind, SUM(count) AS total FROM ({buckets})
+                GROUP BY word ORDER BY total DESC
+            ''', bucket_params).fetchall()
+            stats = conn.execute('SELECT COALESCE(SUM(records), 0), COALESCE(SUM(text_length), 0) '
+                                 'FROM keyword_hour_stats WHERE hour >= ?', (start_hour,)).fetchone()
+        finally:
+            conn.close()
+        top: Dict[str, List[Tuple[str, int]]] = {KIND_CHINESE: [], KIND_ENGLISH: []}
+        for row in totals:
+            words = top.get(row['kind'])
+            if words is not None and len(words) < top_n:
+                words.append((row['word'], row['total']))
+        return {
+            "chinese": top[KIND_CHINESE],
+            "english": top[KIND_ENGLISH],
+            "unique_words": len(totals),
+            "records_count": stats[0],
+            "total_text_length": stats[1],
+        }
+
+
+# 全局关键词统计实例
+keyword_stats = KeywordStatsStore()
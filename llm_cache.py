@@ -0,0 +1,194 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import APIConfig
+
+# 缓存值中代表“当前监控时间”的占位符，命中时替换为本次的时间
+TIME_PLACEHOLDER = "\x00TIME\x00"
+
+_PUNCTUATION_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_description(text: str) -> str:
+    """归一化视频描述：全半角统一、小写、去掉空白和标点"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _PUNCTUATION_RE.sub('', text)
+
+
+class MinHasher:
+    """基于字符 n-gram 的 MinHash 签名，用于近似重复描述的查找"""
+
+    def __init__(self, num_perm: int = 32, ngram: int = 3):
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self._seeds = list(range(1, num_perm + 1))
+
+    def shingles(self, text: str) -> set:
+        if len(text) <= self.ngram:
+            return {text} if text else set()
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        shingles = self.shingles(text)
+        if not shingles:
+            return tuple([0] * self.num_perm)
+        return tuple(min(hash((seed, s)) for s in shingles) for seed in self._seeds)
+
+    @staticmethod
+    def similarity(sig1: Tuple[int, ...], sig2: Tuple[int, ...]) -> float:
+        """估计 Jaccard 相似度"""
+        return sum(a == b for a, b in zip(sig1, sig2)) / len(sig1)
+
+
+class DescriptionResultCache:
+    """以归一化描述为键的 LLM 结果缓存 (TTL + LRU)
+
+    精确键为 (命名空间, 上下文, 归一化描述)；可选的 MinHash-LSH 索引让几乎相同的
+    描述也能复用上一次的分类结果。缓存值中的监控时间以占位符保存，命中时替换。
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None,
+                 near_duplicate: bool = None, near_threshold: float = None,
+                 num_perm: int = 32, bands: int = 8):
+        self.max_entries = max_entries or APIConfig.LLM_CACHE_MAX_ENTRIES
+        self.ttl = ttl or APIConfig.LLM_CACHE_TTL
+        self.near_duplicate = APIConfig.LLM_CACHE_NEAR_DUP if near_duplicate is None else near_duplicate
+        self.near_threshold = near_threshold or APIConfig.LLM_CACHE_NEAR_DUP_THRESHOLD
+        self.enabled = APIConfig.LLM_CACHE_ENABLED
+
+        self._hasher = MinHasher(num_perm=num_perm)
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._lock = threading.Lock()
+        # key -> (过期时间, 值模板, MinHash签名)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Any, Optional[Tuple[int, ...]]]]" = OrderedDict()
+        # (命名空间, 上下文, 分段序号, 分段值) -> {key}
+        self._lsh: Dict[Tuple, set] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # ---- 时间占位符处理 ----
+    @classmethod
+    def _to_template(cls, value: Any, time_str: Optional[str]) -> Any:
+        if not time_str:
+            return value
+        if isinstance(value, str):
+            return value.replace(time_str, TIME_PLACEHOLDER)
+        if isinstance(value, dict):
+            return {k: cls._to_template(v, time_str) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._to_template(v, time_str) for v in value]
+        return value
+
+    @classmethod
+    def _from_template(cls, value: Any, time_str: Optional[str]) -> Any:
+        if isinstance(value, str):
+            return value.replace(TIME_PLACEHOLDER, time_str or '')
+        if isinstance(value, dict):
+            return {k: cls._from_template(v, time_str) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._from_template(v, time_str) for v in value]
+        return value
+
+    # ---- LSH 索引 ----
+    def _band_keys(self, namespace: str, context: str, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [
+            (namespace, context, band, signature[band * self._rows:(band + 1) * self._rows])
+            for band in range(self._bands)
+        ]
+
+    def _remove(self, key: Tuple[str, str, str]):
+        _, _, signature = self._entries.pop(key)
+        if signature is not None:
+            for band_key in self._band_keys(key[0], key[1], signature):
+                bucket = self._lsh.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._lsh[band_key]
+
+    def _stat(self, namespace: str, name: str):
+        stats = self._stats.setdefault(namespace, {"hits": 0, "near_hits": 0, "misses": 0, "expired": 0, "stores": 0})
+        stats[name] += 1
+
+    # ---- 公共接口 ----
+    def get(self, namespace: str, description: str, context: str = "", time_str: str = None) -> Optional[Any]:
+        """查询缓存，未命中返回 None"""
+        if not self.enabled:
+            return None
+        normalized = normalize_description(description)
+        key = (namespace, context, normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._entries.move_to_end(key)
+                    self._stat(namespace, "hits")
+                    return self._from_template(entry[1], time_str)
+                self._remove(key)
+                self._stat(namespace, "expired")
+
+            if self.near_duplicate and normalized:
+                signature = self._hasher.signature(normalized)
+                candidates = set()
+                for band_key in self._band_keys(namespace, context, signature):
+                    candidates |= self._lsh.get(band_key, set())
+                best_key, best_score = None, 0.0
+                for candidate in candidates:
+                    candidate_entry = self._entries.get(candidate)
+                    if candidate_entry is None or candidate_entry[0] < now:
+                        continue
+                    score = MinHasher.similarity(signature, candidate_entry[2])
+                    if score > best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None and best_score >= self.near_threshold:
+                    self._entries.move_to_end(best_key)
+                    self._stat(namespace, "near_hits")
+                    logging.debug(f"LLM缓存近似命中 [{namespace}] 相似度 {best_score:.2f}")
+                    return self._from_template(self._entries[best_key][1], time_str)
+
+            self._stat(namespace, "misses")
+            return None
+
+    def put(self, namespace: str, description: str, value: Any, context: str = "", time_str: str = None):
+        """写入缓存，value 中的 time_str 会被替换为占位符"""
+        if not self.enabled:
+            return
+        normalized = normalize_description(description)
+        key = (namespace, context, normalized)
+        signature = self._hasher.signature(normalized) if self.near_duplicate and normalized else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, self._to_template(value, time_str), signature)
+            if signature is not None:
+                for band_key in self._band_keys(namespace, context, signature):
+                    self._lsh.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._stat(namespace, "stores")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._lsh.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            namespaces = {}
+            for namespace, stats in self._stats.items():
+                lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+                namespaces[namespace] = dict(
+                    stats,
+                    hit_rate=round((stats["hits"] + stats["near_hits"]) / lookups, 3) if lookups else 0.0
+                )
+            return {"enabled": self.enabled, "entries": len(self._entries), "namespaces": namespaces}
+
+
+# 全局描述级结果缓存，异常检测与自定义规则评估共享
+description_cache = DescriptionResultCache()
@@ -6,6 +6,16 @@ import asyncio
 import logging
 from typing import Optional, Dict, Any, Union
 import os
+import random
+import time
+import weakref
+from urllib.parse import urlsplit
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # 硅基流动API配置（用于RAG问答）- 从config.py读取
 # API密钥从.env文件读取
@@ -13,6 +23,106 @@ SILICONFLOW_API_KEY = APIConfig.DEEPSEEK_API_KEY
 SILICONFLOW_API_URL = APIConfig.DEEPSEEK_API_URL
 SILICONFLOW_MODEL = APIConfig.DEEPSEEK_MODEL
 
+class HTTPGateway:
+    """进程级共享的 HTTP/LLM 网关
+
+    - 每个事件循环复用一个 httpx.AsyncClient (keep-alive 连接池，可用时启用 HTTP/2)，
+      避免每次请求都重新进行 TCP+TLS 握手；
+    - 按上游主机限制并发数；
+    - 对网络错误、429 和 5xx 响应做带抖动的指数退避重试；
+    - timeout 为整次调用（含重试）的时间预算。
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self):
+        # httpx 客户端和信号量都绑定事件循环，按循环分别维护
+        self._loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    def _state(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        state = self._loop_states.get(loop)
+        if state is None or state["client"].is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE and APIConfig.HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=APIConfig.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=APIConfig.HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=APIConfig.HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=APIConfig.REQUEST_TIMEOUT
+            )
+            state = {"client": client, "semaphores": {}}
+            self._loop_states[loop] = state
+        return state
+
+    @staticmethod
+    def _upstream(url: str) -> str:
+        return urlsplit(url).netloc
+
+    def _semaphore(self, state: Dict[str, Any], upstream: str) -> asyncio.Semaphore:
+        semaphore = state["semaphores"].get(upstream)
+        if semaphore is None:
+            limit = APIConfig.UPSTREAM_CONCURRENCY.get(upstream, APIConfig.DEFAULT_UPSTREAM_CONCURRENCY)
+            semaphore = asyncio.Semaphore(limit)
+            state["semaphores"][upstream] = semaphore
+        return semaphore
+
+    async def request(self, method: str, url: str, timeout: float = None,
+                      retries: int = None, **kwargs) -> httpx.Response:
+        """发送请求，返回最后一次的响应；重试耗尽仍为网络错误时抛出异常"""
+        state = self._state()
+        upstream = self._upstream(url)
+        retries = APIConfig.HTTP_MAX_RETRIES if retries is None else retries
+        budget = timeout or APIConfig.REQUEST_TIMEOUT
+        deadline = time.monotonic() + budget
+        self.stats["requests"] += 1
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise httpx.TimeoutException(f"请求 {upstream} 超出时间预算 {budget:.1f} 秒")
+                async with self._semaphore(state, upstream):
+                    response = await state["client"].request(method, url, timeout=remaining, **kwargs)
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                logging.warning(f"{upstream} 返回 {response.status_code}，准备重试 ({attempt + 1}/{retries})")
+            except httpx.TransportError as e:
+                if attempt >= retries or deadline - time.monotonic() <= 0:
+                    self.stats["failures"] += 1
+                    raise
+                logging.warning(f"请求 {upstream} 网络错误: {e}，准备重试 ({attempt + 1}/{retries})")
+
+            delay = APIConfig.HTTP_RETRY_BASE_DELAY * (2 ** attempt)
+            delay = min(delay + random.uniform(0, delay), max(0.0, deadline - time.monotonic()))
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        """关闭当前事件循环上的客户端"""
+        loop = asyncio.get_running_loop()
+        state = self._loop_states.pop(loop, None)
+        if state is not None:
+            await state["client"].aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, http2=HTTP2_AVAILABLE and APIConfig.HTTP2_ENABLED)
+
+
+# 全局网关实例，所有上游 HTTP 调用共享
+http_gateway = HTTPGateway()
+
+
 class LLMService:
     @staticmethod
     async def get_response(prompt: str, use_siliconflow: bool = True) -> str:
@@ -37,7 +147,7 @@ class LLMService:
         # 可以在这里添加后处理逻辑
         return response.strip()
 
-async def query_siliconflow_model(prompt: str) -> str:
+async def query_siliconflow_model(prompt: str, max_tokens: int = 512) -> str:
     """调用硅基流动API获取回答（用于智能问答模块）"""
     try:
         logging.info(f"提示词长度: {len(prompt)}")
@@ -49,7 +159,7 @@ async def query_siliconflow_model(prompt: str) -> str:
                 {"role": "user", "content": prompt}
             ],
             "stream": False,
-            "max_tokens": 512,
+            "max_tokens": max_tokens,
             "temperature": 0.7,
             "top_p": 0.7,
             "top_k": 50,
@@ -60,37 +170,36 @@ async def query_siliconflow_model(prompt: str) -> str:
 
         logging.info(f"正在发送请求到硅基流动API")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                SILICONFLOW_API_URL,
-                headers={
-                    "Authorization": f"Bearer {SILICONFLOW_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json=request_data,
-                timeout=60.0
-            )
-
-            # 记录响应状态码
-            logging.info(f"硅基流动API响应状态码: {response.status_code}")
-
-            # 检查HTTP错误
-            if response.status_code != 200:
-                error_text = response.text
-                logging.error(f"硅基流动API返回HTTP错误: {response.status_code} - {error_text}")
-                return f"API调用失败: {response.status_code} - {error_text}"
-
-            # 解析响应
-            result = response.json()
-            logging.info(f"硅基流动API响应: {result.keys()}")
-
-            if "choices" in result and len(result["choices"]) > 0:
-                message = result["choices"][0].get("message", {})
-                content = message.get("content", "")
-                return content.strip()
-            else:
-                logging.error(f"硅基流动API响应缺少choices字段: {result}")
-                return "API响应格式错误"
+        response = await http_gateway.post(
+            SILICONFLOW_API_URL,
+            headers={
+                "Authorization": f"Bearer {SILICONFLOW_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json=request_data,
+            timeout=60.0
+        )
+
+        # 记录响应状态码
+        logging.info(f"硅基流动API响应状态码: {response.status_code}")
+
+        # 检查HTTP错误
+        if response.status_code != 200:
+            error_text = response.text
+            logging.error(f"硅基流动API返回HTTP错误: {response.status_code} - {error_text}")
+            return f"API调用失败: {response.status_code} - {error_text}"
+
+        # 解析响应
+        result = response.json()
+        logging.info(f"硅基流动API响应: {result.keys()}")
+
+        if "choices" in result and len(result["choices"]) > 0:
+            message = result["choices"][0].get("message", {})
+            content = message.get("content", "")
+            return content.strip()
+        else:
+            logging.error(f"硅基流动API响应缺少choices字段: {result}")
+            return "API响应格式错误"
 
     except Exception as e:
         logging.error(f"调用硅基流动模型异常: {str(e)}")
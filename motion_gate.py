@@ -0,0 +1,118 @@
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from config import VideoConfig
+from multi_modal_analyzer import MultiModalAnalyzer
+
+
+class MotionGate:
+    """基于运动分数的自适应分析触发器
+
+    采集线程每秒喂入一帧采样，触发器计算与上一采样帧、与上次分析帧的帧差分数：
+    - 大幅变化 (>= trigger_threshold) 时跳过等待立即分析；
+    - 到达分析间隔且有变化 (>= static_threshold) 时正常分析；
+    - 画面静止时跳过本轮并按 backoff 倍数延长间隔，直到 heartbeat 强制分析一次。
+    """
+
+    def __init__(self,
+                 base_interval: float = None,
+                 heartbeat: float = None,
+                 min_interval: float = None,
+                 static_threshold: float = None,
+                 trigger_threshold: float = None,
+                 backoff: float = None,
+                 enabled: bool = None):
+        self.base_interval = base_interval or VideoConfig.ANALYSIS_INTERVAL
+        self.heartbeat = max(heartbeat or VideoConfig.ANALYSIS_HEARTBEAT, self.base_interval)
+        self.min_interval = min_interval if min_interval is not None else VideoConfig.MOTION_MIN_INTERVAL
+        self.static_threshold = static_threshold if static_threshold is not None else VideoConfig.MOTION_STATIC_THRESHOLD
+        self.trigger_threshold = trigger_threshold if trigger_threshold is not None else VideoConfig.MOTION_TRIGGER_THRESHOLD
+        self.backoff = backoff or VideoConfig.ANALYSIS_BACKOFF
+        self.enabled = VideoConfig.MOTION_GATE_ENABLED if enabled is None else enabled
+        self.gray_size = (VideoConfig.MOTION_GRAY_WIDTH, VideoConfig.MOTION_GRAY_HEIGHT)
+
+        now = time.time()
+        self.last_run = now
+        self.current_interval = self.base_interval
+        self.next_check = now + self.base_interval
+
+        self._prev_gray: Optional[np.ndarray] = None
+        self._reference_gray: Optional[np.ndarray] = None  # 上次分析时的画面
+        self.peak_motion = 0.0  # 上次分析以来的最大运动分数
+        self.last_motion = 0.0
+
+        # 统计计数
+        self.executed = 0
+        self.skipped = 0
+        self.executed_by_reason = {"motion": 0, "change": 0, "heartbeat": 0, "interval": 0}
+
+    def observe(self, frame: np.ndarray) -> float:
+        """喂入一帧采样，返回本次运动分数"""
+        gray = MultiModalAnalyzer.to_motion_gray(frame, self.gray_size)
+        score = 0.0
+        if self._prev_gray is not None:
+            score = MultiModalAnalyzer.compute_motion_score(self._prev_gray, gray)
+        if self._reference_gray is not None:
+            # 与上次分析帧比较，捕捉缓慢累积的变化
+            score = max(score, MultiModalAnalyzer.compute_motion_score(self._reference_gray, gray))
+        elif self._prev_gray is None:
+            # 首帧视为大幅变化，保证启动后尽快分析一次
+            score = 1.0
+        self._prev_gray = gray
+        self.last_motion = score
+        self.peak_motion = max(self.peak_motion, score)
+        return score
+
+    def should_analyze(self, now: float = None) -> Optional[str]:
+        """判断本轮是否分析，返回触发原因或 None（跳过）"""
+        now = now or time.time()
+        elapsed = now - self.last_run
+
+        if not self.enabled:
+            return "interval" if elapsed >= self.base_interval else None
+
+        if elapsed < self.min_interval:
+            return None
+        if self.peak_motion >= self.trigger_threshold:
+            return "motion"
+        if now < self.next_check:
+            return None
+        if self.peak_motion >= self.static_threshold:
+            return "change"
+        if elapsed >= self.heartbeat:
+            return "heartbeat"
+
+        # 画面静止：跳过本轮并退避
+        self.skipped += 1
+        self.current_interval = min(self.current_interval * self.backoff, self.heartbeat)
+        self.next_check = min(now + self.current_interval, self.last_run + self.heartbeat)
+        logging.debug(f"画面静止 (运动分数 {self.peak_motion:.4f})，跳过分析，下次检查间隔 {self.current_interval:.0f} 秒")
+        return None
+
+    def mark_executed(self, reason: str, now: float = None):
+        """记录一次已执行的分析"""
+        now = now or time.time()
+        self.executed += 1
+        self.executed_by_reason[reason] = self.executed_by_reason.get(reason, 0) + 1
+        if reason != "heartbeat":
+            self.current_interval = self.base_interval
+        self.last_run = now
+        self.next_check = now + self.current_interval
+        self._reference_gray = self._prev_gray
+        self.peak_motion = 0.0
+
+    def get_stats(self) -> Dict:
+        total = self.executed + self.skipped
+        return {
+            "enabled": self.enabled,
+            "executed": self.executed,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / total, 3) if total else 0.0,
+            "executed_by_reason": dict(self.executed_by_reason),
+            "current_interval": self.current_interval,
+            "last_motion": round(self.last_motion, 4),
+            "peak_motion": round(self.peak_motion, 4),
+        }
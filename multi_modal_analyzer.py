@@ -20,7 +20,12 @@ from typing import List, Tuple, Dict
 import logging
 
 from utility import video_chat_async,chat_request,insert_txt,video_chat_async_limit_frame
-from config import RAGConfig
+from config import RAGConfig, VideoConfig
+from llm_service import http_gateway
+from alert_rule_engine import AlertRuleEngine
+from alert_rule_store import rule_store
+from llm_cache import description_cache
+from alert_bus import AlertBus, alert_bus as default_alert_bus
 
 # 导入双数据库组件 (仅SQLite部分)
 from video_database import video_db
@@ -45,8 +50,7 @@ async def add_activity_to_vector_db_via_api(activity_id: int, activity_data: Dic
             "activity_data": activity_data
         }
 
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(rag_server_url, json=payload)
+        response = await http_gateway.post(rag_server_url, json=payload, timeout=10.0)
 
         if response.status_code == 200:
             logging.info(f"活动 {activity_id} 已成功通过API发送到向量数据库。")
@@ -69,10 +73,12 @@ from prompt import prompt_detect, prompt_vieo
 from llm_service import chat_completion
 
 class MultiModalAnalyzer:
-    def __init__(self, alert_queue=None):
+    def __init__(self, alert_bus: AlertBus = None, camera_id: str = "cam0"):
         self.message_queue = []
         self.time_step_story = []
-        self.alert_queue = alert_queue
+        self.alert_bus = alert_bus or default_alert_bus  # 预警发布总线，可在任意线程发布
+        self.camera_id = camera_id  # 所属摄像头ID，写入预警和活动记录
+        self.rule_engine = AlertRuleEngine()  # 自定义预警规则批量评估
 
         # 智能活动跟踪器配置
         self.current_activities = {}  # {activity_type: {activity_id, start_time, last_update}}
@@ -112,22 +118,33 @@ class MultiModalAnalyzer:
         """生成活动描述"""
         return f"监控显示：{timestamp}，{activity_type}"
 
+    @staticmethod
+    def to_motion_gray(frame: np.ndarray, size: Tuple[int, int] = None) -> np.ndarray:
+        """转换为用于帧差计算的灰度图，可选缩小尺寸以降低开销"""
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if size is not None:
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return gray
+
+    @staticmethod
+    def compute_motion_score(gray1: np.ndarray, gray2: np.ndarray) -> float:
+        """帧差法运动分数：变化像素占比 (0~1)"""
+        diff = cv2.absdiff(gray1, gray2)
+        thresh = cv2.threshold(diff, 25, 255, cv2.THRESH_BINARY)[1]
+        return np.count_nonzero(thresh) / thresh.size
+
     def detect_activity(self, frames: List[np.ndarray]) -> bool:
         """检测画面中是否有活动"""
         if len(frames) < 2:
             return False
 
         # 使用帧差法检测运动
-        frame1 = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
-        frame2 = cv2.cvtColor(frames[-1], cv2.COLOR_BGR2GRAY)
-
-        # 计算帧差
-        diff = cv2.absdiff(frame1, frame2)
-        thresh = cv2.threshold(diff, 25, 255, cv2.THRESH_BINARY)[1]
+        frame1 = self.to_motion_gray(frames[0])
+        frame2 = self.to_motion_gray(frames[-1])
 
         # 如果变化像素超过阈值，认为有活动
-        change_ratio = np.count_nonzero(thresh) / thresh.size
-        return change_ratio > 0.01
+        change_ratio = self.compute_motion_score(frame1, frame2)
+        return change_ratio > VideoConfig.MOTION_STATIC_THRESHOLD
 
     async def analyze_activity(self, frames: List[np.ndarray]) -> str:
         """分析活动类型，调用大模型进行视频描述"""
@@ -169,12 +186,13 @@ class MultiModalAnalyzer:
                     'image_path': image_path,
                     'metadata': {
                         'detection_method': 'video_analysis',
-                        'source': 'multi_modal_analyzer'
+                        'source': 'multi_modal_analyzer',
+                        'camera_id': self.camera_id
                     },
                     'source_type': 'activity_detection'
                 }
 
-                activity_id = video_db.insert_activity(activity_data)
+                activity_id = await video_db.aio.insert_activity(activity_data)
                 if activity_id:
                     # [修改] 调用新的API函数
                     await add_activity_to_vector_db_via_api(activity_id, activity_data)
@@ -219,12 +237,13 @@ class MultiModalAnalyzer:
                 'image_path': image_path,
                 'metadata': {
                     'detection_method': 'intelligent_tracking',
-                    'source': 'multi_modal_analyzer'
+                    'source': 'multi_modal_analyzer',
+                    'camera_id': self.camera_id
                 },
                 'source_type': 'activity_tracking'
             }
 
-            activity_id = video_db.insert_activity(activity_data)
+            activity_id = await video_db.aio.insert_activity(activity_data)
             if activity_id:
                 self.current_activities[activity_type] = {
                     'activity_id': activity_id,
@@ -256,7 +275,7 @@ class MultiModalAnalyzer:
         duration_minutes = (end_time - start_time).total_seconds() / 60
 
         # 无论持续时间长短，都更新数据库中的结束时间和持续时长
-        video_db.update_activity_end_time(
+        await video_db.aio.update_activity_end_time(
             activity_info['activity_id'],
             end_time.strftime('%Y-%m-%d %H:%M:%S'),
             duration_minutes
@@ -280,18 +299,15 @@ class MultiModalAnalyzer:
                 "duration_minutes": duration_minutes,
                 "level": alert_level,
                 "activity_id": activity_info['activity_id'],
-                "alert_key": f"{activity_type}_结束_{end_time.strftime('%Y-%m-%d %H:%M:%S')}",
-                "is_custom": is_custom  # 添加标识字段
+                "alert_key": f"{self.camera_id}_{activity_type}_结束_{end_time.strftime('%Y-%m-%d %H:%M:%S')}",
+                "is_custom": is_custom,  # 添加标识字段
+                "camera_id": self.camera_id
             }
 
-            # 这里需要将结束预警发送到预警队列
-            # 由于架构限制，可以尝试通过导入获取alert_queue
+            # 发布到预警总线
             try:
-                if self.alert_queue:
-                    self.alert_queue.put(end_alert)
-                    logging.info(f"活动结束预警已发送: {activity_type}, 持续{duration_minutes:.1f}分钟")
-                else:
-                    logging.warning("Alert queue is not available, a活动结束预警未发送")
+                self.alert_bus.publish(end_alert)
+                logging.info(f"活动结束预警已发送: {activity_type}, 持续{duration_minutes:.1f}分钟")
             except Exception as e:
                 logging.warning(f"发送结束预警失败: {e}")
 
@@ -338,22 +354,18 @@ class MultiModalAnalyzer:
                 "duration_minutes": 0,
                 "image_url": f"/video_warning/{os.path.basename(image_path)}" if image_path else None,
                 "video_url": None,  # 开始预警通常没有视频
-                "alert_key": f"{activity_type}_{timestamp}",
-                "is_custom": is_custom  # 添加标识字段
+                "alert_key": f"{self.camera_id}_{activity_type}_{timestamp}",
+                "is_custom": is_custom,  # 添加标识字段
+                "camera_id": self.camera_id
             }
 
             print(f"📋 构造的预警消息: {start_alert}")
 
-            # 发送到预警队列
+            # 发布到预警总线
             try:
-                print(f"🔄 尝试发送到预警队列...")
-                if self.alert_queue:
-                    self.alert_queue.put(start_alert)
-                    print(f"✅ 活动开始预警已成功发送到队列: {activity_type}, 级别={level}")
-                    logging.info(f"活动开始预警已发送: {activity_type}, 级别={level}")
-                else:
-                    print(f"❌ Alert queue is not available, a开始预警未发送")
-                    logging.warning("Alert queue is not available, 开始预警未发送")
+                self.alert_bus.publish(start_alert)
+                print(f"✅ 活动开始预警已成功发布: {activity_type}, 级别={level}")
+                logging.info(f"活动开始预警已发送: {activity_type}, 级别={level}")
             except Exception as e:
                 print(f"❌ 发送开始预警失败: {e}")
                 logging.warning(f"发送开始预警失败: {e}")
@@ -426,8 +438,15 @@ class MultiModalAnalyzer:
                     time=timestamps[0]
                 )
 
-                # 调用DeepSeek进行标准检测
-                detection_result_raw = await chat_completion(detect_prompt, model="deepseek")
+                # 相同/近似描述直接复用上次的检测结果，否则调用DeepSeek进行标准检测
+                detection_result_raw = description_cache.get("detect", description, time_str=timestamps[0])
+                if detection_result_raw is not None:
+                    print(f"\n♻️ 复用缓存的异常检测结果")
+                else:
+                    detection_result_raw = await chat_completion(detect_prompt, model="deepseek")
+                    if (isinstance(detection_result_raw, str) and not detection_result_raw.startswith("错误：")
+                            and not detection_result_raw.startswith("API调用")):
+                        description_cache.put("detect", description, detection_result_raw, time_str=timestamps[0])
 
                 # 检查返回结果是否表示错误
                 if isinstance(detection_result_raw, str) and detection_result_raw.startswith("错误："):
@@ -452,7 +471,7 @@ class MultiModalAnalyzer:
                             # 保存关键帧
                             image_path = None
                             if frames:
-                                image_path = f"video_warning/activity_{int(time.time())}.jpg"
+                                image_path = f"video_warning/activity_{self.camera_id}_{int(time.time())}.jpg"
                                 os.makedirs("video_warning", exist_ok=True)
                                 cv2.imwrite(image_path, frames[-1])
 
@@ -483,8 +502,7 @@ class MultiModalAnalyzer:
     async def apply_custom_alert_rules(self, description, timestamp):
         """应用自定义预警规则进行检测"""
         try:
-            # 获取当前激活的自定义规则（这里需要从video_server获取）
-            # 由于架构限制，我们先创建一个简化的实现
+            # 获取当前激活的自定义规则（与video_server共享的规则注册表）
             all_rules = await self.get_active_custom_rules()
 
             # 过滤掉系统预设规则，只处理真正的用户自定义规则
@@ -494,48 +512,8 @@ class MultiModalAnalyzer:
                 logging.debug("没有启用的用户自定义规则")
                 return []
 
-            triggered_alerts = []
-
-            for rule in custom_rules:
-                if not rule.get('enabled', False):
-                    continue
-
-                # 使用生成的提示词进行检测
-                custom_prompt = rule.get('generated_prompt', '')
-                if not custom_prompt:
-                    continue
-
-                # 将当前视频描述和时间戳插入到自定义提示词中
-                detection_prompt = f"""
-                {custom_prompt}
-
-                当前视频描述：{description}
-                当前时间：{timestamp}
-
-                请根据规则检测是否触发预警，如果触发请返回："{timestamp} {rule['name']}"
-                如果未触发请返回："未检测到"
-                """
-
-                try:
-                    logging.info(f"🔍 检测自定义规则: {rule['name']}")
-                    custom_result = await chat_completion(detection_prompt, model="deepseek")
-                    logging.info(f"🤖 LLM检测结果: '{custom_result}'")
-
-                    if custom_result and custom_result.strip() != "未检测到" and rule['name'] in custom_result:
-                        triggered_alerts.append({
-                            'rule_id': rule['id'],
-                            'rule_name': rule['name'],
-                            'condition': rule['condition'],
-                            'level': rule['level'],
-                            'detection_result': custom_result.strip(),
-                            'timestamp': timestamp
-                        })
-                        logging.info(f"✅ 用户自定义规则触发: {rule['name']}")
-                    else:
-                        logging.info(f"❌ 自定义规则未触发: {rule['name']} (结果: '{custom_result}')")
-
-                except Exception as e:
-                    logging.error(f"执行自定义规则检测失败 [{rule['name']}]: {e}")
+            # 一次结构化调用评估所有启用的规则 (超出上下文预算时自动分批/并发)
+            triggered_alerts = await self.rule_engine.evaluate(custom_rules, description, timestamp)
 
             if triggered_alerts:
                 logging.info(f"本次共触发{len(triggered_alerts)}个用户自定义规则")
@@ -547,24 +525,9 @@ class MultiModalAnalyzer:
             return []
 
     async def get_active_custom_rules(self):
-        """获取当前激活的自定义规则（简化实现）"""
+        """获取当前的自定义规则（读取进程内规则注册表的快照，无I/O）"""
         try:
-            # 这是一个简化的实现，实际应用中应该从global变量或数据库获取
-            # 由于模块间的耦合问题，这里使用一个简化的方法
-            import httpx
-
-            async with httpx.AsyncClient() as client:
-                try:
-                    response = await client.get("http://localhost:16532/api/custom-alert-rules", timeout=5.0)
-                    if response.status_code == 200:
-                        data = response.json()
-                        return data.get('rules', [])
-                except:
-                    pass
-
-            # 如果无法获取，返回空列表
-            return []
-
+            return list(rule_store.snapshot())
         except Exception as e:
             logging.warning(f"获取自定义规则失败: {e}")
             return []
@@ -590,7 +553,7 @@ class MultiModalAnalyzer:
             image_path = None
             if frames:
                 timestamp_str = formatted_timestamp.replace(':', '-').replace(' ', '-')
-                alert_id = f"custom_{custom_alert['rule_id']}_{timestamp_str}"
+                alert_id = f"custom_{self.camera_id}_{custom_alert['rule_id']}_{timestamp_str}"
                 image_path = f"video_warning/{alert_id}.jpg"
                 os.makedirs("video_warning", exist_ok=True)
                 cv2.imwrite(image_path, frames[-1])
@@ -640,34 +603,11 @@ class MultiModalAnalyzer:
         """发送自定义预警到系统"""
         try:
             print(f"🚨 正在发送自定义预警: {alert_message.get('content', 'Unknown')}")
-
-            # 直接访问全局的video_processor实例来发送预警
-            import video_server
-
-            print(f"🔍 检查video_server模块: hasattr(video_server, 'video_processor') = {hasattr(video_server, 'video_processor')}")
-
-            if hasattr(video_server, 'video_processor'):
-                print(f"🔍 video_processor实例: {video_server.video_processor}")
-                if video_server.video_processor:
-                    print(f"🔍 alert_queue是否存在: {hasattr(video_server.video_processor, 'alert_queue')}")
-                    if hasattr(video_server.video_processor, 'alert_queue'):
-                        # 直接将预警放入队列
-                        video_server.video_processor.alert_queue.put(alert_message)
-                        print(f"✅ 自定义预警已成功发送到队列: {alert_message.get('content', 'Unknown')}")
-                        logging.info(f"自定义预警已发送到队列: {alert_message.get('content', 'Unknown')}")
-                        return True
-                    else:
-                        print(f"❌ video_processor没有alert_queue属性")
-                        logging.error("video_processor没有alert_queue属性")
-                        return False
-                else:
-                    print(f"❌ video_processor实例为None")
-                    logging.error("video_processor实例为None")
-                    return False
-            else:
-                print(f"❌ video_server模块没有video_processor属性")
-                logging.error("video_server模块没有video_processor属性")
-                return False
+            alert_message.setdefault("camera_id", self.camera_id)
+            self.alert_bus.publish(alert_message)
+            print(f"✅ 自定义预警已成功发布: {alert_message.get('content', 'Unknown')}")
+            logging.info(f"自定义预警已发布: {alert_message.get('content', 'Unknown')}")
+            return True
 
         except Exception as e:
             print(f"❌ 发送自定义预警异常: {e}")
@@ -694,13 +634,14 @@ class MultiModalAnalyzer:
                 'metadata': {
                     'source': 'video_analysis',
                     'analysis_type': 'description',
-                    'content_length': len(description)
+                    'content_length': len(description),
+                    'camera_id': self.camera_id
                 },
                 'source_type': 'video_summary'
             }
 
             # 插入SQLite
-            activity_id = video_db.insert_activity(activity_data)
+            activity_id = await video_db.aio.insert_activity(activity_data)
 
             # 2. 添加到向量数据库（使用优化的文档构建）
             if activity_id:
@@ -710,25 +651,21 @@ class MultiModalAnalyzer:
 
             # 3. 保留原有的RAG服务器兼容性（仅为视频描述）
             try:
-                import httpx
-                from config import RAGConfig
-
                 summary = f"{formatted_time} - {description}"
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        RAGConfig.VECTOR_API_URL,
-                        json={
-                            "docs": [summary],
-                            "table_name": "text_summaries",
-                            "event_timestamps": [formatted_time]
-                        },
-                        timeout=10.0
-                    )
-
-                    if response.status_code == 200:
-                        logging.info(f"视频描述同时发送到RAG服务器成功")
-                    else:
-                        logging.warning(f"RAG服务器存储失败，但双数据库存储成功")
+                response = await http_gateway.post(
+                    RAGConfig.VECTOR_API_URL,
+                    json={
+                        "docs": [summary],
+                        "table_name": "text_summaries",
+                        "event_timestamps": [formatted_time]
+                    },
+                    timeout=10.0
+                )
+
+                if response.status_code == 200:
+                    logging.info(f"视频描述同时发送到RAG服务器成功")
+                else:
+                    logging.warning(f"RAG服务器存储失败，但双数据库存储成功")
             except Exception as rag_error:
                 logging.warning(f"RAG服务器不可用，仅使用双数据库: {rag_error}")
 
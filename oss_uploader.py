@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+import cv2
+import numpy as np
+
+from config import OSSConfig, VideoConfig
+
+
+class OSSBackend:
+    """阿里云OSS存储后端，进程内复用同一个带连接池的 Bucket"""
+
+    def __init__(self):
+        import oss2
+
+        auth = oss2.Auth(OSSConfig.ACCESS_KEY_ID, OSSConfig.ACCESS_KEY_SECRET)
+        # Session 内部持有 requests 连接池，所有上传线程共享
+        session = oss2.Session(pool_size=OSSConfig.UPLOAD_WORKERS)
+        self.bucket = oss2.Bucket(
+            auth, OSSConfig.ENDPOINT, OSSConfig.BUCKET,
+            session=session,
+            connect_timeout=OSSConfig.CONNECT_TIMEOUT
+        )
+
+    def put(self, object_key: str, data: Union[bytes, str]) -> str:
+        if isinstance(data, str):
+            # 本地文件路径
+            self.bucket.put_object_from_file(object_key, data)
+        else:
+            self.bucket.put_object(object_key, data)
+        return f"https://{OSSConfig.BUCKET}.{OSSConfig.ENDPOINT}/{object_key}"
+
+
+class LocalFileBackend:
+    """本地文件系统存储后端，用于离线开发和测试"""
+
+    def __init__(self, root_dir: str = None, url_prefix: str = None):
+        self.root_dir = os.path.abspath(root_dir or OSSConfig.LOCAL_ROOT)
+        self.url_prefix = url_prefix or OSSConfig.LOCAL_URL_PREFIX or f"file://{self.root_dir}/"
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def put(self, object_key: str, data: Union[bytes, str]) -> str:
+        path = os.path.join(self.root_dir, *object_key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, str):
+            with open(data, 'rb') as src:
+                data = src.read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return f"{self.url_prefix}{object_key}"
+
+
+class OSSUploader:
+    """带连接池、并行上传和指数退避重试的对象存储上传服务
+
+    同步接口可在任意线程调用；异步接口把阻塞上传放到有界线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, backend=None, max_workers: int = None, max_retries: int = None):
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+        self.max_workers = max_workers or OSSConfig.UPLOAD_WORKERS
+        self.max_retries = max_retries or OSSConfig.UPLOAD_MAX_RETRIES
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="oss-upload")
+
+        # 统计信息
+        self.uploaded = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def backend(self):
+        """按配置惰性创建存储后端"""
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    if OSSConfig.BACKEND == "local":
+                        self._backend = LocalFileBackend()
+                    else:
+                        self._backend = OSSBackend()
+                    logging.info(f"对象存储后端已初始化: {type(self._backend).__name__}")
+        return self._backend
+
+    def put(self, object_key: str, data: Union[bytes, str]) -> str:
+        """上传一个对象并返回URL，失败时按指数退避重试"""
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                url = self.backend.put(object_key, data)
+                self.uploaded += 1
+                return url
+            except Exception as e:
+                last_error = e
+                logging.error(f"上传到OSS失败 (尝试 {attempt + 1}/{self.max_retries}) [{object_key}]: {e}")
+                if attempt + 1 < self.max_retries:
+                    self.retries += 1
+                    delay = OSSConfig.RETRY_BASE_DELAY * (2 ** attempt)
+                    time.sleep(delay + random.uniform(0, delay / 2))
+        self.failures += 1
+        raise Exception(f"上传到OSS失败，已重试{self.max_retries}次: {last_error}")
+
+    @staticmethod
+    def new_frame_key(prefix: str, index: int = 0) -> str:
+        """生成不会在多路摄像头间冲突的对象键"""
+        return f"{prefix}{int(time.time())}_{uuid.uuid4().hex[:8]}_{index}.jpg"
+
+    def put_frame(self, frame: np.ndarray, object_key: str) -> str:
+        """JPEG编码并上传一帧"""
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, VideoConfig.JPEG_QUALITY])
+        if not ok:
+            raise Exception(f"图像编码失败: {object_key}")
+        return self.put(object_key, buffer.tobytes())
+
+    def upload_frames(self, frames: List[np.ndarray], prefix: str = None) -> List[str]:
+        """并行上传多帧，按输入顺序返回URL列表"""
+        prefix = prefix or OSSConfig.ANALYSIS_PREFIX
+        futures = [
+            self._executor.submit(self.put_frame, frame, self.new_frame_key(prefix, i))
+            for i, frame in enumerate(frames)
+        ]
+        return [future.result() for future in futures]
+
+    async def put_async(self, object_key: str, data: Union[bytes, str]) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.put, object_key, data)
+
+    async def upload_frames_async(self, frames: List[np.ndarray], prefix: str = None) -> List[str]:
+        """异步并行上传多帧，按输入顺序返回URL列表"""
+        prefix = prefix or OSSConfig.ANALYSIS_PREFIX
+        loop = asyncio.get_running_loop()
+        tasks = [
+            loop.run_in_executor(self._executor, self.put_frame, frame, self.new_frame_key(prefix, i))
+            for i, frame in enumerate(frames)
+        ]
+        return list(await asyncio.gather(*tasks))
+
+    def get_stats(self):
+        return {
+            "backend": type(self._backend).__name__ if self._backend else None,
+            "uploaded": self.uploaded,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# 全局上传服务实例
+oss_uploader = OSSUploader()
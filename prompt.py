@@ -67,4 +67,22 @@ prompt_activity_search = """
 {query}
 
 请基于上述监控记录，用友好自然的语言回答用户的问题。
-"""
\ No newline at end of file
+"""
+# prompt_rule_batch 用于一次性检测所有用户自定义预警规则
+prompt_rule_batch = """你是专业的视频监控预警分析师，请根据视频描述逐条判断以下预警规则是否被触发。
+
+【预警规则】
+{rules}
+
+【判断要求】
+1. 每条规则独立判断，只依据视频描述中的客观事实
+2. 规则中关于返回格式的要求请忽略，统一按下方JSON格式输出
+
+【输出格式】
+只输出一个JSON对象，键为规则编号，值为 true（触发）或 false（未触发），不要输出其他内容。
+例如：{{"1001": true, "1002": false}}
+
+监控时间：{time}
+视频描述：
+{description}
+"""
@@ -2,16 +2,9 @@ from fastapi import FastAPI, WebSocket
 from typing import List, Optional, Dict, Any
 import uvicorn
 from pydantic import BaseModel
-try:
-    from langchain_chroma import Chroma
-except ImportError:
-    from langchain_community.vectorstores import Chroma
-
-try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
+
 from langchain.text_splitter import CharacterTextSplitter
+from embedding_service import embedding_service
 import jieba
 import httpx
 from config import APIConfig, VideoConfig, ServerConfig
@@ -42,98 +35,19 @@ app.add_middleware(
 
 # 导入双数据库支持
 from video_database import video_db
+from video_vector_store import VideoVectorManager, open_document_store
 
-# 使用多语言嵌入模型
-embeddings = HuggingFaceEmbeddings(
-    model_name="Alibaba-NLP/gte-multilingual-base",
-    model_kwargs={'device': 'cpu', 'trust_remote_code': True},
-    encode_kwargs={'normalize_embeddings': True}
-)
+# 使用多语言嵌入模型 (共享嵌入服务：自动凑批、结果缓存)
+embeddings = embedding_service.as_langchain()
 
-# 初始化向量存储 (保持兼容性，主要用于视频活动检索)
-vector_store = Chroma(embedding_function=embeddings, persist_directory="./video_chroma_db")
+# 初始化向量存储 (保持兼容性，主要用于视频活动检索；首次启动时从旧集合重新嵌入)
+vector_store = open_document_store(embeddings)
 
 # 初始化智能代理
 intelligent_agent = IntelligentAgent()
 
-# 初始化视频活动向量管理器
-class VideoVectorManager:
-    def __init__(self):
-        self.vector_store = Chroma(
-            collection_name="video_activities",
-            embedding_function=embeddings,
-            persist_directory="./video_chroma_db"
-        )
-
-    async def add_activity(self, activity_id, activity_data):
-        """添加活动到向量数据库"""
-        try:
-            # 构建文档内容
-            content = activity_data.get('content', '')
-            activity_type = activity_data.get('activity_type', '')
-            start_time = activity_data.get('start_time', '')
-
-            document_text = f"活动类型: {activity_type} 活动描述: {content} 时间: {start_time}"
-
-            # 构建元数据
-            metadata = {
-                "activity_id": activity_id,
-                "activity_type": activity_type,
-                "start_time": start_time,
-                "source_type": activity_data.get('source_type', 'video_analysis')
-            }
-
-            # 添加到向量数据库
-            self.vector_store.add_texts(
-                texts=[document_text],
-                metadatas=[metadata],
-                ids=[f"video_activity_{activity_id}"]
-            )
-            return True
-        except Exception as e:
-            logging.error(f"添加活动到向量数据库失败: {e}")
-            return False
-
-    def search_activities(self, query, k=10, time_filter=None):
-        """搜索活动"""
-        try:
-            # 先进行无过滤的搜索，然后在Python端进行时间过滤
-            docs_with_scores = self.vector_store.similarity_search_with_score(query, k=k*2)
-
-            # 如果有时间过滤条件，在Python端进行过滤
-            if time_filter and "start_time" in time_filter:
-                filtered_results = []
-                start_time_filter = time_filter["start_time"]
-                min_time = start_time_filter.get("$gte")
-                max_time = start_time_filter.get("$lte")
-
-                for doc, score in docs_with_scores:
-                    # 从元数据中获取活动的开始时间
-                    activity_id = doc.metadata.get('activity_id')
-                    if activity_id:
-                        try:
-                            from video_database import video_db
-                            activity = video_db.get_activity_by_id(activity_id)
-                            if activity:
-                                activity_start = activity.get('start_time', '')
-                                if min_time and max_time:
-                                    if min_time <= activity_start <= max_time:
-                                        filtered_results.append((doc, score))
-                                        if len(filtered_results) >= k:
-                                            break
-                        except Exception as e:
-                            logging.warning(f"时间过滤时查询活动失败: {e}")
-                            continue
-
-                return filtered_results[:k]
-
-            return docs_with_scores[:k]
-        except Exception as e:
-            logging.error(f"向量搜索失败: {e}")
-            return []
-
-# 全局向量管理器
-video_vector_manager = VideoVectorManager()
+# 全局视频活动向量管理器
+video_vector_manager = VideoVectorManager(embeddings)
 
 # 定义停用词
 STOP_WORDS = {"监控", "显示", "在", "了", "吗", "什么", "的", "：", "，", "。", "年", "月", "日"}
@@ -501,17 +415,12 @@ async def search_video_activities(query: str):
                             "start_time": {"$gte": time_info['start_time'], "$lte": time_info['end_time']}
                         }
 
-                    vector_results = video_vector_manager.search_activities(query, k=5, time_filter=vector_time_filter)
-                    for doc, score in vector_results:
-                        activity_id = doc.metadata.get('activity_id')
-                        if activity_id:
-                            activity = video_db.get_activity_by_id(activity_id)
-                            if activity and activity not in activities:
-                                if time_info:
-                                    activity_start = activity.get('start_time', '')
-                                    if not (time_info['start_time'] <= activity_start <= time_info['end_time']):
-                                        continue
-                                activities.append(activity)
+                    # 时间和类型条件在向量库内过滤，命中记录一次批量取回
+                    known_ids = {a['id'] for a in activities}
+                    for activity in video_vector_manager.search_activity_records(
+                            query, k=5, time_filter=vector_time_filter, activity_type=activity_type):
+                        if activity['id'] not in known_ids:
+                            activities.append(activity)
                 except Exception as e:
                     logging.warning(f"语义搜索补充失败: {e}")
         else:
@@ -526,19 +435,7 @@ async def search_video_activities(query: str):
                         "start_time": {"$gte": recent_start, "$lte": recent_end}
                     }
 
-                vector_results = video_vector_manager.search_activities(query, k=8, time_filter=implicit_time_filter)
-                for doc, score in vector_results:
-                    activity_id = doc.metadata.get('activity_id')
-                    if activity_id:
-                        activity = video_db.get_activity_by_id(activity_id)
-                        if activity:
-                            if implicit_time_filter:
-                                activity_start = activity.get('start_time', '')
-                                recent_start = implicit_time_filter["start_time"]["$gte"]
-                                recent_end = implicit_time_filter["start_time"]["$lte"]
-                                if not (recent_start <= activity_start <= recent_end):
-                                    continue
-                            activities.append(activity)
+                activities = video_vector_manager.search_activity_records(query, k=8, time_filter=implicit_time_filter)
             except Exception as e:
                 logging.error(f"语义搜索失败: {e}")
                 return None
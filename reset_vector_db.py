@@ -30,6 +30,13 @@ def reset_vector_database():
             print(f"⚠️  目录不存在: {chroma_dir}")
     
     if deleted_any:
+        # 向量库已清空，向量集合的水位线归零以便重新索引全部历史记录（关键词统计和全文索引不受影响）
+        try:
+            from index_watermark import index_watermarks
+            index_watermarks.reset()
+            print("✅ 已重置向量索引水位线")
+        except Exception as e:
+            print(f"❌ 重置索引水位线失败: {e}")
         print("\n🔄 向量数据库已重置")
         print("📝 系统下次启动时将重新创建向量数据库并重新索引所有历史数据")
         print("⚠️  注意：重新索引可能需要一些时间，具体取决于历史数据量")
@@ -73,16 +73,19 @@ if os.name == 'nt' and PYWIN32_AVAILABLE: # 检查是否为Windows且pywin32可
     except Exception as e_dpi:
         logging.warning(f"设置DPI感知时发生未知错误: {e_dpi}")
 
-# 导入活动索引功能
+# activity_log 写入服务：所有记录经由单个写线程批量提交
+from activity_log_writer import activity_log_writer
+from screen_dedup import screen_deduplicator
+from screen_change import screen_change_detector
+from tile_ocr import tile_ocr
+
+# 导入后台向量索引器：记录在写入事务中登记到索引队列，由后台线程批量嵌入
 try:
-    from activity_retriever import index_single_activity_record
-    logging.info("成功导入index_single_activity_record函数")
+    from activity_indexer import activity_indexer
+    activity_indexer.attach(activity_log_writer)
+    logging.info("后台向量索引器已挂载到写入服务")
 except ImportError as e:
-    logging.error(f"导入index_single_activity_record函数失败: {e}")
-    # 定义一个替代函数，在真正的函数不可用时使用
-    def index_single_activity_record(record):
-        logging.error("无法使用实际的index_single_activity_record函数，只记录数据到文件")
-        return False
+    logging.error(f"导入后台向量索引器失败: {e}，记录只保存到数据库")
 
 # 配置日志
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s') # 将日志级别改为DEBUG
@@ -102,6 +105,9 @@ MOUSE_CLICK_CAPTURE_INTERVAL_SECONDS = 5
 OMNIPARSER_API_URL = "http://localhost:5111/parse"  # 根据实际部署情况修改
 USE_OMNIPARSER = True  # 控制是否使用Omniparser替代OCR
 ENABLE_VECTOR_INDEXING = True # 是否启用向量数据库索引（临时禁用以避免ChromaDB问题）
+ENABLE_CHANGE_DETECTION = True # 定时截图画面与同一窗口上次解析时相同时跳过 OCR/Omniparser，复用上次结果
+ENABLE_TILE_OCR = True # 截图分块解析，只重新解析内容变化的分块（分块结果按像素哈希缓存）
+ENABLE_SCREEN_DEDUP = True # 定时截图内容与同一窗口上一条记录近似相同时只延长该记录的时间跨度
 
 # 特殊应用名称的大小写映射
 KNOWN_APP_CASINGS = {
@@ -118,7 +124,6 @@ last_window_title = None # 可选：也跟踪窗口标题变化，以记录更
 
 # 用于鼠标点击截图的全局变量
 last_mouse_click_screenshot_time = 0
-record_file_lock = threading.Lock() # 用于同步对记录文件的写入
 mouse_controller = None # pynput鼠标控制器实例
 click_task_queue = queue.Queue() # 用于处理鼠标点击任务的队列
 
@@ -187,7 +192,9 @@ def init_db():
                 mouse_x INTEGER,
                 mouse_y INTEGER,
                 button TEXT,
-                pressed INTEGER 
+                pressed INTEGER,
+                end_timestamp TEXT,    -- 近似重复的屏幕内容最后一次出现的时间
+                duplicate_count INTEGER DEFAULT 0  -- 被合并到本记录的近似重复截图数
             );
             """
             cursor.execute(create_table_sql)
@@ -226,6 +233,17 @@ def init_db():
                 except sqlite3.Error as e_alter:
                     logging.error(f"数据库迁移失败：添加 'url' 列时出错: {e_alter}")
             
+            # 近似重复去重：记录的时间跨度和被合并的截图数
+            for column_name, column_type in (('end_timestamp', 'TEXT'), ('duplicate_count', 'INTEGER DEFAULT 0')):
+                if column_name not in columns:
+                    logging.info(f"检测到旧版数据库表，缺少 '{column_name}' 列。正在进行迁移...")
+                    try:
+                        cursor.execute(f"ALTER TABLE activity_log ADD COLUMN {column_name} {column_type};")
+                        conn.commit()
+                        logging.info(f"数据库迁移成功：已成功添加 '{column_name}' 列。")
+                    except sqlite3.Error as e_alter:
+                        logging.error(f"数据库迁移失败：添加 '{column_name}' 列时出错: {e_alter}")
+            
             # 3. 创建索引（如果不存在）
             create_index_timestamp_sql = "CREATE INDEX IF NOT EXISTS idx_timestamp ON activity_log (timestamp);"
             cursor.execute(create_index_timestamp_sql)
@@ -323,15 +341,18 @@ def extract_text_from_image(image_path):
         logging.error(f"❌ 从图像提取文本失败 ({image_path}): {e}")
         return "", "", "failed"
 
-def extract_with_omniparser(image_path):
+def extract_with_omniparser(image_path, image_bytes=None):
     """
     使用Omniparser API从图像中提取结构化信息。
+    提供 image_bytes 时直接发送该图像数据（如截图分块），image_path 仅用于日志。
     返回元组: (合并后的文本描述, 原始结构化数据JSON字符串)
     """
     try:
         # 读取图像并转换为base64
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
+        if image_bytes is None:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
         
         # 准备请求数据
         payload = {"image_base64": image_data}
@@ -473,6 +494,104 @@ def extract_with_omniparser(image_path):
         logging.error(f"❌ 使用Omniparser解析图像失败 ({image_path}): {e}", exc_info=True)
         return "", ""
 
+def _tesseract_fragments(image, offset=(0, 0)):
+    """Tesseract 逐词识别，返回带整图坐标的片段列表，失败时返回 None"""
+    try:
+        data = pytesseract.image_to_data(image, lang='chi_sim+eng', output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        logging.error(f"❌ Tesseract分块解析失败: {e}")
+        return None
+    fragments = []
+    for i, word in enumerate(data['text']):
+        if not word or not word.strip():
+            continue
+        left, top = data['left'][i] + offset[0], data['top'][i] + offset[1]
+        fragments.append({
+            "text": word,
+            "box": (left, top, left + data['width'][i], top + data['height'][i]),
+            "element": None,
+        })
+    return fragments
+
+def _omniparser_fragments(image, box, image_size):
+    """
+    Omniparser 解析整图或分块，元素坐标换算为整图坐标（归一化坐标仍保持归一化），
+    返回片段列表，服务调用失败时返回 None。
+    """
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    _, structured_data_json = extract_with_omniparser(f"分块{box}", image_bytes=buffer.getvalue())
+    if not structured_data_json:
+        return None
+    try:
+        items = json.loads(structured_data_json)
+    except ValueError:
+        return None
+    if isinstance(items, dict):
+        items = [items]
+
+    x0, y0, x1, y1 = box
+    full_width, full_height = image_size
+    fragments = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"text": item}
+        if not isinstance(item, dict):
+            continue
+        text = str(item.get("text") or item.get("caption") or item.get("description") or "").strip()
+        if text == "图像已处理，但未检测到文本内容":
+            continue
+        element = dict(item)
+        pixel_box = None
+        bbox = item.get("bbox")
+        if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+            normalized = all(0 <= float(v) <= 1 for v in bbox)
+            if normalized:
+                pixel_box = (x0 + bbox[0] * (x1 - x0), y0 + bbox[1] * (y1 - y0),
+                             x0 + bbox[2] * (x1 - x0), y0 + bbox[3] * (y1 - y0))
+                element["bbox"] = [pixel_box[0] / full_width, pixel_box[1] / full_height,
+                                   pixel_box[2] / full_width, pixel_box[3] / full_height]
+            else:
+                pixel_box = (x0 + bbox[0], y0 + bbox[1], x0 + bbox[2], y0 + bbox[3])
+                element["bbox"] = list(pixel_box)
+        fragments.append({"text": text, "box": pixel_box, "element": element})
+    return fragments
+
+def extract_text_incremental(image_path, image):
+    """
+    分块增量解析：只有内容变化的分块重新交给 Omniparser/Tesseract，其余分块复用缓存结果，
+    回退规则与 extract_text_from_image 相同。
+    返回 ((文本, 视觉元素JSON, 解析器类型), TileParseResult 或 None)
+    """
+    global omniparser_request_count, tesseract_request_count, omniparser_consecutive_failures
+
+    if USE_OMNIPARSER and not omniparser_temporary_disabled:
+        result = tile_ocr.parse(
+            image, "omniparser",
+            lambda full_image: _omniparser_fragments(full_image, (0, 0) + full_image.size, full_image.size),
+            lambda tile, box: _omniparser_fragments(tile, box, image.size)
+        )
+        if result is not None and result.text:
+            omniparser_request_count += 1
+            omniparser_consecutive_failures = 0
+            logging.info(f"✅ Omniparser分块解析完成: 重新解析 {result.dirty_tiles}/{result.total_tiles} 个分块")
+            visual_elements = json.dumps(result.elements, ensure_ascii=False) if result.elements else ""
+            return (result.text, visual_elements, "omniparser"), result
+        logging.warning("⚠️  Omniparser分块解析失败或返回空结果，回退到Tesseract OCR")
+
+    tesseract_request_count += 1
+    result = tile_ocr.parse(
+        image, "tesseract",
+        lambda full_image: _tesseract_fragments(full_image),
+        lambda tile, box: _tesseract_fragments(tile, box[:2])
+    )
+    if result is None:
+        logging.error(f"❌ 从图像提取文本失败 ({image_path})")
+        return ("", "", "failed"), None
+    logging.info(f"✅ Tesseract分块解析完成 (第{tesseract_request_count}次): "
+                 f"重新解析 {result.dirty_tiles}/{result.total_tiles} 个分块, {len(result.text)}个字符")
+    return (result.text, "", "tesseract"), result
+
 def extract_url_from_text(text):
     """
     从OCR文本中提取URL。
@@ -578,12 +697,12 @@ def get_url_from_browser(hwnd, app_name):
         
     return None
 
-def capture_screenshot(filename_prefix="screenshot", window_rect=None, app_name="Unknown"):
+def capture_screenshot_image(filename_prefix="screenshot", window_rect=None, app_name="Unknown"):
     """
     捕获屏幕截图。如果提供了window_rect，则捕获该区域。
     对于已知浏览器，会尝试裁剪掉顶部的UI元素（标签栏、地址栏等）。
     在多显示器环境下，智能识别窗口所在显示器，避免截取多个显示器内容。
-    返回截图文件的路径。
+    返回 (截图文件路径, PIL图像, mss原始BGRA缓冲区)，失败时返回 (None, None, None)。
     """
     try:
         with mss.mss() as sct:
@@ -659,23 +778,27 @@ def capture_screenshot(filename_prefix="screenshot", window_rect=None, app_name=
                             logging.warning(f"使用回退显示器进行截图: {fallback_monitor}")
                         except Exception as e_fallback:
                             logging.error(f"回退显示器截图也失败: {e_fallback}")
-                            return None
+                            return None, None, None
                 else:
                     logging.error("无法确定任何可用的显示器，截图失败。")
-                    return None
+                    return None, None, None
 
             if sct_img:
                 img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
                 img.save(filepath)
                 logging.info(f"截图已保存到 {filepath} (截图方式: {capture_details})")
-                return filepath
+                return filepath, img, sct_img.bgra
             else:
                 logging.error("未能生成sct_img对象，截图失败。")
-                return None
+                return None, None, None
 
     except Exception as e:
         logging.error(f"截图过程中发生严重错误: {e}", exc_info=True)
-        return None
+        return None, None, None
+
+def capture_screenshot(filename_prefix="screenshot", window_rect=None, app_name="Unknown"):
+    """捕获屏幕截图，返回截图文件的路径，失败时返回 None。"""
+    return capture_screenshot_image(filename_prefix, window_rect, app_name)[0]
 
 def determine_window_monitor(sct, window_rect):
     """
@@ -916,69 +1039,15 @@ def get_active_window_info():
 
 def save_record(record_data):
     """
-    将单条记录保存到SQLite数据库中。
-    使用锁来确保线程安全。
-    返回新插入记录的ID，如果失败则返回None。
+    将单条记录交给 activity_log 写入服务，由写线程与其他记录合并提交。
+    等待提交完成后返回新插入记录的ID，如果失败则返回None。
+    向量索引等提交后钩子由写入服务在后台执行。
     """
-    global record_file_lock
-    
-    columns = [
-        'timestamp', 'record_type', 'triggered_by', 'event_type', 
-        'window_title', 'process_name', 'app_name', 'page_title', 'url', 'pid',
-        'from_app', 'to_app', 'to_app_title', 
-        'screenshot_path', 'ocr_text', 'visual_elements', 'parser_type',
-        'mouse_x', 'mouse_y', 'button', 'pressed'
-    ]
-    
-    data_tuple = (
-        record_data.get('timestamp'),
-        record_data.get('record_type'),
-        record_data.get('triggered_by'),
-        record_data.get('event_type'),
-        record_data.get('window_title'),
-        record_data.get('process_name'),
-        record_data.get('app_name'),
-        record_data.get('page_title'),
-        record_data.get('url'),
-        record_data.get('pid'),
-        record_data.get('from_app'),
-        record_data.get('to_app'),
-        record_data.get('to_app_title'),
-        record_data.get('screenshot_path'),
-        record_data.get('ocr_text'),
-        record_data.get('visual_elements'),  # 新增：视觉元素JSON
-        record_data.get('parser_type'),      # 新增：解析器类型
-        record_data.get('mouse_x'),
-        record_data.get('mouse_y'),
-        record_data.get('button'),
-        1 if record_data.get('pressed') else 0
-    )
-
-    sql = f"INSERT INTO activity_log ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
-    record_id = None # 初始化 record_id
-
-    try:
-        with record_file_lock: 
-            conn = create_connection(DATABASE_FILE)
-            if conn is None:
-                logging.error("保存记录失败：无法连接到数据库。")
-                return None # 修改：返回 None
-            
-            cursor = conn.cursor()
-            cursor.execute(sql, data_tuple)
-            record_id = cursor.lastrowid # 获取自增ID
-            conn.commit()
-            logging.info(f"记录已保存到数据库 (ID: {record_id})")
-            return record_id # 修改：返回 record_id
-    except sqlite3.Error as e:
-        logging.error(f"保存记录到数据库失败: {e}. SQL: {sql}, Data: {data_tuple}", exc_info=True)
-        return None # 修改：返回 None
-    except Exception as e_global: 
-        logging.error(f"保存记录时发生意外错误: {e_global}. Data: {record_data}", exc_info=True)
-        return None # 修改：返回 None
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+    record_data['pressed'] = 1 if record_data.get('pressed') else 0
+    record_id = activity_log_writer.write(record_data, run_hooks=ENABLE_VECTOR_INDEXING)
+    if record_id is not None:
+        logging.info(f"记录已保存到数据库 (ID: {record_id})")
+    return record_id
 
 def print_parser_stats():
     """定期打印解析器使用统计"""
@@ -994,9 +1063,50 @@ def print_parser_stats():
             
             logging.info(f"📊 解析器使用统计: Omniparser {omniparser_request_count}次({omni_percentage:.1f}%), "
                         f"Tesseract {tesseract_request_count}次({tesseract_percentage:.1f}%)")
-        
+        if ENABLE_CHANGE_DETECTION:
+            change_stats = screen_change_detector.get_stats()
+            logging.info(f"📊 画面变化检测: 跳过解析 {change_stats['skipped']}次, "
+                        f"局部解析 {change_stats['partial']}次, 完整解析 {change_stats['full']}次")
+        if ENABLE_TILE_OCR:
+            tile_stats = tile_ocr.get_stats()
+            logging.info(f"📊 分块解析: 重新解析 {tile_stats['tiles_parsed']}/{tile_stats['tiles_total']} 个分块, "
+                        f"复用率 {tile_stats['tile_reuse_ratio'] * 100:.1f}%")
+        if ENABLE_SCREEN_DEDUP:
+            dedup_stats = screen_deduplicator.get_stats()
+            logging.info(f"📊 屏幕内容去重: 检查 {dedup_stats['checked']}次, "
+                        f"合并近似重复 {dedup_stats['suppressed']}次({dedup_stats['suppress_ratio'] * 100:.1f}%)")
+
         last_stats_time = current_time
 
+def parse_screenshot(image_path, image, raw, stream_key):
+    """
+    带画面变化检测的解析：画面与该窗口上次解析时相同则直接复用上次的结果；
+    否则启用分块解析时只重新解析变化的分块，未启用时调用 extract_text_from_image 完整解析。
+    返回值与 extract_text_from_image 相同。
+    """
+    if image is None:
+        return extract_text_from_image(image_path)
+
+    change = None
+    if ENABLE_CHANGE_DETECTION:
+        change = screen_change_detector.observe(stream_key, image, raw)
+        if change.mode == "skip":
+            screen_change_detector.record("skipped")
+            logging.info(f"⏭️  画面未变化，跳过解析并复用上次结果 ({stream_key[0]})")
+            return change.result
+
+    if ENABLE_TILE_OCR:
+        result, tile_result = extract_text_incremental(image_path, image)
+        mode = "full" if tile_result is None or tile_result.full_parse else "partial"
+    else:
+        result = extract_text_from_image(image_path)
+        mode = "full"
+    if change is not None:
+        screen_change_detector.record(mode)
+        if result[2] != "failed":
+            screen_change_detector.remember(stream_key, change, result)
+    return result
+
 def record_screen_activity(triggered_by="timer"):
     """
     捕获屏幕、提取文本、保存记录，并索引到向量数据库。
@@ -1035,22 +1145,9 @@ def record_screen_activity(triggered_by="timer"):
         }
         logging.info(f"检测到应用切换: 从 {last_active_app_name} 到 {current_app_name} ({current_window_title})")
         
+        # 提交后由写入服务的钩子完成向量索引
         saved_event_id = save_record(event_record) 
-        if saved_event_id is not None:
-            event_record['id'] = saved_event_id 
-            logging.debug(f"DEBUG: Calling index_single_activity_record for event_record with ID: {event_record.get('id')}") 
-            
-            # 只有在启用向量索引时才尝试索引
-            if ENABLE_VECTOR_INDEXING:
-                try:
-                    index_single_activity_record(event_record)
-                    logging.info("应用切换事件已成功索引到向量数据库")
-                except Exception as e:
-                    logging.error(f"索引应用切换事件时出错: {e}")
-                    logging.info("应用切换事件已保存到主数据库，向量索引将在下次重启时重建")
-            else:
-                logging.debug("向量索引已禁用，跳过应用切换事件的向量索引")
-        else:
+        if saved_event_id is None:
             logging.error("应用切换事件未能保存到主数据库")
         
         last_active_app_name = current_app_name
@@ -1059,7 +1156,7 @@ def record_screen_activity(triggered_by="timer"):
         last_active_app_name = current_app_name
         last_window_title = current_window_title
     
-    screenshot_path = capture_screenshot(
+    screenshot_path, screenshot_image, screenshot_raw = capture_screenshot_image(
         filename_prefix="screenshot",
         window_rect=active_window_rect, 
         app_name=current_app_name
@@ -1068,8 +1165,10 @@ def record_screen_activity(triggered_by="timer"):
         logging.error("截图失败，跳过本次记录")
         return
     
-    # 使用新的提取函数获取文本和视觉元素
-    ocr_text, visual_elements, parser_type = extract_text_from_image(screenshot_path)
+    # 使用新的提取函数获取文本和视觉元素（画面未变化时复用该窗口上次的解析结果）
+    ocr_text, visual_elements, parser_type = parse_screenshot(
+        screenshot_path, screenshot_image, screenshot_raw, (current_app_name, current_window_title)
+    )
 
     # --- 从OCR文本中回退提取URL ---
     if not current_url and ocr_text:
@@ -1103,27 +1202,28 @@ def record_screen_activity(triggered_by="timer"):
     elif not ocr_text : 
         pass
 
-    saved_content_id = save_record(activity_content_record)
-    if saved_content_id is not None:
-        activity_content_record['id'] = saved_content_id
-        logging.debug(f"DEBUG: Calling index_single_activity_record for activity_content_record with ID: {activity_content_record.get('id')}") 
-        
-        # 只有在启用向量索引时才尝试索引
-        if ENABLE_VECTOR_INDEXING:
-            try:
-                logging.info(f"尝试将屏幕内容记录 ({activity_content_record['record_type']}) 索引到向量数据库...")
-                index_result = index_single_activity_record(activity_content_record)
-                if index_result:
-                    logging.info(f"屏幕内容记录 ({activity_content_record['record_type']}) 已成功索引")
-                else:
-                    logging.warning(f"屏幕内容记录 ({activity_content_record['record_type']}) 未能成功索引，但已保存到主数据库")
-            except Exception as e:
-                logging.error(f"索引屏幕内容记录 ({activity_content_record['record_type']}) 时出错: {e}")
-                logging.info("记录已保存到主数据库，向量索引将在下次重启时重建")
+    # 同一窗口内容近似不变时延长上一条记录，不写入新行；向量索引只重新登记该记录以更新结束时间（文档不变，嵌入命中缓存）
+    dedup_key = (current_app_name, current_window_title)
+    fingerprint = None
+    if ENABLE_SCREEN_DEDUP and ocr_text:
+        if triggered_by == "timer" and not app_changed:
+            duplicate_of, fingerprint = screen_deduplicator.find_duplicate(*dedup_key, ocr_text)
+            if duplicate_of is not None:
+                activity_log_writer.extend(duplicate_of, timestamp, run_hooks=ENABLE_VECTOR_INDEXING)
+                logging.info(f"屏幕内容与记录 {duplicate_of} 近似相同，延长其时间跨度")
+                try:
+                    os.remove(screenshot_path)
+                except OSError as e:
+                    logging.debug(f"删除重复截图失败 ({screenshot_path}): {e}")
+                return
         else:
-            logging.debug("向量索引已禁用，跳过屏幕内容记录的向量索引")
-    else:
+            fingerprint = screen_deduplicator.fingerprint(ocr_text)
+
+    saved_content_id = save_record(activity_content_record)
+    if saved_content_id is None:
         logging.error(f"屏幕内容记录 ({activity_content_record['record_type']}) 未能保存到主数据库")
+    elif fingerprint is not None:
+        screen_deduplicator.remember(*dedup_key, saved_content_id, fingerprint)
 
 def process_click_task(task_data):
     """
@@ -1182,25 +1282,7 @@ def process_click_task(task_data):
     }
 
     saved_click_id = save_record(click_event_record) 
-    if saved_click_id is not None:
-        click_event_record['id'] = saved_click_id 
-        logging.debug(f"DEBUG: Calling index_single_activity_record for click_event_record with ID: {click_event_record.get('id')}") 
-        
-        # 只有在启用向量索引时才尝试索引
-        if ENABLE_VECTOR_INDEXING:
-            try:
-                logging.info("尝试将鼠标交互记录 (工作线程) 索引到向量数据库...")
-                index_result = index_single_activity_record(click_event_record)
-                if index_result:
-                    logging.info("鼠标交互记录 (工作线程) 已成功索引")
-                else:
-                    logging.warning("鼠标交互记录 (工作线程) 未能成功索引，但已保存到主数据库")
-            except Exception as e:
-                logging.error(f"索引鼠标交互记录 (工作线程) 时出错: {e}")
-                logging.info("记录已保存到主数据库，向量索引将在下次重启时重建")
-        else:
-            logging.debug("向量索引已禁用，跳过鼠标交互记录的向量索引")
-    else:
+    if saved_click_id is None:
         logging.error("鼠标交互记录 (工作线程) 未能保存到主数据库")
 
 def click_processing_worker():
@@ -1453,6 +1535,13 @@ def reset_vector_database():
             except Exception as e:
                 print(f"❌ 删除向量数据库目录失败 ({chroma_dir}): {e}")
 
+    # 向量库已清空，向量集合的水位线归零以便重新索引全部历史记录（关键词统计和全文索引不受影响）
+    try:
+        from index_watermark import index_watermarks
+        index_watermarks.reset()
+    except Exception as e:
+        print(f"❌ 重置索引水位线失败: {e}")
+
 def check_vector_database_health():
     """
     检查向量数据库健康状态。
@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+CHANGE_GRID_COLUMNS = 8          # 变化检测的分块列数
+CHANGE_GRID_ROWS = 8             # 变化检测的分块行数
+CHANGE_TILE_PIXELS = 16          # 缩略图中每个分块的边长（像素）
+CHANGE_TILE_THRESHOLD = 1.5      # 分块灰度平均差超过该值视为该块有变化 (0-255)
+CHANGE_FORCE_PARSE_SECONDS = 300 # 画面一直不变时，最长隔多久强制重新解析一次
+CHANGE_MAX_STREAMS = 32          # 同时跟踪的 (应用, 窗口) 数量
+
+
+class ScreenChange:
+    """一次截图与同一窗口上次解析时画面的比较结果"""
+    __slots__ = ("mode", "changed_tiles", "result", "thumbnail", "raw_hash", "size")
+
+    def __init__(self, mode: str, changed_tiles: List[int], result: Optional[Tuple],
+                 thumbnail: Image.Image, raw_hash: str, size: Tuple[int, int]):
+        self.mode = mode                    # skip: 画面不变，复用上次结果；full: 需要完整解析
+        self.changed_tiles = changed_tiles  # 有变化的分块序号（行优先）
+        self.result = result                # mode 为 skip 时上次的解析结果
+        self.thumbnail = thumbnail
+        self.raw_hash = raw_hash
+        self.size = size
+
+    @property
+    def changed_ratio(self) -> float:
+        return len(self.changed_tiles) / (CHANGE_GRID_COLUMNS * CHANGE_GRID_ROWS)
+
+
+class _ReferenceFrame:
+    __slots__ = ("raw_hash", "size", "thumbnail", "result", "parsed_at")
+
+    def __init__(self, raw_hash: str, size: Tuple[int, int], thumbnail: Image.Image, result: Tuple, parsed_at: float):
+        self.raw_hash = raw_hash
+        self.size = size
+        self.thumbnail = thumbnail
+        self.result = result
+        self.parsed_at = parsed_at
+
+
+class ScreenChangeDetector:
+    """截图变化检测，画面静止时跳过 OCR/Omniparser 解析
+
+    每个 (应用, 窗口) 保存上次解析时画面的原始像素哈希和灰度缩略图。新截图先比较原始
+    mss 缓冲区的哈希，完全相同直接复用上次的解析结果；否则把缩略图按网格分块比较灰度
+    平均差，所有分块都低于阈值（光标闪烁等）时同样跳过解析。与上次解析帧比较而不是与
+    上一帧比较，缓慢累积的变化最终也会触发解析。
+    """
+
+    def __init__(self, tile_threshold: float = None, force_parse_seconds: float = None,
+                 max_streams: int = None):
+        self.tile_threshold = tile_threshold if tile_threshold is not None else CHANGE_TILE_THRESHOLD
+        self.force_parse_seconds = force_parse_seconds or CHANGE_FORCE_PARSE_SECONDS
+        self.max_streams = max_streams or CHANGE_MAX_STREAMS
+        self.thumbnail_size = (CHANGE_GRID_COLUMNS * CHANGE_TILE_PIXELS, CHANGE_GRID_ROWS * CHANGE_TILE_PIXELS)
+        self._references: "OrderedDict[Any, _ReferenceFrame]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.skipped = 0
+        self.partial = 0
+        self.full = 0
+
+    @staticmethod
+    def raw_hash(raw: bytes) -> str:
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def make_thumbnail(self, image: Image.Image) -> Image.Image:
+        return image.convert('L').resize(self.thumbnail_size, Image.BILINEAR)
+
+    def changed_tiles(self, previous: Image.Image, current: Image.Image) -> List[int]:
+        diff = ImageChops.difference(previous, current)
+        changed = []
+        for row in range(CHANGE_GRID_ROWS):
+            for column in range(CHANGE_GRID_COLUMNS):
+                box = (column * CHANGE_TILE_PIXELS, row * CHANGE_TILE_PIXELS,
+                       (column + 1) * CHANGE_TILE_PIXELS, (row + 1) * CHANGE_TILE_PIXELS)
+                if ImageStat.Stat(diff.crop(box)).mean[0] > self.tile_threshold:
+                    changed.append(row * CHANGE_GRID_COLUMNS + column)
+        return changed
+
+    def observe(self, key: Any, image: Image.Image, raw: bytes = None, now: float = None) -> ScreenChange:
+        """比较新截图与该窗口上次解析时的画面；raw 为 mss 原始缓冲区，缺省时使用图像字节"""
+        now = now or time.time()
+        raw_hash = self.raw_hash(raw if raw is not None else image.tobytes())
+        thumbnail = self.make_thumbnail(image)
+        all_tiles = list(range(CHANGE_GRID_COLUMNS * CHANGE_GRID_ROWS))
+        with self._lock:
+            reference = self._references.get(key)
+            if reference is not None:
+                self._references.move_to_end(key)
+        if (reference is None or reference.size != image.size
+                or now - reference.parsed_at >= self.force_parse_seconds):
+            return ScreenChange("full", all_tiles, None, thumbnail, raw_hash, image.size)
+        if reference.raw_hash == raw_hash:
+            return ScreenChange("skip", [], reference.result, thumbnail, raw_hash, image.size)
+        changed = self.changed_tiles(reference.thumbnail, thumbnail)
+        if not changed:
+            return ScreenChange("skip", [], reference.result, thumbnail, raw_hash, image.size)
+        return ScreenChange("full", changed, None, thumbnail, raw_hash, image.size)
+
+    def record(self, mode: str):
+        """登记一次解析方式：skipped / partial / full"""
+        with self._lock:
+            setattr(self, mode, getattr(self, mode) + 1)
+
+    def remember(self, key: Any, change: ScreenChange, result: Tuple, now: float = None):
+        """解析完成后把本次画面登记为该窗口的比较基准"""
+        with self._lock:
+            self._references[key] = _ReferenceFrame(change.raw_hash, change.size, change.thumbnail,
+                                                    result, now or time.time())
+            self._references.move_to_end(key)
+            while len(self._references) > self.max_streams:
+                self._references.popitem(last=False)
+
+    def forget(self, key: Any):
+        with self._lock:
+            self._references.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.skipped + self.partial + self.full
+        return {
+            "skipped": self.skipped,
+            "partial": self.partial,
+            "full": self.full,
+            "skip_ratio": round(self.skipped / total, 3) if total else 0.0,
+            "streams": len(self._references),
+        }
+
+
+# 全局变化检测器实例，定时截图共享
+screen_change_detector = ScreenChangeDetector()
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from llm_cache import MinHasher, normalize_description
+
+DEDUP_SIMILARITY_THRESHOLD = 0.9  # 与上一条记录的估计 Jaccard 相似度不低于该值时视为近似重复
+DEDUP_MAX_SPAN_SECONDS = 1800     # 单条记录最多延长的时间跨度，超过后即使内容不变也写入新记录
+DEDUP_MAX_STREAMS = 64            # 同时跟踪的 (应用, 窗口) 数量，超出时淘汰最久未出现的窗口
+DEDUP_MIN_TEXT_LENGTH = 8         # 归一化后短于该长度的文本不参与去重
+
+
+class _StreamState:
+    __slots__ = ("record_id", "signature", "text_length", "first_seen", "last_seen", "extended")
+
+    def __init__(self, record_id: int, signature: Tuple[int, ...], text_length: int, now: float):
+        self.record_id = record_id
+        self.signature = signature
+        self.text_length = text_length
+        self.first_seen = now
+        self.last_seen = now
+        self.extended = 0
+
+
+class ScreenContentDeduplicator:
+    """按 (应用, 窗口) 跟踪上一条屏幕内容记录的 MinHash 指纹
+
+    定时截图的 OCR 文本与同一窗口上一条记录近似相同时，调用方只延长那条记录的时间跨度，
+    不再写入新行、也不再生成向量；只有内容确实变化（或超过最长跨度）时才写入新记录。
+    """
+
+    def __init__(self, threshold: float = None, max_span: float = None, max_streams: int = None):
+        self.threshold = threshold or DEDUP_SIMILARITY_THRESHOLD
+        self.max_span = max_span or DEDUP_MAX_SPAN_SECONDS
+        self.max_streams = max_streams or DEDUP_MAX_STREAMS
+        self._hasher = MinHasher(num_perm=64)
+        self._streams: "OrderedDict[Tuple[str, str], _StreamState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.checked = 0
+        self.suppressed = 0
+        self.stored = 0
+
+    def fingerprint(self, text: str) -> Tuple[Optional[Tuple[int, ...]], int]:
+        normalized = normalize_description(text)
+        if len(normalized) < DEDUP_MIN_TEXT_LENGTH:
+            return None, len(normalized)
+        return self._hasher.signature(normalized), len(normalized)
+
+    def find_duplicate(self, app_name: str, window_title: str, text: str,
+                       now: float = None) -> Tuple[Optional[int], Any]:
+        """返回 (可延长的记录ID 或 None, 指纹)；指纹传给 remember() 避免重复计算"""
+        now = now or time.time()
+        fingerprint = self.fingerprint(text)
+        signature, text_length = fingerprint
+        with self._lock:
+            self.checked += 1
+            state = self._streams.get((app_name, window_title))
+            if state is None or signature is None or now - state.first_seen > self.max_span:
+                return None, fingerprint
+            # 文本长度差异过大时 MinHash 可能高估相似度，直接视为内容变化
+            if min(text_length, state.text_length) < self.threshold * max(text_length, state.text_length):
+                return None, fingerprint
+            similarity = MinHasher.similarity(signature, state.signature)
+            if similarity < self.threshold:
+                return None, fingerprint
+            state.last_seen = now
+            state.extended += 1
+            self._streams.move_to_end((app_name, window_title))
+            self.suppressed += 1
+            logging.debug(f"屏幕内容近似重复 (相似度 {similarity:.2f})，延长记录 {state.record_id}")
+            return state.record_id, fingerprint
+
+    def remember(self, app_name: str, window_title: str, record_id: int, fingerprint: Any,
+                 now: float = None):
+        """新记录写入后登记为该窗口的比较基准"""
+        signature, text_length = fingerprint
+        key = (app_name, window_title)
+        with self._lock:
+            self.stored += 1
+            if signature is None:
+                self._streams.pop(key, None)
+                return
+            self._streams[key] = _StreamState(record_id, signature, text_length, now or time.time())
+            self._streams.move_to_end(key)
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+
+    def forget(self, app_name: str, window_title: str):
+        with self._lock:
+            self._streams.pop((app_name, window_title), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "suppressed": self.suppressed,
+            "stored": self.stored,
+            "suppress_ratio": round(self.suppressed / self.checked, 3) if self.checked else 0.0,
+            "streams": len(self._streams),
+        }
+
+
+# 全局去重器实例，定时截图共享
+screen_deduplicator = ScreenContentDeduplicator()
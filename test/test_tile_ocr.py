@@ -0,0 +1,74 @@
+"""
+分块OCR阅读顺序测试：跨多个分块的整行文字必须按 行 -> x 的顺序拼接
+"""
+import random
+import sys
+from pathlib import Path
+
+# 添加项目根目录到sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image
+
+from tile_ocr import TileOCR
+
+# 600x600 截图，3 列 x 6 行分块，每个分块 200x100
+# 第一行分块内有两行跨三列的文字，第三行分块内有一行短文字
+FRAGMENTS = [
+    {"text": "A", "box": (20, 10, 180, 30)},
+    {"text": "B", "box": (220, 12, 380, 30)},
+    {"text": "C", "box": (420, 10, 580, 28)},
+    {"text": "D", "box": (20, 50, 180, 70)},
+    {"text": "E", "box": (220, 52, 380, 70)},
+    {"text": "F", "box": (420, 50, 580, 68)},
+    {"text": "G", "box": (20, 210, 180, 230)},
+]
+EXPECTED_TEXT = "A B C\nD E F\nG"
+
+
+def test_assemble_text_orders_lines_then_x():
+    fragments = list(FRAGMENTS)
+    random.Random(7).shuffle(fragments)
+    fragments.append({"text": "无坐标", "box": None})
+    assert TileOCR.assemble_text(fragments) == EXPECTED_TEXT + "\n无坐标"
+
+
+def test_split_rows_share_bounds():
+    boxes = TileOCR(columns=3, rows=6).split(Image.new("RGB", (600, 600), "white"))
+    assert len(boxes) == 18
+    for row in range(6):
+        row_boxes = boxes[row * 3:(row + 1) * 3]
+        assert len({(box[1], box[3]) for box in row_boxes}) == 1
+        assert [box[0] for box in row_boxes] == sorted(box[0] for box in row_boxes)
+
+
+def test_parse_keeps_reading_order_across_tiles():
+    ocr = TileOCR(columns=3, rows=6)
+    image = Image.new("RGB", (600, 600), "white")
+    calls = []
+
+    def parse_full(full_image):
+        calls.append("full")
+        return [dict(fragment) for fragment in reversed(FRAGMENTS)]
+
+    def parse_tile(tile, box):
+        calls.append(box)
+        return []
+
+    # 首次解析全部分块都是脏块，整图解析后按坐标分配到各分块
+    result = ocr.parse(image, "tesseract", parse_full, parse_tile)
+    assert result is not None and result.full_parse
+    assert result.text == EXPECTED_TEXT
+
+    # 画面不变时全部命中分块缓存，拼接顺序保持不变
+    result = ocr.parse(image, "tesseract", parse_full, parse_tile)
+    assert result is not None and not result.full_parse and result.dirty_tiles == 0
+    assert result.text == EXPECTED_TEXT
+    assert calls == ["full"]
+
+
+if __name__ == "__main__":
+    for test in (test_assemble_text_orders_lines_then_x, test_split_rows_share_bounds,
+                 test_parse_keeps_reading_order_across_tiles):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,188 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+TILE_COLUMNS = 3               # 截图横向分块数
+TILE_ROWS = 6                  # 截图纵向分块数
+TILE_SNAP_PIXELS = 16          # 分块边界向附近最“干净”的行/列（空白间隔）吸附的最大距离，避免切断文字
+TILE_FULL_PARSE_RATIO = 0.34   # 脏块比例超过该值时改为整图解析一次，再按坐标把结果分配到各分块
+TILE_CACHE_MAX_ENTRIES = 1024  # 分块解析结果缓存条目数 (LRU)
+
+Box = Tuple[int, int, int, int]
+# 解析片段: {"text": 文本, "box": 整图像素坐标 (x0, y0, x1, y1) 或 None, "element": 视觉元素或 None}
+Fragment = Dict[str, Any]
+
+
+class TileParseResult:
+    __slots__ = ("text", "elements", "dirty_tiles", "total_tiles", "full_parse")
+
+    def __init__(self, text: str, elements: List[Dict], dirty_tiles: int, total_tiles: int, full_parse: bool):
+        self.text = text
+        self.elements = elements
+        self.dirty_tiles = dirty_tiles
+        self.total_tiles = total_tiles
+        self.full_parse = full_parse
+
+
+class TileOCR:
+    """分块增量 OCR
+
+    截图按网格切分，边界吸附到附近的空白行/列。每个分块的解析结果以 (解析器, 位置,
+    像素哈希) 为键缓存，只有内容变化的“脏块”才重新交给 Tesseract/Omniparser 解析。
+    同一行分块共用上下边界，拼接文本时把整行分块的片段按坐标重新排成文字行（同一行
+    按 x 排序），跨列的整行文字不会被拆散。脏块较多时整图解析一次，按片段坐标分配
+    到各分块并写入缓存，之后的局部变化就只需解析对应分块。
+    """
+
+    def __init__(self, columns: int = None, rows: int = None, full_parse_ratio: float = None,
+                 cache_size: int = None):
+        self.columns = columns or TILE_COLUMNS
+        self.rows = rows or TILE_ROWS
+        self.full_parse_ratio = full_parse_ratio if full_parse_ratio is not None else TILE_FULL_PARSE_RATIO
+        self.cache_size = cache_size or TILE_CACHE_MAX_ENTRIES
+        self._cache: "OrderedDict[Tuple, List[Fragment]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.tiles_total = 0
+        self.tiles_parsed = 0
+        self.full_parses = 0
+
+    # ---- 分块 ----
+    @staticmethod
+    def _snap(gray: Image.Image, nominal: int, low: int, high: int, span: Tuple[int, int], vertical: bool) -> int:
+        """在 nominal 附近寻找像素最均匀的一行（vertical 为 True 时为一列）作为分块边界"""
+        best, best_score = nominal, None
+        for pos in range(max(low, nominal - TILE_SNAP_PIXELS), min(high, nominal + TILE_SNAP_PIXELS + 1)):
+            box = (pos, span[0], pos + 1, span[1]) if vertical else (span[0], pos, span[1], pos + 1)
+            lo, hi = gray.crop(box).getextrema()
+            score = (hi - lo, abs(pos - nominal))
+            if best_score is None or score < best_score:
+                best, best_score = pos, score
+        return best
+
+    def split(self, image: Image.Image) -> List[Box]:
+        """返回按阅读顺序（行优先）排列的分块坐标，同一行分块的上下边界相同"""
+        width, height = image.size
+        gray = image.convert('L')
+        xs = [0] + [self._snap(gray, width * i // self.columns, 1, width - 1, (0, height), True)
+                    for i in range(1, self.columns)] + [width]
+        ys = [0] + [self._snap(gray, height * j // self.rows, 1, height - 1, (0, width), False)
+                    for j in range(1, self.rows)] + [height]
+        return [(x0, y0, x1, y1)
+                for y0, y1 in zip(ys, ys[1:]) if y1 > y0
+                for x0, x1 in zip(xs, xs[1:]) if x1 > x0]
+
+    @staticmethod
+    def _tile_key(parser: str, box: Box, tile: Image.Image) -> Tuple:
+        return parser, box, hashlib.blake2b(tile.tobytes(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _tile_index(boxes: List[Box], fragment_box: Optional[Box]) -> int:
+        if not fragment_box:
+            return 0
+        cx = (fragment_box[0] + fragment_box[2]) / 2
+        cy = (fragment_box[1] + fragment_box[3]) / 2
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            if x0 <= cx < x1 and y0 <= cy < y1:
+                return i
+        return len(boxes) - 1
+
+    # ---- 解析 ----
+    def parse(self, image: Image.Image, parser: str,
+              parse_full: Callable[[Image.Image], Optional[List[Fragment]]],
+              parse_tile: Callable[[Image.Image, Box], Optional[List[Fragment]]]) -> Optional[TileParseResult]:
+        """
+        parse_full(image) 解析整图，parse_tile(tile, box) 解析单个分块，均返回整图坐标的片段列表，
+        失败时返回 None。任一解析失败时本方法返回 None，由调用方回退到其他解析器。
+        """
+        boxes = self.split(image)
+        tiles = [image.crop(box) for box in boxes]
+        keys = [self._tile_key(parser, box, tile) for box, tile in zip(boxes, tiles)]
+        results: List[Optional[List[Fragment]]] = []
+        with self._lock:
+            for key in keys:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                results.append(cached)
+        dirty = [i for i, cached in enumerate(results) if cached is None]
+
+        full_parse = len(dirty) > self.full_parse_ratio * len(boxes)
+        if full_parse:
+            fragments = parse_full(image)
+            if fragments is None:
+                return None
+            results = [[] for _ in boxes]
+            for fragment in fragments:
+                results[self._tile_index(boxes, fragment.get("box"))].append(fragment)
+            dirty = list(range(len(boxes)))
+        else:
+            for i in dirty:
+                lo, hi = tiles[i].convert('L').getextrema()
+                if lo == hi:
+                    # 纯色分块没有文字，不必调用解析器
+                    results[i] = []
+                    continue
+                fragments = parse_tile(tiles[i], boxes[i])
+                if fragments is None:
+                    return None
+                results[i] = fragments
+
+        with self._lock:
+            for i in dirty:
+                self._cache[keys[i]] = results[i]
+                self._cache.move_to_end(keys[i])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.tiles_total += len(boxes)
+            self.tiles_parsed += len(dirty)
+            self.full_parses += int(full_parse)
+
+        # 按分块行（相同的上下边界）合并片段，再排成文字行
+        bands: "OrderedDict[Tuple[int, int], List[Fragment]]" = OrderedDict()
+        for box, fragments in zip(boxes, results):
+            bands.setdefault((box[1], box[3]), []).extend(fragments)
+        band_texts = [self.assemble_text(fragments) for fragments in bands.values()]
+        elements = [fragment["element"] for fragments in results for fragment in fragments
+                    if fragment.get("element") is not None]
+        return TileParseResult("\n".join(text for text in band_texts if text), elements,
+                               len(dirty), len(boxes), full_parse)
+
+    @staticmethod
+    def assemble_text(fragments: List[Fragment]) -> str:
+        """按片段坐标恢复阅读顺序：纵向中心落在同一行范围内的片段归为一行并按 x 排序，行间换行"""
+        placed = [f for f in fragments if f.get("box") and (f.get("text") or "").strip()]
+        unplaced = [f for f in fragments if not f.get("box") and (f.get("text") or "").strip()]
+        lines: List[List] = []  # [行上沿, 行下沿, 片段列表]
+        for fragment in sorted(placed, key=lambda f: (f["box"][1] + f["box"][3]) / 2):
+            center = (fragment["box"][1] + fragment["box"][3]) / 2
+            if lines and lines[-1][0] <= center <= lines[-1][1]:
+                lines[-1][2].append(fragment)
+            else:
+                lines.append([fragment["box"][1], fragment["box"][3], [fragment]])
+        texts = [" ".join(f["text"].strip() for f in sorted(line_fragments, key=lambda f: f["box"][0]))
+                 for _, _, line_fragments in lines]
+        # 没有坐标的片段无法定位，按原顺序放在最后
+        texts.extend(f["text"].strip() for f in unplaced)
+        return "\n".join(texts)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tiles_total": self.tiles_total,
+            "tiles_parsed": self.tiles_parsed,
+            "tile_reuse_ratio": round(1 - self.tiles_parsed / self.tiles_total, 3) if self.tiles_total else 0.0,
+            "full_parses": self.full_parses,
+            "cache_entries": len(self._cache),
+        }
+
+
+# 全局分块 OCR 实例，定时截图共享分块缓存
+tile_ocr = TileOCR()
@@ -19,8 +19,8 @@ import logging
 # Import the OpenAI library (async version)
 from openai import AsyncOpenAI, APIError # Import APIError for specific exception handling
 import httpx # Ensure httpx is imported
-import oss2
 import os
+from oss_uploader import oss_uploader
 
 
 # Initialize the AsyncOpenAI client for OpenRouter
@@ -64,6 +64,56 @@ def frames_to_base64(frames,fps,timestamps):
     return video_base64
 
 
+# 关键帧选择累计统计
+keyframe_stats = {
+    "windows": 0,       # 处理的分析窗口数
+    "input_frames": 0,  # 窗口内的候选帧总数
+    "sent_frames": 0,   # 实际上传的帧数
+    "saved_frames": 0,  # 相比均匀抽帧少上传的帧数
+}
+
+
+def frame_dhash(frame, hash_size=8):
+    """计算帧的差值感知哈希 (dHash)，返回 hash_size*hash_size 位整数"""
+    gray = frame if len(frame.shape) == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash1, hash2):
+    """两个感知哈希之间的汉明距离"""
+    return bin(hash1 ^ hash2).count('1')
+
+
+def select_keyframes(frames, max_frames, min_distance=None):
+    """按感知哈希选择差异最大的关键帧，剔除近似重复帧
+
+    以最新一帧为锚点，每次加入与已选帧最小汉明距离最大的帧（最远点采样），
+    当剩余帧都与已选帧过于相似时停止。返回按时间顺序排列的帧索引。
+    """
+    if min_distance is None:
+        min_distance = VideoConfig.KEYFRAME_HASH_DISTANCE
+    if len(frames) == 0 or max_frames <= 0:
+        return []
+
+    hashes = [frame_dhash(frame) for frame in frames]
+    selected = [len(frames) - 1]
+    # 每个候选帧到已选集合的最小距离
+    min_distances = {i: hamming_distance(hashes[i], hashes[selected[0]]) for i in range(len(frames) - 1)}
+
+    while min_distances and len(selected) < max_frames:
+        best_index = max(min_distances, key=lambda i: (min_distances[i], -i))
+        if min_distances[best_index] < min_distance:
+            break
+        selected.append(best_index)
+        del min_distances[best_index]
+        for i in min_distances:
+            min_distances[i] = min(min_distances[i], hamming_distance(hashes[i], hashes[best_index]))
+
+    return sorted(selected)
+
+
 #强制抽取关键帧帧，限制数量
 async def video_chat_async_limit_frame(text, frames, timestamps, fps=20, use_oss=True):
     # --- 新增：限制最大图片数量 ---
@@ -77,12 +127,28 @@ async def video_chat_async_limit_frame(text, frames, timestamps, fps=20, use_oss
         logging.error(f"没有足够的帧可供发送 (需要至少1帧, 共有 {len(frames)} 帧).")
         return "Error: No frames available to send."
     
-    # 从可用帧中均匀选取帧
-    indices = np.linspace(0, len(frames) - 1, num=desired_frame_count, dtype=int)
+    if VideoConfig.KEYFRAME_DEDUP_ENABLED:
+        # 按感知哈希选择差异最大的关键帧
+        indices = select_keyframes(frames, desired_frame_count)
+    else:
+        # 从可用帧中均匀选取帧
+        indices = np.linspace(0, len(frames) - 1, num=desired_frame_count, dtype=int)
     selected_frames = [frames[i] for i in indices]
+
+    saved = desired_frame_count - len(selected_frames)
+    keyframe_stats["windows"] += 1
+    keyframe_stats["input_frames"] += len(frames)
+    keyframe_stats["sent_frames"] += len(selected_frames)
+    keyframe_stats["saved_frames"] += saved
+    logging.info(f"关键帧选择: 候选 {len(frames)} 帧，上传 {len(selected_frames)} 帧，本窗口节省 {saved} 帧 "
+                 f"(累计节省 {keyframe_stats['saved_frames']} 帧)")
     
-    # 强制使用OSS存储和URL
-    image_urls = upload_frames_to_oss(selected_frames)
+    # 强制使用OSS存储和URL (线程池并行上传，不阻塞事件循环)
+    try:
+        image_urls = await oss_uploader.upload_frames_async(selected_frames)
+    except Exception as e:
+        logging.error(f"上传多帧到OSS失败: {e}")
+        image_urls = []
     if not image_urls:
         logging.error("无法上传图像到OSS")
         return "Error: Failed to upload images to OSS."
@@ -111,12 +177,12 @@ async def video_chat_async_limit_frame(text, frames, timestamps, fps=20, use_oss
     }
 
     try:
-        async with httpx.AsyncClient(timeout=APIConfig.REQUEST_TIMEOUT) as client:
-            response = await client.post(
-                api_url,
-                headers=headers,
-                json=data
-            )
+        response = await llm_service.http_gateway.post(
+            api_url,
+            headers=headers,
+            json=data,
+            timeout=APIConfig.REQUEST_TIMEOUT
+        )
 
         # Check HTTP status code
         if response.status_code != 200:
@@ -184,22 +250,19 @@ async def chat_request(message, stream=False):
 
 # Keep insert_txt as is, assuming it talks to a different service
 async def insert_txt(docs: List[str], table_name: str) -> bool:
-    # ... (Keep using httpx for RAG service) ...
-    # Ensure httpx is imported
-    import httpx
+    # ... (RAG service calls go through the shared HTTP gateway) ...
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                RAGConfig.VECTOR_API_URL,
-                json={
-                    "docs": docs,
-                    "table_name": table_name
-                },
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("status") == "success"
+        response = await llm_service.http_gateway.post(
+            RAGConfig.VECTOR_API_URL,
+            json={
+                "docs": docs,
+                "table_name": table_name
+            },
+            timeout=30.0
+        )
+        response.raise_for_status()
+        result = response.json()
+        return result.get("status") == "success"
     except Exception as e:
         print(f"向 RAG 系统添加文本失败: {e}")
         return False
@@ -207,31 +270,10 @@ async def insert_txt(docs: List[str], table_name: str) -> bool:
 # Make sure to import llm_service if chat_request uses it
 import llm_service
 
-def upload_frames_to_oss(frames, max_retries=3):
-    """上传多个帧到OSS并返回URL列表"""
-    urls = []
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            auth = oss2.Auth(OSSConfig.ACCESS_KEY_ID, OSSConfig.ACCESS_KEY_SECRET)
-            bucket = oss2.Bucket(auth, OSSConfig.ENDPOINT, OSSConfig.BUCKET)
-            
-            for i, frame in enumerate(frames):
-                object_key = f"{OSSConfig.ANALYSIS_PREFIX}{int(time.time())}_{i}.jpg"
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, VideoConfig.JPEG_QUALITY])
-                bucket.put_object(object_key, buffer.tobytes())
-                urls.append(f"https://{OSSConfig.BUCKET}.{OSSConfig.ENDPOINT}/{object_key}")
-            
-            return urls
-        except Exception as e:
-            logging.error(f"上传多帧到OSS失败 (尝试 {retry_count+1}/{max_retries}): {e}")
-            retry_count += 1
-            if retry_count < max_retries:
-                time.sleep(1)  # 等待1秒再重试
-    
-    # 不再返回None进行回退，直接抛出异常
-    raise Exception(f"上传到OSS失败，已重试{max_retries}次")
+def upload_frames_to_oss(frames):
+    """上传多个帧到OSS并返回URL列表 (同步接口，由共享上传服务并行上传，重试次数见 OSSConfig.UPLOAD_MAX_RETRIES)"""
+    # 不再返回None进行回退，失败时直接抛出异常
+    return oss_uploader.upload_frames(frames)
 
 def frames_to_video_oss(frames, fps, timestamps, alert_id=None):
     """将帧序列转换为视频并上传到OSS"""
@@ -261,17 +303,10 @@ def frames_to_video_oss(frames, fps, timestamps, alert_id=None):
     
     # 上传到OSS
     try:
-        auth = oss2.Auth(OSSConfig.ACCESS_KEY_ID, OSSConfig.ACCESS_KEY_SECRET)
-        bucket = oss2.Bucket(auth, OSSConfig.ENDPOINT, OSSConfig.BUCKET)
-        
         # 使用唯一标识符创建对象键
         object_key = f"{OSSConfig.ALERT_PREFIX}video_{unique_id}.mp4"
         
-        with open(temp_path, 'rb') as video_file:
-            bucket.put_object(object_key, video_file)
-        
-        # 生成URL
-        url = f"https://{OSSConfig.BUCKET}.{OSSConfig.ENDPOINT}/{object_key}"
+        url = oss_uploader.put(object_key, temp_path)
         
         # 删除临时文件
         os.remove(temp_path)
@@ -1,19 +1,229 @@
 import sqlite3
 import json
 import logging
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 from contextlib import contextmanager
 import os
 
+from config import DatabaseConfig
+
 # 数据库文件路径
 DATABASE_PATH = "video_activities.db"
+IN_QUERY_CHUNK_SIZE = 500  # 批量 IN (...) 查询每次最多绑定的ID数
+
+
+def time_str_to_epoch(time_str: Optional[str]) -> Optional[float]:
+    """把 'YYYY-MM-DD HH:MM:SS' 格式的本地时间转换为 Unix 时间戳，无法解析时返回 None"""
+    if not time_str:
+        return None
+    try:
+        return datetime.fromisoformat(str(time_str).replace(' ', 'T')).timestamp()
+    except (ValueError, TypeError):
+        return None
+
+
+class _DatabaseJob:
+    __slots__ = ("fn", "args", "kwargs", "write", "future")
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, write: bool):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.write = write
+        self.future: Future = Future()
+
+
+class DatabaseWorker:
+    """专用数据库线程
+    
+    读操作按提交顺序逐个执行；开启合并提交时，连续到达的写操作在同一个事务中执行
+    （每个写操作一个 SAVEPOINT，单个失败不影响同批其他写入），最后只提交一次。
+    写函数签名为 fn(conn, *args)，不得自行 commit；读函数签名为 fn(*args)。
+    """
+    
+    def __init__(self, database: "VideoDatabase", group_commit: bool = None,
+                 max_batch: int = None, max_delay: float = None):
+        self.db = database
+        self.group_commit = DatabaseConfig.GROUP_COMMIT_ENABLED if group_commit is None else group_commit
+        self.max_batch = max_batch or DatabaseConfig.GROUP_COMMIT_MAX_BATCH
+        self.max_delay = DatabaseConfig.GROUP_COMMIT_MAX_DELAY if max_delay is None else max_delay
+        self._queue: "queue.Queue[Optional[_DatabaseJob]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        
+        # 统计信息
+        self.commits = 0
+        self.writes = 0
+        self.reads = 0
+    
+    @property
+    def in_worker_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+    
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="video-db", daemon=True)
+                    self._thread.start()
+    
+    def submit(self, fn: Callable, *args, write: bool = False, **kwargs) -> Future:
+        """提交到数据库线程执行，返回 concurrent.futures.Future"""
+        job = _DatabaseJob(fn, args, kwargs, write)
+        if self.in_worker_thread:
+            # 在数据库线程内部调用时直接执行，避免自我等待
+            self._execute_batch([job]) if write else self._execute_read(job)
+            return job.future
+        self._ensure_started()
+        self._queue.put(job)
+        return job.future
+    
+    async def run(self, fn: Callable, *args, write: bool = False, **kwargs):
+        """异步等待数据库线程的执行结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, write=write, **kwargs))
+    
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if not job.write:
+                self._execute_read(job)
+                continue
+            
+            batch, deferred_reads, stop = [job], [], False
+            if self.group_commit:
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        next_job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if next_job is None:
+                        stop = True
+                        break
+                    if next_job.write:
+                        batch.append(next_job)
+                    else:
+                        # 读操作在本批提交后执行，保证能读到之前提交的写入
+                        deferred_reads.append(next_job)
+            
+            self._execute_batch(batch)
+            for read_job in deferred_reads:
+                self._execute_read(read_job)
+            if stop:
+                return
+    
+    def _execute_read(self, job: _DatabaseJob):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.fn(*job.args, **job.kwargs))
+        except Exception as e:
+            job.future.set_exception(e)
+        self.reads += 1
+    
+    def _execute_batch(self, batch: List[_DatabaseJob]):
+        conn = self.db._thread_connection()
+        outcomes = []
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = job.fn(conn, *job.args, **job.kwargs)
+                    conn.execute("RELEASE job")
+                    outcomes.append((job, result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((job, None, e))
+            conn.commit()
+        except Exception as e:
+            logging.error(f"数据库合并提交失败 ({len(batch)} 个写操作): {e}")
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            outcomes = [(job, None, e) for job in batch]
+        else:
+            self.commits += 1
+            self.writes += len(batch)
+        
+        for job, result, error in outcomes:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+    
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "group_commit": self.group_commit,
+            "commits": self.commits,
+            "writes": self.writes,
+            "reads": self.reads,
+            "avg_writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "pending": self._queue.qsize(),
+        }
+
+
+class AsyncVideoDatabase:
+    """VideoDatabase 的异步外观：所有操作在专用数据库线程上执行，不阻塞事件循环
+    
+    写操作走合并提交；其他公开方法按原签名以协程形式调用，例如
+    await video_db.aio.get_recent_activities(10)。
+    """
+    
+    def __init__(self, database: "VideoDatabase"):
+        self._db = database
+    
+    async def insert_activity(self, activity_data: Dict[str, Any]) -> int:
+        return await self._db.worker.run(self._db._insert_activity, activity_data, write=True)
+    
+    async def update_activity_end_time(self, activity_id: int, end_time: str, duration_minutes: float):
+        return await self._db.worker.run(
+            self._db._update_activity_end_time, activity_id, end_time, duration_minutes, write=True
+        )
+    
+    def __getattr__(self, name: str):
+        method = getattr(self._db, name)
+        if not callable(method) or name.startswith('_'):
+            raise AttributeError(name)
+        
+        async def call(*args, **kwargs):
+            return await self._db.worker.run(method, *args, **kwargs)
+        return call
+
 
 class VideoDatabase:
-    """视频活动数据库管理类"""
+    """视频活动数据库管理类
+    
+    每个线程复用一个长连接（WAL 模式、synchronous=NORMAL、预编译语句缓存），
+    异步代码通过 self.aio 在专用数据库线程上访问。
+    """
     
     def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.worker = DatabaseWorker(self)
+        self.aio = AsyncVideoDatabase(self)
         self.init_database()
     
     def init_database(self):
@@ -62,61 +272,101 @@ class VideoDatabase:
             conn.commit()
             logging.info("视频活动数据库初始化完成")
     
+    def _thread_connection(self) -> sqlite3.Connection:
+        """返回当前线程的长连接，首次使用时创建"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=DatabaseConfig.BUSY_TIMEOUT,
+                cached_statements=DatabaseConfig.CACHED_STATEMENTS
+            )
+            conn.row_factory = sqlite3.Row  # 支持字典式访问
+            if DatabaseConfig.WAL_ENABLED:
+                conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={DatabaseConfig.SYNCHRONOUS}')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
     @contextmanager
     def get_connection(self):
-        """获取数据库连接的上下文管理器"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # 支持字典式访问
+        """获取当前线程数据库连接的上下文管理器（连接复用，不在退出时关闭）"""
+        conn = self._thread_connection()
         try:
             yield conn
         except Exception as e:
             conn.rollback()
             logging.error(f"数据库操作失败: {e}")
             raise
-        finally:
-            conn.close()
+    
+    def close(self):
+        """停止数据库线程并关闭所有线程的连接"""
+        self.worker.stop()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # 其他线程创建的连接，随线程结束回收
+                pass
+        self._local = threading.local()
     
     def insert_activity(self, activity_data: Dict[str, Any]) -> int:
-        """插入新的活动记录"""
+        """插入新的活动记录（开启合并提交时与其他写入合并为一个事务）"""
+        if self.worker.group_commit:
+            return self.worker.submit(self._insert_activity, activity_data, write=True).result()
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO video_activities 
-                (activity_type, content, start_time, end_time, duration_minutes, 
-                 confidence_score, image_path, metadata_json, source_type)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                activity_data.get('activity_type'),
-                activity_data.get('content'),
-                activity_data.get('start_time'),
-                activity_data.get('end_time'),
-                activity_data.get('duration_minutes', 0),
-                activity_data.get('confidence_score', 0),
-                activity_data.get('image_path'),
-                json.dumps(activity_data.get('metadata', {})),
-                activity_data.get('source_type', 'video_analysis')
-            ))
-            
-            activity_id = cursor.lastrowid
+            activity_id = self._insert_activity(conn, activity_data)
             conn.commit()
-            
-            logging.info(f"插入活动记录: ID={activity_id}, 类型={activity_data.get('activity_type')}")
             return activity_id
     
+    def _insert_activity(self, conn: sqlite3.Connection, activity_data: Dict[str, Any]) -> int:
+        """插入活动记录，不提交事务"""
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO video_activities 
+            (activity_type, content, start_time, end_time, duration_minutes, 
+             confidence_score, image_path, metadata_json, source_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            activity_data.get('activity_type'),
+            activity_data.get('content'),
+            activity_data.get('start_time'),
+            activity_data.get('end_time'),
+            activity_data.get('duration_minutes', 0),
+            activity_data.get('confidence_score', 0),
+            activity_data.get('image_path'),
+            json.dumps(activity_data.get('metadata', {})),
+            activity_data.get('source_type', 'video_analysis')
+        ))
+        
+        activity_id = cursor.lastrowid
+        logging.info(f"插入活动记录: ID={activity_id}, 类型={activity_data.get('activity_type')}")
+        return activity_id
+    
     def update_activity_end_time(self, activity_id: int, end_time: str, duration_minutes: float):
         """更新活动的结束时间和持续时长"""
+        if self.worker.group_commit:
+            return self.worker.submit(
+                self._update_activity_end_time, activity_id, end_time, duration_minutes, write=True
+            ).result()
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE video_activities 
-                SET end_time = ?, duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (end_time, duration_minutes, activity_id))
-            
+            self._update_activity_end_time(conn, activity_id, end_time, duration_minutes)
             conn.commit()
-            logging.info(f"更新活动记录: ID={activity_id}, 持续时长={duration_minutes}分钟")
+    
+    def _update_activity_end_time(self, conn: sqlite3.Connection, activity_id: int,
+                                  end_time: str, duration_minutes: float):
+        """更新活动结束时间，不提交事务"""
+        conn.execute('''
+            UPDATE video_activities 
+            SET end_time = ?, duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (end_time, duration_minutes, activity_id))
+        logging.info(f"更新活动记录: ID={activity_id}, 持续时长={duration_minutes}分钟")
     
     def get_activities_by_time_range(self, start_time: str, end_time: str, 
                                    activity_type: Optional[str] = None) -> List[Dict]:
@@ -139,6 +389,46 @@ class VideoDatabase:
             cursor.execute(sql, params)
             return [dict(row) for row in cursor.fetchall()]
     
+    def count_activities_by_time_range(self, start_time: str, end_time: str,
+                                       activity_type: Optional[str] = None) -> int:
+        """统计时间范围内的活动记录数 (走 start_time 索引)"""
+        with self.get_connection() as conn:
+            sql = 'SELECT COUNT(*) FROM video_activities WHERE start_time >= ? AND start_time <= ?'
+            params = [start_time, end_time]
+            if activity_type:
+                sql += ' AND activity_type = ?'
+                params.append(activity_type)
+            return conn.execute(sql, params).fetchone()[0]
+    
+    def iter_activities_by_time_range(self, start_time: str, end_time: str,
+                                      activity_type: Optional[str] = None,
+                                      page_size: int = 500) -> Iterator[Dict]:
+        """按 (start_time, id) 键集分页，升序流式返回时间范围内的活动记录
+        
+        每页单独查询并立即释放连接，长时间导出不会一直占用数据库读锁。
+        """
+        last_time, last_id = start_time, 0
+        while True:
+            sql = '''
+                SELECT * FROM video_activities 
+                WHERE (start_time > ? OR (start_time = ? AND id > ?)) AND start_time <= ?
+            '''
+            params = [last_time, last_time, last_id, end_time]
+            
+            if activity_type:
+                sql += ' AND activity_type = ?'
+                params.append(activity_type)
+            
+            sql += ' ORDER BY start_time, id LIMIT ?'
+            params.append(page_size)
+            
+            with self.get_connection() as conn:
+                rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_time, last_id = rows[-1]['start_time'], rows[-1]['id']
+    
     def get_activity_statistics(self, date_str: str, activity_type: Optional[str] = None) -> Dict:
         """获取指定日期的活动统计"""
         with self.get_connection() as conn:
@@ -237,6 +527,20 @@ class VideoDatabase:
             
             return dict(row) if row else None
     
+    def get_activities_by_ids(self, activity_ids: List[int]) -> Dict[int, Dict]:
+        """按ID批量获取活动记录，返回 {id: 记录}；一次 IN (...) 查询代替逐条查询"""
+        ids = list(dict.fromkeys(int(activity_id) for activity_id in activity_ids))
+        records: Dict[int, Dict] = {}
+        if not ids:
+            return records
+        with self.get_connection() as conn:
+            for i in range(0, len(ids), IN_QUERY_CHUNK_SIZE):
+                chunk = ids[i:i + IN_QUERY_CHUNK_SIZE]
+                placeholders = ', '.join('?' * len(chunk))
+                for row in conn.execute(f'SELECT * FROM video_activities WHERE id IN ({placeholders})', chunk):
+                    records[row['id']] = dict(row)
+        return records
+    
     def delete_old_activities(self, days_to_keep: int = 30):
         """删除过期的活动记录"""
         cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).strftime('%Y-%m-%d %H:%M:%S')
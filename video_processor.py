@@ -5,24 +5,32 @@ import time
 import asyncio
 from datetime import datetime
 import numpy as np
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, List, Union
 import logging
 import os
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
 from multi_modal_analyzer import MultiModalAnalyzer
 from config import VideoConfig, OSSConfig, RAGConfig
-import oss2
 from utility import frames_to_video_oss
+from oss_uploader import oss_uploader
+from frame_buffer import FrameRingBuffer
+from frame_hub import FrameBroadcastHub
+from analysis_scheduler import AnalysisScheduler, analysis_scheduler
+from motion_gate import MotionGate
+from alert_bus import AlertBus, alert_bus as default_alert_bus
 
 
 class VideoProcessor:
-    def __init__(self, video_source: Union[int, str]):
+    def __init__(self, video_source: Union[int, str], camera_id: str = "cam0",
+                 alert_bus: Optional[AlertBus] = None,
+                 scheduler: Optional[AnalysisScheduler] = None):
         self.video_source = video_source
+        self.camera_id = camera_id
         self.is_camera = isinstance(video_source, int)
 
-        # 添加frame_queue属性
-        self.frame_queue = queue.Queue()
+        # 视频帧广播中心 (编码一次，推送给所有 /video_feed 连接)
+        self.frame_hub = FrameBroadcastHub(jpeg_quality=VideoConfig.JPEG_QUALITY)
 
         # 初始化视频捕获
         if self.is_camera:
@@ -45,27 +53,27 @@ class VideoProcessor:
         self.running = True
         self.processing = False
 
-        # 实时显示帧
-        self.display_frame = None
-        self.display_lock = threading.Lock()
+        # 实时显示帧环形缓冲区 (采集线程直接读入槽位)
+        self.display_buffer = FrameRingBuffer(VideoConfig.DISPLAY_BUFFER_SIZE)
 
-        # 分析用帧列表
-        self.analysis_frames = []
-        self.analysis_timestamps = []
+        # 分析用帧环形缓冲区 (每秒采样一帧)
+        self.analysis_buffer = FrameRingBuffer(max(2, int(VideoConfig.BUFFER_DURATION)))
         self.last_analysis = time.time()
 
-        # 消息队列
-        self.alert_queue = queue.Queue()
+        # 运动门控：静止画面跳过/退避分析，大幅变化立即分析
+        self.motion_gate = MotionGate()
 
-        # 分析器 (注入预警队列)
-        self.analyzer = MultiModalAnalyzer(alert_queue=self.alert_queue)
+        # 预警总线 (所有摄像头共享，由 video_server 的 /alerts 连接订阅)
+        self.alert_bus = alert_bus or default_alert_bus
+
+        # 分析器 (注入预警总线)，分析任务提交到共享调度器执行
+        self.analyzer = MultiModalAnalyzer(alert_bus=self.alert_bus, camera_id=camera_id)
+        self.scheduler = scheduler or analysis_scheduler
 
         # 创建摄像头线程
-        self.webcam_thread = threading.Thread(target=self._process_webcam)
+        self.webcam_thread = threading.Thread(target=self._process_webcam, name=f"capture-{camera_id}")
         self.webcam_thread.daemon = True
 
-        self.start_push_queue = 0
-
         # 添加活动追踪相关属性
         self.current_activity = None  # 当前正在进行的活动
         self.activity_start_time = None  # 活动开始时间
@@ -85,7 +93,6 @@ class VideoProcessor:
             
             self.running = True
             self.webcam_thread.start()
-            asyncio.create_task(self._process_alerts())
             while self.running:
                 await asyncio.sleep(1)
         except Exception as e:
@@ -107,12 +114,12 @@ class VideoProcessor:
 
         while self.running:
             try:
-                ret, frame = self.cap.read()
+                ret, frame = self._read_frame()
 
                 if not ret:
                     if not self.is_camera:
                         self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                        ret, frame = self.cap.read()
+                        ret, frame = self._read_frame()
                         if not ret:
                             time.sleep(0.1)
                             continue
@@ -123,102 +130,62 @@ class VideoProcessor:
                 current_time = time.time()
                 frame_count += 1
 
-                # 更新显示帧
-                with self.display_lock:
-                    self.display_frame = frame.copy()
+                # 提交显示帧 (原地读取时无拷贝)
+                seq = self.display_buffer.commit(frame, current_time)
+                frame = self.display_buffer.latest()
+
+                # 有订阅者时编码一次并广播，用于WebSocket传输
+                self.frame_hub.publish(frame, seq)
 
-                # 收集分析帧
+                # 收集分析帧 (拷贝到预分配槽位)
                 if current_time - last_analysis_update >= 1.0:
-                    self.analysis_frames.append(frame.copy())
-                    self.analysis_timestamps.append(datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
-                    max_frames = int(VideoConfig.BUFFER_DURATION)
-                    if len(self.analysis_frames) > max_frames:
-                        self.analysis_frames = self.analysis_frames[-max_frames:]
-                        self.analysis_timestamps = self.analysis_timestamps[-max_frames:]
+                    self.analysis_buffer.write(frame, current_time)
+                    self.motion_gate.observe(frame)
                     last_analysis_update = current_time
 
-                # 触发异常分析
-                if current_time - self.last_analysis >= VideoConfig.ANALYSIS_INTERVAL and not self.processing:
-                    if len(self.analysis_frames) >= 2:
-                        analysis_task = threading.Thread(
-                            target=self._run_analysis,
-                            args=(self.analysis_frames.copy(), self.analysis_timestamps.copy())
-                        )
-                        analysis_task.daemon = True
-                        analysis_task.start()
+                # 触发异常分析 (由运动门控决定是否执行)
+                if not self.processing and len(self.analysis_buffer) >= 2:
+                    reason = self.motion_gate.should_analyze(current_time)
+                    if reason:
+                        frames, timestamps = self.analysis_buffer.snapshot_frames()
+                        logging.info(f"[{self.camera_id}] 触发分析: {reason}, 运动分数 {self.motion_gate.peak_motion:.4f}")
+                        self._run_analysis(frames, timestamps)
+                        self.motion_gate.mark_executed(reason, current_time)
                         self.last_analysis = current_time
 
                 if not self.is_camera:
                     time.sleep(max(0, self.frame_interval - (time.time() - current_time)))
 
-                # 添加到帧队列，用于WebSocket传输
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, VideoConfig.JPEG_QUALITY])
-                try:
-                    # 如果队列满，清空旧帧
-                    if self.frame_queue.qsize() > 10:  # 保持帧队列不过长
-                        while not self.frame_queue.empty():
-                            try:
-                                self.frame_queue.get_nowait()
-                            except queue.Empty:
-                                break
-                    self.frame_queue.put_nowait(buffer.tobytes())
-                except Exception as e:
-                    logging.error(f"添加帧到队列出错: {e}")
-
             except Exception as e:
                 logging.error(f"视频处理错误: {e}")
                 time.sleep(0.1)
 
+    def _read_frame(self):
+        """读取一帧，尽量直接写入显示缓冲区的下一个槽位"""
+        slot = self.display_buffer.acquire_slot()
+        if slot is None:
+            return self.cap.read()
+        return self.cap.read(slot)
+
     def _run_analysis(self, frames, timestamps):
-        """在单独的线程中运行异常分析"""
+        """将异常分析提交到共享分析调度器"""
+        self.processing = True
+        print(f"[{self.camera_id}] 开始分析视频片段")
         try:
-            self.processing = True
-            print("开始分析视频片段")
-
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-            result = loop.run_until_complete(
+            future = self.scheduler.submit(
                 self.analyzer.analyze(frames, self.fps, timestamps)
             )
-            
-            # --- 旧的预警系统逻辑已由 multi_modal_analyzer 接管 ---
-            # --- 下方的代码块将被注释掉或移除 ---
-            
-            # current_time = datetime.now()
-            
-            # # 定义允许触发预警的活动类型
-            # allowed_activities = {
-            #     "睡觉", "玩手机", "喝饮料", "喝水", "吃东西", "专注工作学习",
-            #     "发现明火", "人员聚集", "打架斗殴"
-            # }
-
-            # # 如果结果是字符串且不是"正常"
-            # if isinstance(result, str) and result and result != "正常":
-            #     # 尝试从结果中提取行为 (假设格式为 "时间 情况")
-            #     parts = result.split()
-            #     behavior = parts[-1] if len(parts) > 1 else result # 获取最后一个词作为行为
-                
-            #     # 检查提取的行为是否在允许列表中
-            #     if behavior in allowed_activities:
-            #         logging.info(f"检测到允许的活动: {behavior}")
-            #         # 此处原有的活动持续时间判断和 alert_queue.put(alert) 逻辑
-            #         # 已全部转移到 multi_modal_analyzer.py 中实现
-            #     else:
-            #         # 如果检测到的行为不在允许列表中，记录日志但不生成预警
-            #         logging.info(f"检测到非预警活动: {behavior} (原始结果: {result})，不生成预警。")
-
-            # elif self.current_activity is not None:
-            #     # 检查是否需要结束当前活动 (即使当前检测为'正常'或非允许活动)
-            #     # 此部分逻辑也已转移
-            #     pass
-
-            loop.close()
+            future.add_done_callback(self._on_analysis_done)
+        except Exception as e:
+            logging.error(f"[{self.camera_id}] 提交分析任务失败: {e}")
+            self.processing = False
 
+    def _on_analysis_done(self, future):
+        """分析任务完成回调"""
+        try:
+            future.result()
         except Exception as e:
-            logging.error(f"分析错误: {e}")
-            import traceback
-            traceback.print_exc()
+            logging.error(f"[{self.camera_id}] 分析错误: {e}", exc_info=True)
         finally:
             self.processing = False
 
@@ -304,68 +271,18 @@ class VideoProcessor:
         #     self.last_activity_time = None
 
     async def video_streamer(self, websocket):
-        while True:
-            try:
-                if websocket.client_state == WebSocketState.DISCONNECTED:
-                    logging.info("WebSocket已断开连接")
-                    break
-                
-                if self.frame_queue.empty():
-                    await asyncio.sleep(0.1)
-                    continue
-                
-                frame = self.frame_queue.get_nowait()
-                await websocket.send_bytes(frame)
-            except Exception as e:
-                logging.error(f"视频流发送错误: {e}")
-                break
-
-    async def _process_alerts(self):
-        """处理警报消息"""
-        while self.running:
-            try:
+        """订阅帧广播并推送最新帧，发送慢时只会跳过本连接的中间帧"""
+        async with self.frame_hub.subscribe() as subscription:
+            while True:
                 try:
-                    alert = self.alert_queue.get_nowait()
-                    await self.send_alert(alert)
-                except queue.Empty:
-                    await asyncio.sleep(0.1)
-            except Exception as e:
-                logging.error(f"警报处理错误: {e}")
-                await asyncio.sleep(1)
-
-    async def send_alert(self, alert):
-        """发送预警信息"""
-        try:
-            from video_server import recent_alerts, active_connections, MAX_ALERTS
-
-            print(f"准备发送预警: {alert}")
-            print(f"当前有 {len(active_connections)} 个活跃连接")
-
-            recent_alerts.append(alert)
-            if len(recent_alerts) > MAX_ALERTS:
-                recent_alerts.pop(0)
-
-            disconnected = []
-            for i, connection in enumerate(active_connections):
-                try:
-                    if connection.client_state == WebSocketState.CONNECTED:
-                        print(f"发送到连接 {i + 1}/{len(active_connections)}")
-                        await connection.send_json(alert)
-                        print(f"发送成功")
-                    else:
-                        print(f"连接 {i + 1} 状态不是CONNECTED，而是: {connection.client_state}")
-                        disconnected.append(connection)
+                    frame = await subscription.get()
+                    if websocket.client_state == WebSocketState.DISCONNECTED:
+                        logging.info("WebSocket已断开连接")
+                        break
+                    await websocket.send_bytes(frame)
                 except Exception as e:
-                    print(f"发送到连接 {i + 1} 失败: {e}")
-                    disconnected.append(connection)
-
-            for conn in disconnected:
-                if conn in active_connections:
-                    active_connections.remove(conn)
-                    print(f"移除断开的连接，剩余 {len(active_connections)} 个")
-        except Exception as e:
-            print(f"警报发送过程错误: {e}")
-            logging.error(f"警报发送错误: {e}")
+                    logging.error(f"视频流发送错误: {e}")
+                    break
 
     def detect_activity(self, frame: np.ndarray) -> bool:
         """检测画面中的活动"""
@@ -398,25 +315,17 @@ class VideoProcessor:
             return {
                 'timestamp': current_time.strftime('%Y年%m月%d日%H点%M分'),
                 'content': f"监控显示：{current_time.strftime('%Y年%m月%d日%H点%M分')}，检测到{activity_type}",
-                'frames': self.analysis_frames[-int(VideoConfig.BUFFER_DURATION):]
+                'frames': self.analysis_buffer.snapshot_frames(int(VideoConfig.BUFFER_DURATION))[0]
             }
         return None
 
-    def clean_buffer(self, current_time: datetime):
-        """清理过期的帧"""
-        max_frames = int(VideoConfig.BUFFER_DURATION)
-        if len(self.analysis_frames) > max_frames:
-            self.analysis_frames = self.analysis_frames[-max_frames:]
-            self.analysis_timestamps = self.analysis_timestamps[-max_frames:]
-
     async def get_frame_and_behavior(self):
         """获取视频帧"""
         try:
-            # 获取当前帧
-            with self.display_lock:
-                if self.display_frame is None:
-                    return None
-                frame = self.display_frame.copy()
+            # 获取当前帧的只读视图
+            frame = self.display_buffer.latest()
+            if frame is None:
+                return None
 
             # 编码视频帧
             _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, VideoConfig.JPEG_QUALITY])
@@ -450,17 +359,8 @@ class VideoProcessor:
             object_key = f"{OSSConfig.ALERT_PREFIX}alert_{int(time.time())}.jpg"
         
         try:
-            # 创建OSS连接
-            auth = oss2.Auth(OSSConfig.ACCESS_KEY_ID, OSSConfig.ACCESS_KEY_SECRET)
-            bucket = oss2.Bucket(auth, OSSConfig.ENDPOINT, OSSConfig.BUCKET)
-            
-            # 编码图像并上传
-            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, VideoConfig.JPEG_QUALITY])
-            bucket.put_object(object_key, buffer.tobytes())
-            
-            # 生成URL
-            url = f"https://{OSSConfig.BUCKET}.{OSSConfig.ENDPOINT}/{object_key}"
-            return url
+            # 编码图像并通过共享上传服务上传 (复用连接池，失败自动重试)
+            return oss_uploader.put_frame(image, object_key)
         except Exception as e:
             # 不再回退到本地存储，直接抛出异常
             logging.error(f"上传到OSS失败: {e}")
@@ -469,7 +369,7 @@ class VideoProcessor:
     async def _add_to_vector_db(self, alert, event_timestamp: str):
         """将预警信息添加到向量数据库"""
         try:
-            import httpx
+            from llm_service import http_gateway
             
             # 检查alert内容是否为系统错误等，避免存入数据库
             # （在 _run_analysis 中已过滤，这里可作为双重保险，但暂时省略）
@@ -488,21 +388,74 @@ class VideoProcessor:
             if 'start_time' in alert and 'end_time' in alert:
                 alert_text += f"，从{alert['start_time']}持续到{alert['end_time']}，共{alert.get('duration_minutes', 0)}分钟"
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    RAGConfig.VECTOR_API_URL,
-                    json={
-                        "docs": [alert_text],
-                        "table_name": f"alert_{int(time.time())}",
-                        "event_timestamps": [event_timestamp]
-                    },
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    logging.info(f"预警信息已添加到向量数据库: {alert_text}")
-                else:
-                    logging.error(f"添加到向量数据库失败: {response.text}")
+            response = await http_gateway.post(
+                RAGConfig.VECTOR_API_URL,
+                json={
+                    "docs": [alert_text],
+                    "table_name": f"alert_{int(time.time())}",
+                    "event_timestamps": [event_timestamp]
+                },
+                timeout=10.0
+            )
+            
+            if response.status_code == 200:
+                logging.info(f"预警信息已添加到向量数据库: {alert_text}")
+            else:
+                logging.error(f"添加到向量数据库失败: {response.text}")
         except Exception as e:
             logging.error(f"添加预警到向量数据库出错: {e}")
 
+
+class VideoProcessorPool:
+    """多路摄像头处理器池
+
+    每个视频源拥有独立的采集线程，所有摄像头共享同一个分析调度器、
+    预警总线以及全局数据库实例 (video_db)。
+    """
+
+    def __init__(self, sources: Dict[str, Union[int, str]],
+                 scheduler: Optional[AnalysisScheduler] = None,
+                 alert_bus: Optional[AlertBus] = None):
+        if not sources:
+            raise ValueError("至少需要一个视频源")
+        self.alert_bus = alert_bus or default_alert_bus
+        self.scheduler = scheduler or analysis_scheduler
+        self.processors: Dict[str, VideoProcessor] = {}
+        for camera_id, source in sources.items():
+            self.processors[camera_id] = VideoProcessor(
+                source,
+                camera_id=camera_id,
+                alert_bus=self.alert_bus,
+                scheduler=self.scheduler
+            )
+        self.default_camera_id = next(iter(self.processors))
+
+    @property
+    def default(self) -> VideoProcessor:
+        return self.processors[self.default_camera_id]
+
+    @property
+    def camera_ids(self) -> List[str]:
+        return list(self.processors.keys())
+
+    def get(self, camera_id: Optional[str] = None) -> Optional[VideoProcessor]:
+        """按摄像头ID获取处理器，未指定时返回默认摄像头"""
+        if camera_id is None:
+            return self.default
+        return self.processors.get(camera_id)
+
+    async def start(self):
+        """启动所有摄像头的处理"""
+        self.scheduler.start()
+        self.alert_bus.bind(asyncio.get_running_loop())
+        for processor in self.processors.values():
+            asyncio.create_task(processor.start_processing())
+        logging.info(f"已启动 {len(self.processors)} 路视频处理: {self.camera_ids}")
+
+    async def stop(self):
+        """停止所有摄像头的处理"""
+        await asyncio.gather(
+            *(processor.stop_processing() for processor in self.processors.values()),
+            return_exceptions=True
+        )
+        self.scheduler.stop()
@@ -18,7 +18,13 @@ from config import VideoConfig, ServerConfig, VIDEO_SOURCE, LOG_CONFIG, ARCHIVE_
 import os
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from video_processor import VideoProcessor
+from video_processor import VideoProcessor, VideoProcessorPool
+from utility import keyframe_stats
+from oss_uploader import oss_uploader
+from alert_bus import alert_bus
+from alert_store import alert_store
+from export_stream import EXPORT_MEDIA_TYPES, PARQUET_AVAILABLE, export_tracker, stream_export
+from llm_cache import description_cache
 import queue
 from pydantic import BaseModel
 
@@ -32,7 +38,7 @@ logging.basicConfig(
 # 解析命令行参数
 def parse_args():
     parser = argparse.ArgumentParser(description='智能视频监控系统')
-    parser.add_argument('--video_source', type=str, help='视频源路径')
+    parser.add_argument('--video_source', type=str, help='视频源路径，多路摄像头用逗号分隔，可写作 摄像头ID=视频源')
     parser.add_argument('--video_interval', type=int, help='视频分段时长(秒)')
     parser.add_argument('--analysis_interval', type=int, help='分析间隔(秒)')
     parser.add_argument('--buffer_duration', type=int, help='滑窗分析时长')
@@ -65,17 +71,41 @@ def get_video_source(source):
         # 如果不是整数，则视为文件路径
         return source
 
-# 初始化视频源
-video_source = get_video_source(args.get('video_source'))
+def parse_video_sources(source) -> Dict[str, Any]:
+    """解析视频源列表，返回 {摄像头ID: 视频源}
 
-# 创建视频处理器
+    例如 "0,1,door=rtsp_door.mp4" -> {"cam0": 0, "cam1": 1, "door": "rtsp_door.mp4"}
+    """
+    if source is None:
+        return {"cam0": VIDEO_SOURCE}
+
+    import re
+    sources = {}
+    for index, entry in enumerate(str(source).split(',')):
+        entry = entry.strip()
+        if not entry:
+            continue
+        camera_id = f"cam{index}"
+        match = re.match(r'^(\w+)=(.+)$', entry)
+        if match:
+            camera_id, entry = match.group(1), match.group(2).strip()
+        if camera_id in sources:
+            raise ValueError(f"摄像头ID重复: {camera_id}")
+        sources[camera_id] = get_video_source(entry)
+    return sources
+
+# 创建多路视频处理器池
 try:
-    video_processor = VideoProcessor(video_source)
+    video_sources = parse_video_sources(args.get('video_source'))
+    video_pool = VideoProcessorPool(video_sources)
 except ValueError as e:
     print(f"错误: {e}")
     import sys
     sys.exit(1)
 
+# 默认摄像头的处理器 (兼容单路摄像头的调用方)
+video_processor = video_pool.default
+
 # 创建FastAPI应用
 app = FastAPI(title="智能视频监控系统")
 
@@ -93,12 +123,12 @@ os.makedirs("video_warning", exist_ok=True)
 os.makedirs(ARCHIVE_DIR, exist_ok=True)
 
 # 全局变量
-active_connections: List[WebSocket] = [] # 添加类型提示
-MAX_ALERTS = 10
-recent_alerts: deque = deque(maxlen=MAX_ALERTS) # 再使用 deque 并设置最大长度
+MAX_ALERTS = ServerConfig.MAX_RECENT_ALERTS
+recent_alerts: deque = alert_bus.recent  # 最近预警由预警总线维护
+alert_bus.add_listener(alert_store.append)  # 去重后的预警持久化到SQLite，供导出按时间范围查询
 
-# 添加自定义预警规则存储
-custom_alert_rules = []
+# 自定义预警规则存储 (进程内注册表，持久化到SQLite，与分析器共享)
+from alert_rule_store import rule_store
 
 # 初始化系统预设规则（基于activity_configs）
 def init_default_alert_rules():
@@ -184,9 +214,9 @@ def init_default_alert_rules():
         }
     ]
     
-    # 添加到全局规则列表
-    custom_alert_rules.extend(default_rules)
-    logging.info(f"初始化了{len(default_rules)}个系统预设规则")
+    # 写入规则注册表 (已存在的系统规则保留用户的修改)
+    added_count = rule_store.ensure_defaults(default_rules)
+    logging.info(f"初始化了{added_count}个系统预设规则，当前共{len(rule_store.snapshot())}条规则")
 
 # 在应用启动时初始化预设规则
 init_default_alert_rules()
@@ -215,9 +245,8 @@ async def startup():
     # video_server.py 不再需要关心向量模型的初始化。
     
     # 直接启动视频处理和警报处理
-    print("📹 启动视频处理服务...")
-    asyncio.create_task(video_processor.start_processing())
-    asyncio.create_task(alert_handler())
+    print(f"📹 启动视频处理服务 ({len(video_pool.processors)} 路摄像头)...")
+    await video_pool.start()
     
     # 等待视频服务稳定启动
     await asyncio.sleep(1)
@@ -227,71 +256,89 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    await video_processor.stop_processing()
-
-@app.websocket("/video_feed")
-async def video_feed(websocket: WebSocket):
+    await video_pool.stop()
+
+async def stream_camera(websocket: WebSocket, camera_id: Optional[str]):
+    """向视频流连接推送指定摄像头的画面"""
+    processor = video_pool.get(camera_id)
+    if processor is None:
+        await websocket.close(code=1008)
+        return
     await websocket.accept()
-    active_connections.append(websocket)
-    video_processor.start_push_queue = 1
     try:
-        await video_processor.video_streamer(websocket)
+        await processor.video_streamer(websocket)
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
     except Exception as e:
-        logging.error(f"Video feed error: {e}")
-        if websocket in active_connections:
-            active_connections.remove(websocket)
-    finally:
-        video_processor.start_push_queue = 0
+        logging.error(f"Video feed error [{processor.camera_id}]: {e}")
+
+@app.websocket("/video_feed")
+async def video_feed(websocket: WebSocket):
+    await stream_camera(websocket, None)
+
+@app.websocket("/video_feed/{camera_id}")
+async def camera_video_feed(websocket: WebSocket, camera_id: str):
+    await stream_camera(websocket, camera_id)
 
 @app.websocket("/alerts")
-async def alerts(websocket: WebSocket):
+async def alerts(websocket: WebSocket, camera_id: Optional[str] = None):
     await websocket.accept()
-    active_connections.append(websocket)
-    
-    # 为每个连接维护一个已发送预警ID集合
-    connection_sent_alerts = set()
-    
-    try:
-        # 发送已有的预警，但确保不重复
-        if recent_alerts:
-            for alert in recent_alerts:
-                # 提取预警的唯一标识
-                alert_key = alert.get("alert_key")
-                if not alert_key:
-                    # 如果没有alert_key，根据内容和时间戳生成一个更可靠的后备key
-                    timestamp = alert.get("timestamp", "")
-                    content = alert.get("content", "")
-                    # 移除可能为空的 start/end time，避免它们引起不一致
-                    alert_key = f"{content}_{timestamp}"
-                
-                if alert_key not in connection_sent_alerts:
-                    await websocket.send_json(alert)
-                    connection_sent_alerts.add(alert_key)
-                    
-                    # 限制sent_alerts大小
-                    if len(connection_sent_alerts) > 100:
-                        connection_sent_alerts = set(list(connection_sent_alerts)[-100:])
-        
-        # 保持连接
+
+    async def wait_disconnect():
+        # 读取客户端消息以及时发现断开
         while True:
-            await asyncio.sleep(60)
-    except WebSocketDisconnect:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
-    except Exception as e:
-        logging.error(f"Alert WebSocket error: {e}")
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    # 订阅时放入最近预警，之后由总线实时投递到本连接的发件箱
+    async with alert_bus.subscribe(camera_id) as subscription:
+        tasks = [
+            asyncio.create_task(subscription.deliver(websocket.send_json)),
+            asyncio.create_task(wait_disconnect())
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error and not isinstance(error, WebSocketDisconnect):
+                    logging.error(f"Alert WebSocket error: {error}")
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
 @app.get("/api/alerts")
-async def get_alerts_api(): # 修改函数名以示区分
+async def get_alerts_api(camera_id: Optional[str] = None): # 修改函数名以示区分
     # 注意：现在 recent_alerts 是 deque
     return {
         "status": "success",
-        "alerts": list(recent_alerts) # 返回列表
+        "alerts": alert_bus.get_recent(camera_id) # 返回列表
+    }
+
+@app.get("/api/cameras")
+async def get_cameras():
+    """获取所有摄像头及分析调度器状态"""
+    return {
+        "status": "success",
+        "default_camera_id": video_pool.default_camera_id,
+        "cameras": [
+            {
+                "camera_id": camera_id,
+                "video_source": str(processor.video_source),
+                "running": processor.running,
+                "analyzing": processor.processing,
+                "viewers": processor.frame_hub.subscriber_count,
+                "motion_gate": processor.motion_gate.get_stats()
+            }
+            for camera_id, processor in video_pool.processors.items()
+        ],
+        "scheduler": video_pool.scheduler.get_stats(),
+        "keyframes": dict(keyframe_stats),
+        "uploads": oss_uploader.get_stats(),
+        "llm_cache": description_cache.get_stats(),
+        "alert_bus": alert_bus.get_stats(),
+        "alert_store": alert_store.get_stats()
     }
 
 # @app.get("/test_alert")
@@ -300,112 +347,6 @@ async def get_alerts_api(): # 修改函数名以示区分
 #     # 注释掉测试预警接口，防止产生测试信息
 #     pass
 
-async def alert_handler():
-    """处理警报消息"""
-    # 用于跟踪已处理的预警
-    processed_alerts = set()
-    
-    while True:
-        try:
-            alert_processed = False  # 标记本轮是否处理了预警
-            
-            # 检查预警队列
-            if hasattr(video_processor, 'alert_queue') and not video_processor.alert_queue.empty():
-                try:
-                    alert = video_processor.alert_queue.get_nowait()
-                    
-                    # 提取预警的唯一标识
-                    alert_key = alert.get("alert_key")
-                    if not alert_key:
-                        # 如果没有alert_key，根据内容和时间戳生成一个更可靠的后备key
-                        timestamp = alert.get("timestamp", "")
-                        content = alert.get("content", "")
-                        # 移除可能为空的 start/end time，避免它们引起不一致
-                        alert_key = f"{content}_{timestamp}"
-                    
-                    # 检查是否已经处理过这个预警
-                    if alert_key in processed_alerts:
-                        logging.info(f"预警已处理，跳过: {alert_key}")
-                        continue  # 跳过已处理的预警
-                    
-                    # 标记此预警已处理
-                    processed_alerts.add(alert_key)
-                    
-                    # 限制processed_alerts的大小，避免内存无限增长
-                    if len(processed_alerts) > 100:  # 保留最近100个预警记录
-                        processed_alerts = set(list(processed_alerts)[-100:])
-                    
-                    # 简化去重检查 - 只检查alert_key，避免遍历整个recent_alerts
-                    duplicate = False
-                    # 只检查最近的几个预警，提高效率
-                    check_count = min(10, len(recent_alerts))
-                    for i in range(check_count):
-                        existing_alert = recent_alerts[-(i+1)]  # 从最新的开始检查
-                        existing_key = existing_alert.get("alert_key")
-                        if existing_key and existing_key == alert_key:
-                            duplicate = True
-                            break
-                    
-                    if not duplicate:
-                        # 添加到最近预警 (deque 自动处理)
-                        recent_alerts.append(alert)
-                    
-                    # 实时发送给所有连接
-                    disconnected = []
-                    sent_count = 0
-                    
-                    # 逐个发送，避免批量发送时的连接状态问题
-                    for connection in list(active_connections):  # 使用列表副本防止迭代时修改
-                        try:
-                            # 更严格的连接状态检查
-                            if (hasattr(connection, 'client_state') and 
-                                connection.client_state == WebSocketState.CONNECTED):
-                                await connection.send_json(alert)
-                                sent_count += 1
-                            else:
-                                disconnected.append(connection)
-                        except Exception as e:
-                            logging.warning(f"发送预警到连接失败: {e}")
-                            disconnected.append(connection)
-                    
-                    # 清理断开的连接
-                    for conn in disconnected:
-                        if conn in active_connections:
-                            active_connections.remove(conn)
-                            logging.info(f"移除了断开的连接，剩余连接数: {len(active_connections)}")
-                    
-                    if sent_count > 0:
-                        alert_type = alert.get('type', 'standard')
-                        is_custom = alert.get('is_custom', False)
-                        logging.info(f"📤 预警已发送到 {sent_count} 个活跃连接: [{alert_type}] {alert.get('content', 'Unknown')}")
-                        # 如果是自定义预警，添加额外的调试信息
-                        if is_custom or 'custom' in alert_type:
-                            logging.info(f"🔧 自定义预警详情: type={alert_type}, level={alert.get('level')}, is_custom={is_custom}")
-                        print(f"📤 预警发送成功: {alert.get('content', 'Unknown')}, 类型: {alert_type}")
-                    else:
-                        alert_type = alert.get('type', 'standard')
-                        logging.info(f"📥 预警已添加到队列，但无活跃连接: {alert.get('content', 'Unknown')}")
-                        print(f"📥 预警无活跃连接: {alert.get('content', 'Unknown')}, 类型: {alert_type}")
-
-                    alert_processed = True  # 标记已处理预警
-
-                except queue.Empty:
-                    pass # 队列为空，正常情况
-                except Exception as e: # 捕获处理单个警报时的其他异常
-                    logging.error(f"处理单个警报时出错: {e}")
-            
-        except Exception as e:
-            logging.error(f"Alert handler 主循环错误: {e}")
-        finally:
-             # 只有在没有处理预警时才休眠，避免不必要的延迟
-             if not alert_processed:
-                 await asyncio.sleep(0.05)  # 减少空转时的休眠时间到50毫秒
-             else:
-                 # 如果处理了预警，只做极短暂的让出，让其他协程有机会运行
-                 await asyncio.sleep(0.001)  # 1毫秒的极短暂让出
-
-
-
 # 添加行为数据API端点
 @app.get("/api/behavior-data")
 async def get_behavior_data():
@@ -437,7 +378,7 @@ async def add_custom_alert_rule(request: AlertRuleRequest):
             return {"status": "error", "message": "规则名称和条件不能为空"}
         
         # 检查是否已存在同名规则
-        for existing_rule in custom_alert_rules:
+        for existing_rule in rule_store.snapshot():
             if existing_rule.get('name') == request.name and not existing_rule.get('is_system_rule', False):
                 return {"status": "error", "message": f"规则名称 '{request.name}' 已存在，请使用不同的名称"}
         
@@ -467,17 +408,9 @@ async def add_custom_alert_rule(request: AlertRuleRequest):
         
         generated_prompt = await chat_completion(prompt)
         
-        # 智能ID分配：用户自定义规则从1000开始，避免与系统预设规则（1-999）冲突
-        max_user_id = 999  # 系统规则使用1-999
-        for rule in custom_alert_rules:
-            if not rule.get('is_system_rule', False) and rule.get('id', 0) > max_user_id:
-                max_user_id = rule['id']
-        
-        new_id = max_user_id + 1
-        
         # 构建完整的规则对象
+        # ID由注册表分配：用户自定义规则从1000开始，避免与系统预设规则（1-999）冲突
         rule = {
-            "id": new_id,
             "name": request.name,
             "condition": request.condition,
             "level": request.level,
@@ -487,9 +420,9 @@ async def add_custom_alert_rule(request: AlertRuleRequest):
             "created_at": datetime.now().isoformat()
         }
         
-        custom_alert_rules.append(rule)
+        rule = rule_store.add(rule)
         
-        logging.info(f"添加自定义预警规则: {rule['name']} (ID: {new_id})")
+        logging.info(f"添加自定义预警规则: {rule['name']} (ID: {rule['id']}, 版本: {rule_store.version})")
         
         return {
             "status": "success",
@@ -506,32 +439,25 @@ async def get_custom_alert_rules():
     """获取所有自定义预警规则"""
     return {
         "status": "success",
-        "rules": custom_alert_rules
+        "rules": rule_store.list_rules(),
+        "version": rule_store.version
     }
 
 @app.put("/api/custom-alert-rules/{rule_id}")
 async def update_custom_alert_rule(rule_id: int, request: AlertRuleUpdate):
     """更新自定义预警规则"""
     try:
-        # 查找规则
-        rule_index = None
-        for i, rule in enumerate(custom_alert_rules):
-            if rule["id"] == rule_id:
-                rule_index = i
-                break
-        
-        if rule_index is None:
-            return {"status": "error", "message": "规则不存在"}
-        
         # 更新规则
         update_data = request.dict(exclude_unset=True)
-        custom_alert_rules[rule_index].update(update_data)
-        custom_alert_rules[rule_index]["updated_at"] = datetime.now().isoformat()
+        rule = rule_store.update(rule_id, update_data)
+        
+        if rule is None:
+            return {"status": "error", "message": "规则不存在"}
         
         return {
             "status": "success",
             "message": "规则更新成功",
-            "rule": custom_alert_rules[rule_index]
+            "rule": rule
         }
         
     except Exception as e:
@@ -543,14 +469,13 @@ async def delete_custom_alert_rule(rule_id: int):
     """删除自定义预警规则"""
     try:
         # 查找并删除规则
-        for i, rule in enumerate(custom_alert_rules):
-            if rule["id"] == rule_id:
-                deleted_rule = custom_alert_rules.pop(i)
-                logging.info(f"删除自定义预警规则: {deleted_rule['name']}")
-                return {
-                    "status": "success",
-                    "message": "规则删除成功"
-                }
+        deleted_rule = rule_store.delete(rule_id)
+        if deleted_rule is not None:
+            logging.info(f"删除自定义预警规则: {deleted_rule['name']}")
+            return {
+                "status": "success",
+                "message": "规则删除成功"
+            }
         
         return {"status": "error", "message": "规则不存在"}
         
@@ -562,13 +487,13 @@ async def delete_custom_alert_rule(rule_id: int):
 async def cleanup_duplicate_rules():
     """清理重复的自定义预警规则"""
     try:
-        global custom_alert_rules
+        current_rules = rule_store.list_rules()
         
         # 按名称分组，保留最新的规则
         rules_by_name = {}
         system_rules = []
         
-        for rule in custom_alert_rules:
+        for rule in current_rules:
             if rule.get('is_system_rule', False):
                 system_rules.append(rule)
             else:
@@ -585,10 +510,10 @@ async def cleanup_duplicate_rules():
         
         # 重新构建规则列表
         cleaned_user_rules = list(rules_by_name.values())
-        original_count = len(custom_alert_rules)
+        original_count = len(current_rules)
         
-        custom_alert_rules = system_rules + cleaned_user_rules
-        new_count = len(custom_alert_rules)
+        rule_store.replace_all(system_rules + cleaned_user_rules)
+        new_count = len(rule_store.snapshot())
         
         removed_count = original_count - new_count
         
@@ -605,152 +530,128 @@ async def cleanup_duplicate_rules():
         logging.error(f"清理重复规则失败: {e}")
         return {"status": "error", "message": str(e)}
 
+def resolve_export_range(timeRange: str, startDate: str = None, endDate: str = None):
+    """把导出接口的时间范围参数转换为 (开始, 结束) 时间字符串"""
+    from datetime import timedelta
+    time_format = '%Y-%m-%d %H:%M:%S'
+    now = datetime.now()
+    if timeRange == "today":
+        start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif timeRange == "week":
+        start_time = now - timedelta(days=7)
+    elif timeRange == "month":
+        start_time = now - timedelta(days=30)
+    elif timeRange == "custom" and startDate and endDate:
+        start = datetime.fromisoformat(startDate)
+        end = datetime.fromisoformat(endDate)
+        if len(endDate) <= 10:
+            # 只给出日期时包含结束当天
+            end = end.replace(hour=23, minute=59, second=59)
+        return start.strftime(time_format), end.strftime(time_format)
+    else:
+        start_time = now - timedelta(days=1)
+    return start_time.strftime(time_format), now.strftime(time_format)
+
+ALERT_EXPORT_FIELDS = ["时间", "摄像头", "类型", "内容", "级别", "详情"]
+
 @app.get("/api/export/alerts")
 async def export_alerts(timeRange: str = "today", format: str = "csv", 
-                       startDate: str = None, endDate: str = None):
-    """导出预警记录"""
+                       startDate: str = None, endDate: str = None,
+                       camera_id: Optional[str] = None):
+    """导出预警记录 (支持 csv / json / ndjson，按时间范围流式扫描)"""
     try:
-        from datetime import datetime, timedelta
-        import csv
-        import json
-        from io import StringIO
         from fastapi.responses import StreamingResponse
         
-        # 确定时间范围
-        now = datetime.now()
-        if timeRange == "today":
-            start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_time = now
-        elif timeRange == "week":
-            start_time = now - timedelta(days=7)
-            end_time = now
-        elif timeRange == "month":
-            start_time = now - timedelta(days=30)
-            end_time = now
-        elif timeRange == "custom" and startDate and endDate:
-            start_time = datetime.fromisoformat(startDate)
-            end_time = datetime.fromisoformat(endDate)
-        else:
-            start_time = now - timedelta(days=1)
-            end_time = now
-        
-        # 获取预警数据（这里使用recent_alerts作为示例）
-        alerts_data = []
-        for alert in recent_alerts:
-            alert_time = datetime.fromisoformat(alert.get("timestamp", ""))
-            if start_time <= alert_time <= end_time:
-                alerts_data.append({
+        if format not in ("csv", "json", "ndjson"):
+            return {"status": "error", "message": "不支持的导出格式"}
+        start_time, end_time = resolve_export_range(timeRange, startDate, endDate)
+        job = export_tracker.start(f"alerts_{timeRange}", format)
+        
+        def rows():
+            for alert in alert_store.iter_range(start_time, end_time, camera_id=camera_id):
+                yield {
                     "时间": alert.get("timestamp", ""),
+                    "摄像头": alert.get("camera_id", ""),
                     "类型": alert.get("type", ""),
                     "内容": alert.get("content", ""),
                     "级别": alert.get("level", ""),
                     "详情": alert.get("details", "")
-                })
-        
-        if format == "csv":
-            output = StringIO()
-            if alerts_data:
-                fieldnames = alerts_data[0].keys()
-                writer = csv.DictWriter(output, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(alerts_data)
-            
-            response = StreamingResponse(
-                iter([output.getvalue()]),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename=alerts_{timeRange}.csv"}
-            )
-        elif format == "json":
-            json_data = json.dumps(alerts_data, ensure_ascii=False, indent=2)
-            response = StreamingResponse(
-                iter([json_data]),
-                media_type="application/json",
-                headers={"Content-Disposition": f"attachment; filename=alerts_{timeRange}.json"}
-            )
-        else:
-            return {"status": "error", "message": "不支持的导出格式"}
+                }
         
-        return response
+        # 同步生成器由 StreamingResponse 在线程池中迭代，不阻塞事件循环
+        return StreamingResponse(
+            export_tracker.track(job, stream_export(export_tracker.count_rows(job, rows()), format, ALERT_EXPORT_FIELDS)),
+            media_type=EXPORT_MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f"attachment; filename=alerts_{timeRange}.{format}",
+                "X-Export-Id": job.id
+            }
+        )
         
     except Exception as e:
         logging.error(f"导出预警记录失败: {e}")
         return {"status": "error", "message": str(e)}
 
+BEHAVIOR_EXPORT_FIELDS = ["ID", "活动类型", "内容描述", "开始时间", "结束时间", "持续时间(分钟)", "置信度", "来源类型"]
+BEHAVIOR_EXPORT_TYPES = {"ID": int, "持续时间(分钟)": float, "置信度": float}
+
 @app.get("/api/export/behavior")
 async def export_behavior_data(timeRange: str = "today", format: str = "csv",
                               startDate: str = None, endDate: str = None):
-    """导出行为数据"""
+    """导出行为数据 (支持 csv / json / ndjson / parquet，按 (start_time, id) 分页流式导出)"""
     try:
-        from datetime import datetime, timedelta
-        import csv
-        import json
-        from io import StringIO
         from fastapi.responses import StreamingResponse
         from video_database import video_db
         
-        # 确定时间范围
-        now = datetime.now()
-        if timeRange == "today":
-            start_time = now.replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
-            end_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        elif timeRange == "week":
-            start_time = (now - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-            end_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        elif timeRange == "month":
-            start_time = (now - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-            end_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        elif timeRange == "custom" and startDate and endDate:
-            start_time = f"{startDate} 00:00:00"
-            end_time = f"{endDate} 23:59:59"
-        else:
-            start_time = (now - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
-            end_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 从数据库获取行为数据
-        activities = video_db.get_activities_by_time_range(start_time, end_time)
-        
-        behavior_data = []
-        for activity in activities:
-            behavior_data.append({
-                "ID": activity.get("id", ""),
-                "活动类型": activity.get("activity_type", ""),
-                "内容描述": activity.get("content", ""),
-                "开始时间": activity.get("start_time", ""),
-                "结束时间": activity.get("end_time", ""),
-                "持续时间(分钟)": activity.get("duration_minutes", 0),
-                "置信度": activity.get("confidence_score", 0),
-                "来源类型": activity.get("source_type", "")
-            })
-        
-        if format == "csv":
-            output = StringIO()
-            if behavior_data:
-                fieldnames = behavior_data[0].keys()
-                writer = csv.DictWriter(output, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(behavior_data)
-            
-            response = StreamingResponse(
-                iter([output.getvalue()]),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename=behavior_{timeRange}.csv"}
-            )
-        elif format == "json":
-            json_data = json.dumps(behavior_data, ensure_ascii=False, indent=2)
-            response = StreamingResponse(
-                iter([json_data]),
-                media_type="application/json",
-                headers={"Content-Disposition": f"attachment; filename=behavior_{timeRange}.json"}
-            )
-        else:
+        if format not in EXPORT_MEDIA_TYPES:
             return {"status": "error", "message": "不支持的导出格式"}
+        if format == "parquet" and not PARQUET_AVAILABLE:
+            return {"status": "error", "message": "导出Parquet需要安装 pyarrow"}
+        start_time, end_time = resolve_export_range(timeRange, startDate, endDate)
+        
+        # 计数走索引，用于进度显示；计数在线程池中执行，不阻塞事件循环
+        total = await asyncio.to_thread(video_db.count_activities_by_time_range, start_time, end_time)
+        job = export_tracker.start(f"behavior_{timeRange}", format, total)
+        
+        def rows():
+            for activity in video_db.iter_activities_by_time_range(start_time, end_time):
+                yield {
+                    "ID": activity.get("id", ""),
+                    "活动类型": activity.get("activity_type", ""),
+                    "内容描述": activity.get("content", ""),
+                    "开始时间": activity.get("start_time", ""),
+                    "结束时间": activity.get("end_time", ""),
+                    "持续时间(分钟)": activity.get("duration_minutes", 0),
+                    "置信度": activity.get("confidence_score", 0),
+                    "来源类型": activity.get("source_type", "")
+                }
         
-        return response
+        # 同步生成器由 StreamingResponse 在线程池中迭代，分页查询与序列化都不在事件循环中执行
+        chunks = stream_export(export_tracker.count_rows(job, rows()), format,
+                               BEHAVIOR_EXPORT_FIELDS, BEHAVIOR_EXPORT_TYPES)
+        return StreamingResponse(
+            export_tracker.track(job, chunks),
+            media_type=EXPORT_MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f"attachment; filename=behavior_{timeRange}.{format}",
+                "X-Export-Id": job.id
+            }
+        )
         
     except Exception as e:
         logging.error(f"导出行为数据失败: {e}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/api/export/progress")
+async def get_export_progress(id: Optional[str] = None):
+    """查询导出进度与吞吐，未指定ID时返回进行中和最近完成的导出任务"""
+    if id:
+        job = export_tracker.get(id)
+        if job is None:
+            return {"status": "error", "message": "导出任务不存在"}
+        return {"status": "success", "export": job}
+    return {"status": "success", **export_tracker.get_stats()}
+
 @app.get("/api/system/status")
 async def get_system_status():
     """获取系统状态"""
@@ -762,15 +663,13 @@ async def get_system_status():
             "database": "online"
         }
         
-        # 检查视频处理器状态
-        if hasattr(video_processor, 'video_source'):
-            try:
-                # 简单检查视频源是否可用
-                status["videoStream"] = "online"
-            except:
-                status["videoStream"] = "offline"
-        else:
-            status["videoStream"] = "offline"
+        # 检查视频处理器状态 (任一摄像头在线即视为在线)
+        camera_status = {
+            camera_id: "online" if processor.running and processor.cap is not None and processor.cap.isOpened() else "offline"
+            for camera_id, processor in video_pool.processors.items()
+        }
+        status["videoStream"] = "online" if "online" in camera_status.values() else "offline"
+        status["cameras"] = camera_status
         
         # 检查数据库连接
         try:
@@ -0,0 +1,204 @@
+import logging
+
+try:
+    from langchain_chroma import Chroma
+except ImportError:
+    from langchain_community.vectorstores import Chroma
+
+from video_database import video_db, time_str_to_epoch
+
+VIDEO_CHROMA_DIR = "./video_chroma_db"
+# 集合随共享嵌入服务（int8 量化 ONNX 模型）改名，旧集合中 fp32 torch 模型生成的向量不能混用
+VIDEO_ACTIVITY_COLLECTION = "video_activities_gte"
+LEGACY_VIDEO_ACTIVITY_COLLECTION = "video_activities"
+VIDEO_DOCUMENT_COLLECTION = "video_documents_gte"
+LEGACY_VIDEO_DOCUMENT_COLLECTION = "langchain"  # 旧版未指定集合名时 langchain 使用的默认集合
+REEMBED_PAGE_SIZE = 256  # 迁移旧集合时每批重新嵌入的文档数
+# 集合元数据中的标记：旧向量已补写 start_time_epoch，之后启动不再全量扫描
+TIME_METADATA_BACKFILL_MARKER = "start_time_epoch_backfilled"
+# 集合元数据中的标记：已从该旧集合重新嵌入全部文档
+REEMBED_MARKER = "reembedded_from"
+
+
+def reembed_legacy_collection(store, legacy_name: str, page_size: int = REEMBED_PAGE_SIZE) -> int:
+    """把旧集合的文档用 store 当前的嵌入模型重新嵌入到 store 的集合中，返回迁移的文档数
+
+    只复制文档、元数据和ID，不复用旧向量；完成后在集合元数据中写入标记，只执行一次。
+    旧集合保留不删除，需要时可手动清理。
+    """
+    collection = store._collection
+    collection_metadata = dict(collection.metadata or {})
+    if collection_metadata.get(REEMBED_MARKER) == legacy_name:
+        return 0
+    try:
+        legacy = store._client.get_collection(legacy_name, embedding_function=None)
+    except Exception:
+        legacy = None
+
+    migrated = 0
+    offset = 0
+    while legacy is not None:
+        page = legacy.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = (page or {}).get('ids') or []
+        if not ids:
+            break
+        documents = page.get('documents') or [None] * len(ids)
+        metadatas = page.get('metadatas') or [None] * len(ids)
+        rows = [(doc_id, document, metadata) for doc_id, document, metadata in zip(ids, documents, metadatas)
+                if document]
+        if rows:
+            vectors = store.embeddings.embed_documents([document for _, document, _ in rows])
+            # Chroma 不接受 None 元数据，有/无元数据的文档分开写入；upsert 保证中断后重跑幂等
+            for with_metadata in (True, False):
+                part = [(row, vector) for row, vector in zip(rows, vectors) if bool(row[2]) == with_metadata]
+                if part:
+                    collection.upsert(
+                        ids=[row[0] for row, _ in part],
+                        embeddings=[vector for _, vector in part],
+                        documents=[row[1] for row, _ in part],
+                        metadatas=[row[2] for row, _ in part] if with_metadata else None
+                    )
+            migrated += len(rows)
+        offset += len(ids)
+    collection_metadata[REEMBED_MARKER] = legacy_name
+    collection.modify(metadata=collection_metadata)
+    if migrated:
+        logging.info(f"已将旧集合 {legacy_name} 的 {migrated} 条文档重新嵌入到 {collection.name}")
+    return migrated
+
+
+def open_document_store(embeddings, persist_directory: str = VIDEO_CHROMA_DIR):
+    """打开通用文档集合（/add_text、搜索接口使用），首次打开时从旧的默认集合重新嵌入"""
+    store = Chroma(
+        collection_name=VIDEO_DOCUMENT_COLLECTION,
+        embedding_function=embeddings,
+        persist_directory=persist_directory
+    )
+    try:
+        reembed_legacy_collection(store, LEGACY_VIDEO_DOCUMENT_COLLECTION)
+    except Exception as e:
+        logging.warning(f"迁移旧文档集合失败: {e}")
+    return store
+
+
+class VideoVectorManager:
+    """视频活动向量管理器，rag_server 与 rag_server_v2 共用，保证时间元数据和过滤条件一致"""
+
+    def __init__(self, embeddings, persist_directory: str = VIDEO_CHROMA_DIR):
+        self.vector_store = Chroma(
+            collection_name=VIDEO_ACTIVITY_COLLECTION,
+            embedding_function=embeddings,
+            persist_directory=persist_directory
+        )
+        try:
+            reembed_legacy_collection(self.vector_store, LEGACY_VIDEO_ACTIVITY_COLLECTION)
+        except Exception as e:
+            logging.warning(f"迁移旧视频活动向量集合失败: {e}")
+        try:
+            self.backfill_time_metadata()
+        except Exception as e:
+            logging.warning(f"补写视频活动向量时间元数据失败: {e}")
+
+    async def add_activity(self, activity_id, activity_data):
+        """添加活动到向量数据库"""
+        try:
+            # 构建文档内容
+            content = activity_data.get('content', '')
+            activity_type = activity_data.get('activity_type', '')
+            start_time = activity_data.get('start_time', '')
+
+            document_text = f"活动类型: {activity_type} 活动描述: {content} 时间: {start_time}"
+
+            # 构建元数据
+            metadata = {
+                "activity_id": activity_id,
+                "activity_type": activity_type,
+                "start_time": start_time,
+                "source_type": activity_data.get('source_type', 'video_analysis')
+            }
+            # 数值时间戳供向量查询按时间范围过滤
+            start_time_epoch = time_str_to_epoch(start_time)
+            if start_time_epoch is not None:
+                metadata["start_time_epoch"] = start_time_epoch
+
+            # 添加到向量数据库
+            self.vector_store.add_texts(
+                texts=[document_text],
+                metadatas=[metadata],
+                ids=[f"video_activity_{activity_id}"]
+            )
+            return True
+        except Exception as e:
+            logging.error(f"添加活动到向量数据库失败: {e}")
+            return False
+
+    def backfill_time_metadata(self, page_size=1000):
+        """为缺少 start_time_epoch 的旧向量补写数值时间元数据，使时间过滤能在向量库内完成
+
+        只需执行一次：完成后在集合元数据中写入标记，新写入的向量本身已带 start_time_epoch。
+        """
+        collection = self.vector_store._collection
+        collection_metadata = dict(collection.metadata or {})
+        if collection_metadata.get(TIME_METADATA_BACKFILL_MARKER):
+            return 0
+        updated = 0
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            ids = (page or {}).get('ids') or []
+            if not ids:
+                break
+            stale_ids, stale_metadatas = [], []
+            for doc_id, metadata in zip(ids, page.get('metadatas') or []):
+                if not metadata or 'start_time_epoch' in metadata:
+                    continue
+                epoch = time_str_to_epoch(metadata.get('start_time'))
+                if epoch is None:
+                    continue
+                stale_ids.append(doc_id)
+                stale_metadatas.append(dict(metadata, start_time_epoch=epoch))
+            if stale_ids:
+                collection.update(ids=stale_ids, metadatas=stale_metadatas)
+                updated += len(stale_ids)
+            offset += len(ids)
+        collection_metadata[TIME_METADATA_BACKFILL_MARKER] = True
+        collection.modify(metadata=collection_metadata)
+        if updated:
+            logging.info(f"已为 {updated} 条视频活动向量补写 start_time_epoch 元数据")
+        return updated
+
+    @staticmethod
+    def build_where(time_filter=None, activity_type=None):
+        """把时间/类型条件转换为 Chroma where 子句，时间按 start_time_epoch 数值比较"""
+        clauses = []
+        start_time_filter = (time_filter or {}).get("start_time") or {}
+        for op in ("$gte", "$lte"):
+            epoch = time_str_to_epoch(start_time_filter.get(op))
+            if epoch is not None:
+                clauses.append({"start_time_epoch": {op: epoch}})
+        if activity_type:
+            clauses.append({"activity_type": activity_type})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def search_activities(self, query, k=10, time_filter=None, activity_type=None):
+        """搜索活动，时间和类型条件下推到向量查询中过滤"""
+        try:
+            where = self.build_where(time_filter, activity_type)
+            return self.vector_store.similarity_search_with_score(query, k=k, filter=where)
+        except Exception as e:
+            logging.error(f"向量搜索失败: {e}")
+            return []
+
+    def search_activity_records(self, query, k=10, time_filter=None, activity_type=None):
+        """搜索活动并一次批量查询取回数据库记录，按相似度顺序返回"""
+        activity_ids = []
+        for doc, score in self.search_activities(query, k, time_filter, activity_type):
+            activity_id = doc.metadata.get('activity_id')
+            if activity_id is not None:
+                activity_ids.append(int(activity_id))
+        if not activity_ids:
+            return []
+        records = video_db.get_activities_by_ids(activity_ids)
+        return [records[activity_id] for activity_id in dict.fromkeys(activity_ids) if activity_id in records]